@@ -0,0 +1,120 @@
+#!/usr/bin/env python
+
+'''
+Copyright 2010 John Murphy
+This file is part of Coder.
+
+Coder is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+Coder is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with Coder.  If not, see <http://www.gnu.org/licenses/>.
+'''
+
+
+# Shared pieces of the benchmarks: a virtual X server, synthetic files,
+# running the main loop until background work is done, and timing.
+
+import sys,os
+import time
+import subprocess
+import resource
+
+ROOT = os.path.normpath(os.path.join(os.path.dirname(os.path.abspath(__file__)),os.pardir))
+# add the parent directory to the path
+sys.path.insert(0,ROOT)
+
+LINE = 'def function_%d(argument): return argument * 2  # some comment\n'
+TAB_LINE = '\tif argument:\n\t\treturn argument * 2\n'
+
+def start_xvfb():
+    '''
+    Start a virtual X server if there's no display to use.
+    Returns the Xvfb process, or None if there was already a display.
+    '''
+    if os.environ.get('DISPLAY'):
+        return None
+    for number in xrange(90,100):
+        if os.path.exists('/tmp/.X%d-lock' % number):
+            continue
+        display = ':%d' % number
+        try:
+            process = subprocess.Popen(['Xvfb',display,'-screen','0','1280x1024x24','-nolisten','tcp'],
+                                       stdout=open(os.devnull,'w'),stderr=subprocess.STDOUT)
+        except OSError:
+            sys.exit('No display and no Xvfb to start one')
+        # wait for the server to be ready
+        for i in xrange(50):
+            if os.path.exists('/tmp/.X11-unix/X%d' % number) or process.poll() is not None:
+                break
+            time.sleep(0.1)
+        if process.poll() is None:
+            os.environ['DISPLAY'] = display
+            return process
+    sys.exit("Couldn't start Xvfb")
+
+def make_file(folder,size,line=LINE):
+    'A file of about size bytes made of numbered lines, made once and reused'
+    filename = os.path.join(folder,'%s-%d.py' % ('tabs' if line == TAB_LINE else 'lines',size))
+    if os.path.exists(filename):
+        return filename
+    f = open(filename,'wb')
+    try:
+        written = 0
+        i = 0
+        while written < size:
+            # build a block at a time so big files don't take all day
+            block = ''.join([line % (i + j) if '%d' in line else line for j in xrange(1000)])
+            if written + len(block) > size:
+                # stop at the end of the line that reaches the size
+                block = block[:block.find('\n',size - written - 1) + 1] or block
+            f.write(block)
+            written += len(block)
+            i += 1000
+    finally:
+        f.close()
+    return filename
+
+def flush_events():
+    import gtk
+    while gtk.events_pending():
+        gtk.main_iteration(False)
+
+def wait_for(done,timeout=600):
+    'Run the main loop until done() is true'
+    import gtk
+    end = time.time() + timeout
+    while not done():
+        if time.time() > end:
+            raise RuntimeError('timed out')
+        gtk.main_iteration(True)
+
+def peak_rss():
+    'Peak resident set size of this process in kilobytes'
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+def stats(times):
+    'Summary of a list of times in seconds, reported in milliseconds'
+    times = sorted(times)
+    def percentile(p):
+        return times[min(len(times)-1,int(len(times) * p))] * 1000.0
+    return {'count':len(times),
+            'mean_ms':sum(times) / len(times) * 1000.0,
+            'p50_ms':percentile(0.5),
+            'p99_ms':percentile(0.99),
+            'max_ms':times[-1] * 1000.0}
+
+def git_commit():
+    try:
+        process = subprocess.Popen(['git','rev-parse','HEAD'],cwd=ROOT,
+                                   stdout=subprocess.PIPE,stderr=open(os.devnull,'w'))
+        return process.communicate()[0].strip() or None
+    except OSError:
+        return None
@@ -0,0 +1,79 @@
+#!/usr/bin/env python
+
+'''
+Copyright 2010 John Murphy
+This file is part of Coder.
+
+Coder is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+Coder is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with Coder.  If not, see <http://www.gnu.org/licenses/>.
+'''
+
+
+# Compares two result files from bench/suite.py.
+# Prints each measurement side by side and exits with status 1
+# if anything got slower (or bigger) by more than the threshold.
+#
+# usage: bench/compare.py old.json new.json [--threshold 0.1]
+
+import sys
+import json
+import optparse
+
+# measurements where bigger is worse
+METRICS = ['seconds','mean_ms','p99_ms','max_ms','peak_rss_kb']
+
+def load(filename):
+    f = open(filename)
+    try:
+        report = json.load(f)
+    finally:
+        f.close()
+    results = {}
+    for result in report['results']:
+        results[(result['benchmark'],result['size'])] = result
+    return report,results
+
+def main(args):
+    parser = optparse.OptionParser(usage='%prog [options] old.json new.json')
+    parser.add_option('--threshold',type='float',default=0.1,
+                      help='fractional slowdown counted as a regression, default 0.1')
+    options,args = parser.parse_args(args)
+    if len(args) != 2:
+        parser.error('needs two result files')
+    old_report,old = load(args[0])
+    new_report,new = load(args[1])
+    print('old: %s %s' % (old_report.get('commit'),old_report.get('date')))
+    print('new: %s %s' % (new_report.get('commit'),new_report.get('date')))
+    print('%-22s %10s %-12s %12s %12s %8s' % ('benchmark','size','metric','old','new','change'))
+    regressions = 0
+    for key in sorted(set(old) & set(new)):
+        for metric in METRICS:
+            if metric not in old[key] or metric not in new[key]:
+                continue
+            before = old[key][metric]
+            after = new[key][metric]
+            change = (after - before) / before if before else 0.0
+            flag = ''
+            if change > options.threshold:
+                flag = '  <- slower'
+                regressions += 1
+            print('%-22s %10d %-12s %12.4f %12.4f %+7.1f%%%s' % (key[0],key[1],metric,
+                                                                before,after,change*100,flag))
+    for key in sorted(set(old) ^ set(new)):
+        print('%-22s %10d only in %s' % (key[0],key[1],'old' if key in old else 'new'))
+    if regressions:
+        print('%d regressions' % regressions)
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
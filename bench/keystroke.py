@@ -0,0 +1,86 @@
+#!/usr/bin/env python
+
+'''
+Copyright 2010 John Murphy
+This file is part of Coder.
+
+Coder is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+Coder is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with Coder.  If not, see <http://www.gnu.org/licenses/>.
+'''
+
+# Measures the per-keystroke cost of typing into a Tab as the file grows.
+# Needs an X display (run it under xvfb-run when there isn't one).
+#
+# usage: bench/keystroke.py [keystrokes]
+
+import sys,os
+import time
+
+# add the parent directory to the path
+sys.path.insert(0,
+                os.path.normpath(os.path.join(os.path.abspath(sys.argv[0]),
+                os.pardir,
+                os.pardir)))
+
+import gtk
+from coder.tab import Tab
+
+SIZES = [1000,10000,100000,1000000]
+LINE = 'def function_%d(argument): return argument * 2  # some comment\n'
+
+def flush_events():
+    while gtk.events_pending():
+        gtk.main_iteration(False)
+
+def measure(lines,keystrokes):
+    '''
+    Fills a Tab with the given number of lines and types into the middle
+    of it, returning the mean and worst time per keystroke in milliseconds
+    '''
+    notebook = gtk.Notebook()
+    statusbar = gtk.Statusbar()
+    window = gtk.Window(gtk.WINDOW_TOPLEVEL)
+    vbox = gtk.VBox()
+    vbox.pack_start(notebook)
+    vbox.pack_start(statusbar,expand=False)
+    window.add(vbox)
+    window.set_default_size(800,600)
+    tab = Tab(notebook,statusbar,os.curdir)
+    buf = tab.textbuffer
+    buf.set_text(''.join([LINE % i for i in xrange(lines)]))
+    buf.place_cursor(buf.get_iter_at_line(lines/2))
+    window.show_all()
+    flush_events()
+    times = []
+    for i in xrange(keystrokes):
+        start = time.time()
+        buf.insert_at_cursor('x')
+        flush_events()
+        times.append(time.time()-start)
+    # removes the tab's journal, or the editor offers to recover it next time
+    tab.close()
+    window.destroy()
+    flush_events()
+    return (sum(times)/len(times)*1000.0,max(times)*1000.0)
+
+def main(args):
+    keystrokes = 200
+    if args:
+        keystrokes = int(args[0])
+    print '%10s %12s %12s' % ('lines','mean (ms)','max (ms)')
+    for lines in SIZES:
+        mean,worst = measure(lines,keystrokes)
+        print '%10d %12.3f %12.3f' % (lines,mean,worst)
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,236 @@
+#!/usr/bin/env python
+
+'''
+Copyright 2010 John Murphy
+This file is part of Coder.
+
+Coder is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+Coder is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with Coder.  If not, see <http://www.gnu.org/licenses/>.
+'''
+
+
+# Runs the editor's hot paths against synthetic files and writes the
+# results as JSON, tagged with the git commit, for bench/compare.py.
+# Each benchmark runs in its own process so peak RSS means something.
+# Starts Xvfb if there's no display.
+#
+# usage: bench/suite.py [-o results.json] [--sizes 1K,1M,500M] [--only load,save]
+
+import sys,os
+import time
+import json
+import tempfile
+import subprocess
+import optparse
+
+from common import LINE,TAB_LINE,start_xvfb,make_file,flush_events,wait_for
+from common import peak_rss,stats,git_commit
+
+SIZES = '1K,100K,1M,10M'
+UNITS = {'K':1024,'M':1024*1024,'G':1024*1024*1024}
+KEYSTROKES = 200
+
+def parse_size(text):
+    if text[-1].upper() in UNITS:
+        return int(float(text[:-1]) * UNITS[text[-1].upper()])
+    return int(text)
+
+def open_file(editor,filename):
+    'Load a file into the current tab, returns the tab and how long it took'
+    start = time.time()
+    editor.load_file(filename)
+    tab = editor.current_tab()
+    wait_for(lambda:tab.loader is None)
+    elapsed = time.time() - start
+    flush_events()
+    return tab,elapsed
+
+def timed(function,*args):
+    start = time.time()
+    function(*args)
+    return time.time() - start
+
+def bench_load(editor,filename):
+    tab,elapsed = open_file(editor,filename)
+    return {'seconds':elapsed}
+
+def bench_save(editor,filename):
+    tab,elapsed = open_file(editor,filename)
+    buf = tab.get_textview().get_buffer()
+    buf.insert(buf.get_start_iter(),'x')
+    target = filename + '.saved'
+    start = time.time()
+    editor.save_file(target)
+    wait_for(lambda:tab.saver is None and tab.pending_save is None)
+    elapsed = time.time() - start
+    os.unlink(target)
+    return {'seconds':elapsed}
+
+def bench_keystroke(editor,filename):
+    'Typing into the middle of the file, through the changed handlers'
+    tab,elapsed = open_file(editor,filename)
+    buf = tab.get_textview().get_buffer()
+    buf.place_cursor(buf.get_iter_at_line(buf.get_line_count()/2))
+    flush_events()
+    times = []
+    for i in xrange(KEYSTROKES):
+        start = time.time()
+        buf.insert_at_cursor('x')
+        flush_events()
+        times.append(time.time() - start)
+    return stats(times)
+
+def bench_find(editor,filename):
+    'Find the last line of the file from the start'
+    from coder.search import compile_pattern,search_forward
+    tab,elapsed = open_file(editor,filename)
+    buf = tab.get_textview().get_buffer()
+    last = buf.get_line_count() - 2
+    pattern = compile_pattern(u'function_%d(' % last)
+    start = time.time()
+    match = search_forward(buf,pattern,buf.get_start_iter())
+    return {'seconds':time.time() - start,'found':match is not None}
+
+def bench_highlight(editor,filename):
+    'Highlight every match until the whole buffer has been searched'
+    from coder.search import compile_pattern
+    tab,elapsed = open_file(editor,filename)
+    start = time.time()
+    tab.highlight_matches(compile_pattern(u'argument'))
+    wait_for(tab.matches.is_complete)
+    return {'seconds':time.time() - start,'matches':tab.matches.count()}
+
+def bench_replace(editor,filename):
+    from coder.search import compile_pattern,replace_all
+    tab,elapsed = open_file(editor,filename)
+    buf = tab.get_textview().get_buffer()
+    start = time.time()
+    count = replace_all(buf,compile_pattern(u'argument'),u'parameter')
+    return {'seconds':time.time() - start,'replaced':count}
+
+def select_all(tab):
+    buf = tab.get_textview().get_buffer()
+    buf.select_range(buf.get_start_iter(),buf.get_end_iter())
+
+def bench_indent(editor,filename):
+    tab,elapsed = open_file(editor,filename)
+    select_all(tab)
+    return {'seconds':timed(tab.indent)}
+
+def bench_comment(editor,filename):
+    tab,elapsed = open_file(editor,filename)
+    select_all(tab)
+    return {'seconds':timed(tab.comment)}
+
+def bench_replace_tabs(editor,filename):
+    tab,elapsed = open_file(editor,filename)
+    start = time.time()
+    tab.replace_tabs()
+    wait_for(lambda:tab.transform is None)
+    return {'seconds':time.time() - start}
+
+def bench_convert_line_endings(editor,filename):
+    tab,elapsed = open_file(editor,filename)
+    start = time.time()
+    tab.convert_line_endings('dos')
+    wait_for(lambda:tab.transform is None)
+    return {'seconds':time.time() - start}
+
+# name, function, file contents, whether it needs an editable buffer
+BENCHMARKS = [('load',bench_load,LINE,False),
+              ('save',bench_save,LINE,True),
+              ('keystroke',bench_keystroke,LINE,True),
+              ('find',bench_find,LINE,True),
+              ('highlight',bench_highlight,LINE,True),
+              ('replace',bench_replace,LINE,True),
+              ('indent',bench_indent,LINE,True),
+              ('comment',bench_comment,LINE,True),
+              ('replace_tabs',bench_replace_tabs,TAB_LINE,True),
+              ('convert_line_endings',bench_convert_line_endings,LINE,True)]
+
+def run_one(name,filename):
+    'Runs in the child process, prints the result as JSON'
+    import gobject
+    gobject.threads_init()
+    from coder.editor import TextEditor
+    function = dict([(b[0],b[1]) for b in BENCHMARKS])[name]
+    editor = TextEditor([])
+    flush_events()
+    result = function(editor,filename)
+    result['peak_rss_kb'] = peak_rss()
+    print(json.dumps(result))
+
+def run_child(name,filename,home):
+    'Run a benchmark in a fresh process with its own config directory'
+    env = dict(os.environ)
+    # keep the session, language cache and server socket away from the real ones
+    env['HOME'] = home
+    env['XDG_RUNTIME_DIR'] = home
+    process = subprocess.Popen([sys.executable,os.path.abspath(__file__),'--run',name,filename],
+                               stdout=subprocess.PIPE,env=env)
+    output = process.communicate()[0]
+    if process.returncode:
+        return {'error':'exit status %d' % process.returncode}
+    return json.loads(output.strip().splitlines()[-1])
+
+def main(args):
+    parser = optparse.OptionParser(usage='%prog [options]')
+    parser.add_option('-o','--output',help='write the results to this file')
+    parser.add_option('--sizes',default=SIZES,help='file sizes, default %s' % SIZES)
+    parser.add_option('--only',help='comma separated benchmarks to run')
+    parser.add_option('--data',default=os.path.join(tempfile.gettempdir(),'coder-bench'),
+                      help='where the synthetic files are kept')
+    parser.add_option('--run',action='store_true',help=optparse.SUPPRESS_HELP)
+    options,args = parser.parse_args(args)
+    if options.run:
+        run_one(args[0],args[1])
+        return
+    from coder.largefile import LARGE_FILE_SIZE
+    xvfb = start_xvfb()
+    try:
+        if not os.path.isdir(options.data):
+            os.makedirs(options.data)
+        home = tempfile.mkdtemp(prefix='coder-bench-home-')
+        only = options.only and options.only.split(',')
+        results = []
+        for size_text in options.sizes.split(','):
+            size = parse_size(size_text)
+            for name,function,line,editable in BENCHMARKS:
+                if only and name not in only:
+                    continue
+                result = {'benchmark':name,'size':size}
+                if editable and size >= LARGE_FILE_SIZE:
+                    # opened read-only by the large file viewer
+                    result['skipped'] = 'read only'
+                else:
+                    result.update(run_child(name,make_file(options.data,size,line),home))
+                results.append(result)
+                print('%-22s %10s  %s' % (name,size_text,
+                                          ', '.join(['%s=%s' % item for item in sorted(result.items())
+                                                     if item[0] not in ('benchmark','size')])))
+    finally:
+        if xvfb:
+            xvfb.terminate()
+    report = {'commit':git_commit(),
+              'date':time.strftime('%Y-%m-%dT%H:%M:%S'),
+              'python':sys.version.split()[0],
+              'results':results}
+    if options.output:
+        f = open(options.output,'w')
+        try:
+            json.dump(report,f,indent=1,sort_keys=True)
+        finally:
+            f.close()
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
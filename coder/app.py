@@ -16,8 +16,39 @@ You should have received a copy of the GNU General Public License
 along with Coder.  If not, see <http://www.gnu.org/licenses/>.
 '''
 
-import coder
-
 def main(args):
+    '''
+    Hands the files to an editor that's already running if there is one,
+    otherwise starts a new editor. gtk is only imported in the second case,
+    after the Find in Files worker processes have been forked.
+    --profile-startup prints where the time went while starting up,
+    --profile-startup=FILE writes it to FILE as JSON instead.
+    --instrument times the editor's handlers and prints the stats on exit,
+    --instrument=FILE writes them to FILE as JSON.
+    '''
+    profile = [arg for arg in args if arg.split('=')[0] == '--profile-startup']
+    if profile:
+        args = [arg for arg in args if arg not in profile]
+        import profiling
+        profiling.start(profile[-1].partition('=')[2] or None)
+    instrument_args = [arg for arg in args if arg.split('=')[0] == '--instrument']
+    args = [arg for arg in args if arg not in instrument_args]
+    import instrument
+    if instrument_args:
+        instrument.enable(instrument_args[-1].partition('=')[2] or None)
+    else:
+        instrument.enable_from_environment()
+    import server
+    import profiling
+    with profiling.phase('send_files'):
+        sent = server.send_files(args)
+    if sent:
+        profiling.report()
+        return
+    # Find in Files workers are forked now, while there's no gtk to copy
+    import searchpool
+    with profiling.phase('search pool'):
+        searchpool.start_pool()
+    import coder
     coder.main(args)
 
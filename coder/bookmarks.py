@@ -0,0 +1,178 @@
+'''
+Copyright 2010 John Murphy
+This file is part of Coder.
+
+Coder is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+Coder is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with Coder.  If not, see <http://www.gnu.org/licenses/>.
+'''
+
+import gtk
+
+from coder import SOURCE_VIEW
+
+class Bookmarks(object):
+    '''
+    A sorted list of bookmarked lines.
+    Lookups are binary searches, so moving between bookmarks doesn't
+    slow down however many there are.
+    This one holds plain line numbers, which is all a read-only
+    LargeFileViewer needs since its lines never move.
+    '''
+
+    def __init__(self):
+        self.marks = []
+
+    def line_of(self,mark):
+        return mark
+
+    def create(self,line):
+        return line
+
+    def remove(self,mark):
+        pass
+
+    def find(self,line):
+        'Index of the first bookmark on or after line'
+        low = 0
+        high = len(self.marks)
+        while low < high:
+            middle = (low + high) // 2
+            if self.line_of(self.marks[middle]) < line:
+                low = middle + 1
+            else:
+                high = middle
+        return low
+
+    def toggle(self,line):
+        'Add a bookmark to the line, or remove it if there is one'
+        i = self.find(line)
+        end = i
+        while end < len(self.marks) and self.line_of(self.marks[end]) == line:
+            # edits can leave more than one bookmark on a line
+            self.remove(self.marks[end])
+            end += 1
+        if end > i:
+            del self.marks[i:end]
+        else:
+            self.marks.insert(i,self.create(line))
+        self.redraw()
+
+    def next(self,line):
+        'Line of the next bookmark after line, wrapping around to the first'
+        if not self.marks:
+            return None
+        i = self.find(line + 1)
+        if i == len(self.marks):
+            i = 0
+        return self.line_of(self.marks[i])
+
+    def previous(self,line):
+        'Line of the bookmark before line, wrapping around to the last'
+        if not self.marks:
+            return None
+        i = self.find(line) - 1
+        return self.line_of(self.marks[i])
+
+    def lines(self):
+        return [self.line_of(mark) for mark in self.marks]
+
+    def between(self,start_line,end_line):
+        'The (mark,line) pairs from start_line to end_line'
+        pairs = []
+        i = self.find(start_line)
+        while i < len(self.marks):
+            line = self.line_of(self.marks[i])
+            if line > end_line:
+                break
+            pairs.append((self.marks[i],line))
+            i += 1
+        return pairs
+
+    def restore(self,pairs):
+        'Put marks back on the lines returned by between'
+        pass
+
+    def redraw(self):
+        pass
+
+    def close(self):
+        for mark in self.marks:
+            self.remove(mark)
+        self.marks = []
+
+class BufferBookmarks(Bookmarks):
+    '''
+    Bookmarks held as marks at the start of lines in the buffer,
+    so they move with their lines as text is edited above them.
+    Marks never pass each other, so the list stays sorted.
+    The gutter shows an icon next to each bookmarked line. Source View
+    draws its own line marks, a plain Text View gets a border window
+    that only draws the bookmarks in the visible lines.
+    '''
+
+    category = 'bookmark'
+    gutter_width = 12
+
+    def __init__(self,textview):
+        Bookmarks.__init__(self)
+        self.textview = textview
+        self.textbuffer = textview.get_buffer()
+        self.expose_id = None
+        if SOURCE_VIEW:
+            pixbuf = textview.render_icon(gtk.STOCK_MEDIA_RECORD,gtk.ICON_SIZE_MENU)
+            textview.set_mark_category_pixbuf(self.category,pixbuf)
+            textview.set_show_line_marks(True)
+
+    def line_of(self,mark):
+        return self.textbuffer.get_iter_at_mark(mark).get_line()
+
+    def create(self,line):
+        textiter = self.textbuffer.get_iter_at_line(line)
+        if SOURCE_VIEW:
+            return self.textbuffer.create_source_mark(None,self.category,textiter)
+        if self.expose_id is None:
+            # the gutter only takes up space once there's something in it
+            self.textview.set_border_window_size(gtk.TEXT_WINDOW_LEFT,self.gutter_width)
+            self.expose_id = self.textview.connect('expose-event',self.on_expose_event)
+        return self.textbuffer.create_mark(None,textiter,True)
+
+    def remove(self,mark):
+        if not mark.get_deleted():
+            self.textbuffer.delete_mark(mark)
+
+    def restore(self,pairs):
+        for mark,line in pairs:
+            self.textbuffer.move_mark(mark,self.textbuffer.get_iter_at_line(line))
+        if pairs:
+            self.redraw()
+
+    def redraw(self):
+        if not SOURCE_VIEW:
+            window = self.textview.get_window(gtk.TEXT_WINDOW_LEFT)
+            if window:
+                window.invalidate_rect(None,False)
+
+    def on_expose_event(self,widget,event):
+        window = widget.get_window(gtk.TEXT_WINDOW_LEFT)
+        if event.window != window:
+            return False
+        rect = widget.get_visible_rect()
+        top = widget.get_line_at_y(rect.y)[0].get_line()
+        bottom = widget.get_line_at_y(rect.y + rect.height)[0].get_line()
+        gc = widget.style.text_gc[gtk.STATE_NORMAL]
+        size = self.gutter_width - 4
+        for mark,line in self.between(top,bottom):
+            y,height = widget.get_line_yrange(self.textbuffer.get_iter_at_mark(mark))
+            x,y = widget.buffer_to_window_coords(gtk.TEXT_WINDOW_LEFT,0,y)
+            window.draw_arc(gc,True,2,y + (height - size) // 2,size,size,0,360*64)
+        return False
@@ -24,6 +24,7 @@ import subprocess
 import re
 
 try:
+    import gobject
     import gtk
 except ImportError:
     print 'This program requires pygtk'
@@ -44,8 +45,21 @@ def main(filenames=[]):
     Creates the Text Editor object and starts GTK.
     Accepts an optional list of filenames to pass to the Text Editor
     '''
+    import profiling
     from editor import TextEditor
-    editor = TextEditor(filenames)
+    # files are loaded and saved on worker threads
+    gobject.threads_init()
+    with profiling.phase('TextEditor'):
+        editor = TextEditor(filenames)
+    if profiling.enabled():
+        def startup_done():
+            # wait for the files being opened to finish loading
+            for tab in editor.tabs:
+                if tab.loader:
+                    return True
+            profiling.report()
+            return False
+        gobject.timeout_add(50,startup_done)
     gtk.main()
 
 if __name__ == "__main__":
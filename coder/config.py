@@ -0,0 +1,56 @@
+'''
+Copyright 2010 John Murphy
+This file is part of Coder.
+
+Coder is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+Coder is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with Coder.  If not, see <http://www.gnu.org/licenses/>.
+'''
+
+# Settings and state that last between runs are kept here.
+# Nothing in this module imports gtk.
+
+import os
+
+CONFIG_DIR = os.path.join(os.path.expanduser('~'),'.coder')
+
+def config_path(name):
+    'Path of a file in the config directory, which is created if need be'
+    if not os.path.isdir(CONFIG_DIR):
+        try:
+            os.makedirs(CONFIG_DIR,0700)
+        except OSError as e:
+            print("Couldn't create config directory %s: %s" % (CONFIG_DIR,e))
+    return os.path.join(CONFIG_DIR,name)
+
+def write_file(path,data):
+    '''
+    Write data to a temporary file and rename it over path,
+    so a crash never leaves half a file behind
+    '''
+    temp = path + '.tmp'
+    f = open(temp,'wb')
+    try:
+        f.write(data)
+    finally:
+        f.close()
+    os.rename(temp,path)
+
+def encode_strings(value):
+    'json hands back unicode, the rest of the editor works in utf-8 strings'
+    if isinstance(value,unicode):
+        return value.encode('utf-8')
+    if isinstance(value,list):
+        return [encode_strings(item) for item in value]
+    if isinstance(value,dict):
+        return dict([(encode_strings(k),encode_strings(v)) for k,v in value.items()])
+    return value
@@ -18,14 +18,27 @@ along with Coder.  If not, see <http://www.gnu.org/licenses/>.
 
 import sys
 import os
-import subprocess
 import re
+import time
+import gobject
 import gtk
 from coder import SOURCE_VIEW,MAIN_PATH
 if SOURCE_VIEW:
     import gtksourceview2
 import menus
 from tab import Tab
+from fileio import FileLoader,FileSaver,FileReloader,main_line_ending
+from largefile import is_large_file
+from server import Server
+from findinfiles import FindResultsPane
+from runner import RunPane
+from watcher import Watcher,verify_in_background
+from search import to_unicode,compile_pattern,same_pattern,expand
+from search import search_forward,search_backward,match_selection,replace_all
+from session import save_session,load_session
+from journal import find_journals,remove_journal
+import profiling
+import instrument
 
 class TextEditor(object):
     '''
@@ -38,11 +51,21 @@ class TextEditor(object):
         Sets up the GUI.
         Accepts an optional list of filenames to open
         '''
-        self.build_ui()
+        # before anything is connected to the commands
+        instrument.wrap_methods(self,'TextEditor')
+        self.stats = None
+        self.run_pane = None
+        self.warm_interpreter = bool(os.environ.get('CODER_WARM_RUN'))
+        with profiling.phase('build_ui'):
+            self.build_ui()
         
-        #values of the last used find, replace, and goto line entries
-        self.last_find = ""
-        self.last_replace = ""
+        #earlier find and replace entries, most recent first
+        self.find_history = []
+        self.replace_history = []
+        self.history_size = 50
+        self.search_options = {'regex':False,'match_case':True,'whole_word':False}
+
+        #value of the last used goto line entry
         self.last_goto = ""
         
         #set up a clipboard
@@ -51,23 +74,66 @@ class TextEditor(object):
         #set up a list to keep track of all the active tabs
         self.tabs = []
 
-        #build a Tab object for the first page of the notebook
-        self.new_tab()
+        #listen for files opened from the command line while we're running
+        with profiling.phase('server'):
+            self.server = Server(self.open_files)
+            self.server.start()
+
+        #notice when open files are changed by something else
+        self.watcher = Watcher(self.on_files_changed)
+        self.watcher.start()
+
+        with profiling.phase('load session'):
+            session = load_session()
+            if session:
+                self.restore_history(session)
 
         #load files from the command line if there were any
         if filenames:
+            #build a Tab object for the first page of the notebook
+            self.new_tab()
             self.only_first_tab = 0
             self.load_file(filenames[0])
             filenames = filenames[1:]
-            # if there was more than 1 filename then
-            # create tabs for each one and load the files
+            # if there was more than 1 filename then create placeholder
+            # tabs for the rest, they're loaded when first switched to
             for f in filenames:
-                self.new_tab()
-                self.load_file(f)
-        else:
+                self.new_lazy_tab(f)
+        elif not (session and self.restore_tabs(session)):
+            self.new_tab()
             #open works differently if there's only the original "New Document" tab
             self.only_first_tab = 1
 
+        #offer to bring back what wasn't saved if coder died last time
+        gobject.idle_add(self.recover_journals)
+
+    def restore_history(self,session):
+        self.find_history = session.get('find_history',[])[:self.history_size]
+        self.replace_history = session.get('replace_history',[])[:self.history_size]
+        self.search_options.update(session.get('search_options',{}))
+        self.last_goto = session.get('last_goto','')
+
+    def restore_tabs(self,session):
+        '''
+        Put back the tabs from the last session.
+        Only the current tab is loaded, the others are loaded
+        when they're first switched to.
+        Returns False if none of the files are still there.
+        '''
+        for state in session.get('tabs',[]):
+            filename = state.get('filename')
+            if filename and os.path.exists(filename):
+                tab = self.new_lazy_tab(filename)
+                tab.restore_state(state)
+        if not self.tabs:
+            return False
+        current = max(0,min(session.get('current',0),len(self.tabs)-1))
+        if current == self.current_page():
+            # already showing it, so switching won't load it
+            self.on_notebook_switch_page(self.notebook,None,current)
+        self.notebook.set_current_page(current)
+        return True
+
     def build_ui(self):
         ### Window ###
         self.window = gtk.Window(gtk.WINDOW_TOPLEVEL)
@@ -81,6 +147,7 @@ class TextEditor(object):
         self.window.connect('delete-event',self.on_window_delete_event)
         self.window.connect('destroy',self.on_window_destroy)
         self.window.connect('key-press-event',self.on_window_key_press_event)
+        self.window.connect('focus-in-event',self.on_window_focus_in_event)
         accelgroup = gtk.AccelGroup()
         self.window.add_accel_group(accelgroup)
 
@@ -90,16 +157,26 @@ class TextEditor(object):
         vbox.show()
 
         ### Menus ###
-        menubar = menus.build_main_menu(self,accelgroup)
+        with profiling.phase('build_main_menu'):
+            menubar = menus.build_main_menu(self,accelgroup)
         menubar.show_all()
         vbox.pack_start(menubar,expand=False,fill=True,padding=0)
 
         ### Notebook ###
         self.notebook = gtk.Notebook()
         self.notebook.connect('switch-page',self.on_notebook_switch_page)        
-        vbox.pack_start(self.notebook,expand=True,fill=True,padding=0)
         self.notebook.show()
 
+        ### Panel ###
+        # tool output (search results etc.) goes in tabs below the editor
+        self.panel = gtk.Notebook()
+        self.find_results = None
+        paned = gtk.VPaned()
+        paned.pack1(self.notebook,resize=True,shrink=False)
+        paned.pack2(self.panel,resize=False,shrink=True)
+        vbox.pack_start(paned,expand=True,fill=True,padding=0)
+        paned.show()
+
         ### Status Bar ###
         self.statusbar = gtk.Statusbar()
         vbox.pack_start(self.statusbar,expand=False,fill=True,padding=0)
@@ -117,6 +194,11 @@ class TextEditor(object):
     def on_window_destroy(self,widget,data=None):
         pass
 
+    def on_window_focus_in_event(self,widget,event):
+        if self.tabs:
+            self.check_disk(self.current_tab())
+        return False
+
     def on_window_key_press_event(self,widget,data=None):
         '''
         check for <Ctrl>Tab or <Shift><Ctrl>Tab to switch tabs
@@ -132,9 +214,19 @@ class TextEditor(object):
                     return True
 
     def on_notebook_switch_page(self,widget,data=None,new_page_num=None):
-        if self.tabs:
+        if new_page_num < len(self.tabs):
             tab = self.tabs[new_page_num]
+            if not tab.is_materialized():
+                tab.materialize()
+                filename = tab.get_filename()
+                if is_large_file(filename):
+                    # don't swap pages around in the middle of switching pages
+                    gobject.idle_add(self.load_file,filename,tab)
+                else:
+                    self.load_file(filename,tab)
             tab.update_statusbar()
+            # no dialogs in the middle of switching pages
+            gobject.idle_add(self.check_disk,tab)
 
     def file_open(self):
         file_chooser = gtk.FileChooserDialog(
@@ -147,20 +239,49 @@ class TextEditor(object):
             file_chooser.set_current_folder(tab.get_current_folder())
         response = file_chooser.run()
         if response == gtk.RESPONSE_ACCEPT:
-            #if there's only the original "New Document" tab
-            #then don't create a new tab, just replace the original
-            if not self.only_first_tab:
-                self.new_tab()
-            #if there are no open tabs at all then create one first
-            if not self.tabs:
-                self.new_tab()
-            filename = file_chooser.get_filename()
-            self.load_file(filename)
-            #reset the flag to indicate that we no longer
-            #have just the original "New Document" tab
-            self.only_first_tab = 0
+            self.open_file(file_chooser.get_filename())
         file_chooser.destroy()
 
+    def open_file(self,filename):
+        '''
+        Load a file into a new tab,
+        or switch to its tab if it's already open
+        '''
+        path = os.path.abspath(filename)
+        for i in xrange(len(self.tabs)):
+            tab_filename = self.tabs[i].get_filename()
+            if tab_filename and os.path.abspath(tab_filename) == path:
+                self.notebook.set_current_page(i)
+                self.tabs[i].focus()
+                return
+        #if there's only the original "New Document" tab
+        #then don't create a new tab, just replace the original
+        if not self.only_first_tab:
+            self.new_tab()
+        #if there are no open tabs at all then create one first
+        if not self.tabs:
+            self.new_tab()
+        self.load_file(filename)
+        #reset the flag to indicate that we no longer
+        #have just the original "New Document" tab
+        self.only_first_tab = 0
+
+    def open_file_at_line(self,filename,line):
+        'Open a file and put the cursor on a line once it has loaded'
+        self.open_file(filename)
+        tab = self.current_tab()
+        if tab.loader:
+            tab.pending_line = line
+        else:
+            tab.goto_line(line)
+            tab.focus()
+
+    def open_files(self,filenames):
+        'Called when another coder process hands us files to open'
+        for filename in filenames:
+            self.open_file(filename)
+        self.window.present()
+
     def file_save(self):
         if self.tabs:
             tab = self.current_tab()
@@ -219,141 +340,353 @@ class TextEditor(object):
 
     def find(self):
         tab = self.current_tab()
-        textview = tab.get_textview()
-        textbuffer = textview.get_buffer()
+        RESPONSE_HIGHLIGHT = 1
         dialog = gtk.Dialog(
                     title = 'Find',
                     parent = self.window,
                     flags = gtk.DIALOG_MODAL | gtk.DIALOG_DESTROY_WITH_PARENT,
-                    buttons = ('Find',gtk.RESPONSE_ACCEPT))
+                    buttons = ('Highlight All',RESPONSE_HIGHLIGHT,
+                               'Find',gtk.RESPONSE_ACCEPT))
         dialog.set_property('resizable',False)
         label = gtk.Label('Find')
-        entry = gtk.Entry()
-        entry.set_text(self.last_find)
-        # we want the text entry to emit the response but we don't want it
-        # in the action area (where the buttons are)
-        dialog.add_action_widget(entry,gtk.RESPONSE_ACCEPT)
-        action_area = dialog.get_action_area()
-        action_area.remove(entry)
+        combo,entry = self.build_history_entry(self.find_history)
+        # pressing enter in the entry finds
+        entry.connect('activate',lambda w:dialog.response(gtk.RESPONSE_ACCEPT))
         # add the label and text entry to a table
         table = gtk.Table(2,2)
         table.attach(label,0,1,0,1)
-        table.attach(entry,1,2,0,1)
+        table.attach(combo,1,2,0,1)
         table.set_col_spacing(0,10)
+        options,option_buttons = self.build_search_options()
+        result_label = gtk.Label()
         # add the table to the context area
         box = dialog.get_content_area()
         box.pack_start(table,fill=False,expand=False,padding=0)
+        box.pack_start(options,fill=False,expand=False,padding=0)
+        box.pack_start(result_label,fill=False,expand=False,padding=0)
         box.show_all()
         done = False
         while not done:
             response = dialog.run()
             search = ""
-            if response == gtk.RESPONSE_ACCEPT:
+            if response == gtk.RESPONSE_ACCEPT or response == RESPONSE_HIGHLIGHT:
                 search = entry.get_text()
-                self.last_find = search
-                bounds = textbuffer.get_selection_bounds()
-                if bounds:
-                    cur_iter = bounds[1]
-                else:
-                    cur_iter = textbuffer.get_iter_at_mark(textbuffer.get_insert())
-                found = cur_iter.forward_search(search,flags=0)
-                if found:
-                   match_start,match_end = found
-                   textbuffer.select_range(match_start,match_end)
-                   textview.scroll_to_iter(match_start,0.1)
-                else:
-                    #loop around to beginning, stopping at cursor position
-                    start_iter = textbuffer.get_start_iter()
-                    found = start_iter.forward_search(search,flags=0,limit=cur_iter)
-                    if found:
-                       match_start,match_end = found
-                       textbuffer.select_range(match_start,match_end)
-                       textview.scroll_to_iter(match_start,0.1)
+                self.add_to_history(self.find_history,search,combo)
+                self.read_search_options(option_buttons)
+                pattern = self.get_pattern(tab,search,result_label)
+                if pattern is None:
+                    continue
+                if response == RESPONSE_HIGHLIGHT:
+                    tab.highlight_matches(pattern)
+                self.find_in_tab(tab,pattern)
             else:
                 done = True
-                dialog.destroy()  
+                dialog.destroy()
+
+    def build_history_entry(self,history):
+        '''
+        A combo box entry that drops down the history and
+        completes from any part of the earlier searches.
+        Returns the combo box and its entry.
+        '''
+        combo = gtk.combo_box_entry_new_text()
+        for text in history:
+            combo.append_text(text)
+        entry = combo.child
+        if history:
+            entry.set_text(history[0])
+        completion = gtk.EntryCompletion()
+        completion.set_model(combo.get_model())
+        completion.set_text_column(0)
+        completion.set_match_func(self.history_match,None)
+        entry.set_completion(completion)
+        return (combo,entry)
+
+    def history_match(self,completion,key,treeiter,data=None):
+        text = completion.get_model().get_value(treeiter,0)
+        return key.lower() in text.lower()
+
+    def add_to_history(self,history,text,combo=None):
+        'Move text to the front of a history list'
+        if not text:
+            return
+        if text in history:
+            history.remove(text)
+        history.insert(0,text)
+        del history[self.history_size:]
+        if combo:
+            model = combo.get_model()
+            model.clear()
+            for item in history:
+                model.append([item])
+
+    def build_search_options(self):
+        'Check buttons for the search options, set the way they were last time'
+        box = gtk.HBox(spacing=10)
+        buttons = {}
+        for name,label in (('regex','Regular expression'),
+                           ('match_case','Match case'),
+                           ('whole_word','Whole word')):
+            button = gtk.CheckButton(label)
+            button.set_active(self.search_options[name])
+            box.pack_start(button,expand=False,fill=False,padding=0)
+            buttons[name] = button
+        return (box,buttons)
+
+    def read_search_options(self,buttons):
+        for name,button in buttons.items():
+            self.search_options[name] = button.get_active()
+
+    def get_pattern(self,tab,search,error_label=None):
+        '''
+        Compile a search with the current search options.
+        Large file tabs search the raw bytes so get a byte string pattern.
+        Returns None if the search is empty or isn't a valid expression.
+        '''
+        if not tab.is_read_only():
+            search = to_unicode(search)
+        return self.compile_search(search,error_label)
+
+    def compile_search(self,search,error_label=None):
+        'get_pattern for a search that is already the right kind of string'
+        if not search:
+            return None
+        try:
+            pattern = compile_pattern(search,**self.search_options)
+        except re.error as e:
+            if error_label:
+                error_label.set_text('Invalid regular expression: %s' % e)
+            return None
+        if error_label:
+            error_label.set_text('')
+        return pattern
+
+    def find_in_tab(self,tab,pattern,backwards=False):
+        '''
+        Select the next (or previous) match from the cursor,
+        looping around at the end (or beginning) of the buffer.
+        Jumps through the tab's highlighted matches when they're all known.
+        '''
+        if tab.is_read_only():
+            tab.viewer.find(pattern)
+            return
+        textview = tab.get_textview()
+        textbuffer = textview.get_buffer()
+        bounds = textbuffer.get_selection_bounds()
+        cursor = textbuffer.get_iter_at_mark(textbuffer.get_insert())
+        index = tab.matches
+        if index and index.is_complete() and same_pattern(index.pattern,pattern):
+            if bounds:
+                offset = bounds[0].get_offset()
+            else:
+                offset = cursor.get_offset()
+            if backwards:
+                found = index.previous(offset)
+            elif bounds:
+                found = index.next(offset)
+            else:
+                # a match right at the cursor counts as the next one
+                found = index.next(offset - 1)
+        elif backwards:
+            if bounds:
+                cur_iter = bounds[0]
+            else:
+                cur_iter = cursor
+            found = search_backward(textbuffer,pattern,cur_iter)
+            if not found:
+                #loop around to the end, stopping at cursor position
+                found = search_backward(textbuffer,pattern,
+                                        textbuffer.get_end_iter(),cur_iter)
+        else:
+            if bounds:
+                cur_iter = bounds[1]
+            else:
+                cur_iter = cursor
+            found = search_forward(textbuffer,pattern,cur_iter)
+            if not found:
+                #loop around to beginning, stopping at cursor position
+                found = search_forward(textbuffer,pattern,
+                                       textbuffer.get_start_iter(),cur_iter)
+        if found:
+            match_start,match_end = found
+            self.select_match(textview,match_start,match_end)
+
+    def select_match(self,textview,match_start,match_end):
+        textview.get_buffer().select_range(match_start,match_end)
+        textview.scroll_to_iter(match_start,0.1)
+
+    def find_next(self,backwards=False):
+        if self.tabs and self.find_history:
+            tab = self.current_tab()
+            pattern = self.get_pattern(tab,self.find_history[0])
+            if pattern:
+                self.find_in_tab(tab,pattern,backwards)
+
+    def find_previous(self):
+        self.find_next(backwards=True)
+
+    def clear_highlights(self):
+        if self.tabs:
+            self.current_tab().clear_matches()
+
+    def find_in_files(self):
+        '''
+        Search the open tabs and the files in a folder,
+        the results are listed in the panel
+        '''
+        tab = self.current_tab()
+        dialog = gtk.Dialog(
+                    title = 'Find in Files',
+                    parent = self.window,
+                    flags = gtk.DIALOG_MODAL | gtk.DIALOG_DESTROY_WITH_PARENT,
+                    buttons = (gtk.STOCK_CANCEL,gtk.RESPONSE_REJECT,
+                               'Find',gtk.RESPONSE_ACCEPT))
+        dialog.set_property('resizable',False)
+        find_label = gtk.Label('Find')
+        combo,entry = self.build_history_entry(self.find_history)
+        entry.connect('activate',lambda w:dialog.response(gtk.RESPONSE_ACCEPT))
+        folder_label = gtk.Label('In')
+        folder_button = gtk.FileChooserButton('Folder')
+        folder_button.set_action(gtk.FILE_CHOOSER_ACTION_SELECT_FOLDER)
+        if self.tabs:
+            folder_button.set_current_folder(os.path.abspath(tab.get_current_folder()))
+        table = gtk.Table(2,2)
+        table.attach(find_label,0,1,0,1)
+        table.attach(combo,1,2,0,1)
+        table.attach(folder_label,0,1,1,2)
+        table.attach(folder_button,1,2,1,2)
+        table.set_col_spacing(0,10)
+        options,option_buttons = self.build_search_options()
+        result_label = gtk.Label()
+        box = dialog.get_content_area()
+        box.pack_start(table,fill=False,expand=False,padding=0)
+        box.pack_start(options,fill=False,expand=False,padding=0)
+        box.pack_start(result_label,fill=False,expand=False,padding=0)
+        box.show_all()
+        while dialog.run() == gtk.RESPONSE_ACCEPT:
+            search = entry.get_text()
+            self.add_to_history(self.find_history,search,combo)
+            self.read_search_options(option_buttons)
+            # other files are always searched as unicode, so no tab is needed
+            pattern = self.compile_search(to_unicode(search),result_label)
+            if pattern is None:
+                continue
+            folder = folder_button.get_filename()
+            if not self.find_results:
+                self.find_results = FindResultsPane(self)
+                self.panel.append_page(self.find_results.get_widget(),
+                                       gtk.Label('Find Results'))
+            self.show_panel(self.find_results.get_widget())
+            self.find_results.start(folder,pattern,self.tabs)
+            break
+        dialog.destroy()
+
+    def show_stats(self,shown=True):
+        'Show or hide the handler timings in the panel'
+        if shown:
+            if not self.stats:
+                self.stats = instrument.StatsPane()
+                self.panel.append_page(self.stats.get_widget(),gtk.Label('Handler Stats'))
+            self.stats.get_widget().show()
+            self.show_panel(self.stats.get_widget())
+        elif self.stats:
+            # a hidden page loses its tab, the pane stops refreshing once unmapped
+            self.stats.get_widget().hide()
+            if not [page for page in self.panel.get_children() if page.get_visible()]:
+                self.panel.hide()
+
+    def show_panel(self,widget):
+        'Show the panel and switch to the page holding widget'
+        self.panel.show()
+        self.panel.set_current_page(self.panel.page_num(widget))
 
     def replace(self):
         tab = self.current_tab()
+        if tab.is_read_only() or tab.is_busy():
+            return
         textview = tab.get_textview()
         textbuffer = textview.get_buffer()
         RESPONSE_FIND = 1
         RESPONSE_REPLACE = 2
+        RESPONSE_REPLACE_ALL = 3
         dialog = gtk.Dialog(
                     title = 'Find & Replace',
                     parent = self.window,
                     flags = gtk.DIALOG_MODAL | gtk.DIALOG_DESTROY_WITH_PARENT,
                     buttons = ('Find',RESPONSE_FIND,
-                               'Replace',RESPONSE_REPLACE))
+                               'Replace',RESPONSE_REPLACE,
+                               'Replace All',RESPONSE_REPLACE_ALL))
         dialog.set_property('resizable',False)
         find_label = gtk.Label('Find')
-        find_entry = gtk.Entry()
-        find_entry.set_text(self.last_find)
+        find_combo,find_entry = self.build_history_entry(self.find_history)
         replace_label = gtk.Label('Replace')
-        replace_entry = gtk.Entry()
-        replace_entry.set_text(self.last_replace)
+        replace_combo,replace_entry = self.build_history_entry(self.replace_history)
         table = gtk.Table(2,2)
         table.attach(find_label,0,1,0,1)
-        table.attach(find_entry,1,2,0,1)
+        table.attach(find_combo,1,2,0,1)
         table.attach(replace_label,0,1,1,2)
-        table.attach(replace_entry,1,2,1,2)
+        table.attach(replace_combo,1,2,1,2)
         table.set_col_spacing(0,10)
+        options,option_buttons = self.build_search_options()
+        selection_check = gtk.CheckButton('Replace All in selection only')
+        result_label = gtk.Label()
         box = dialog.get_content_area()
         box.pack_start(table,fill=False,expand=False,padding=0)
+        box.pack_start(options,fill=False,expand=False,padding=0)
+        box.pack_start(selection_check,fill=False,expand=False,padding=0)
+        box.pack_start(result_label,fill=False,expand=False,padding=0)
         box.show_all()
         done = False
         while not done:
             response = dialog.run()
-            find = ""
-            replace = ""
-            if response == RESPONSE_FIND or response == RESPONSE_REPLACE:
+            if response in (RESPONSE_FIND,RESPONSE_REPLACE,RESPONSE_REPLACE_ALL):
                 find = find_entry.get_text()
                 replace = replace_entry.get_text()
-                self.last_find = find
-                self.last_replace = replace
-                bounds = textbuffer.get_selection_bounds()
-                if response == RESPONSE_FIND and bounds:
-                    cur_iter = bounds[1]
-                else:
-                    cur_iter = textbuffer.get_iter_at_mark(textbuffer.get_insert())
-                found = cur_iter.forward_search(find,flags=0)
-                if found:
-                   match_start,match_end = found
-                   textbuffer.select_range(match_start,match_end)
-                   textview.scroll_to_iter(match_start,0.1)
-                   if response == RESPONSE_REPLACE:
-                       textbuffer.insert(match_start,replace)
-                       textbuffer.delete_selection(1,1)
-                else:
-                    #loop around to beginning, stopping at cursor position
-                    start_iter = textbuffer.get_start_iter()
-                    found = start_iter.forward_search(find,flags=0,limit=cur_iter)
-                    if found:
-                       match_start,match_end = found
-                       textbuffer.select_range(match_start,match_end)
-                       textview.scroll_to_iter(match_start,0.1)
-                       if response == RESPONSE_REPLACE:
-                           textbuffer.insert(match_start,replace)
-                           textbuffer.delete_selection(1,1)
-                if response == RESPONSE_REPLACE:
+                self.add_to_history(self.find_history,find,find_combo)
+                self.add_to_history(self.replace_history,replace,replace_combo)
+                self.read_search_options(option_buttons)
+                regex = self.search_options['regex']
+                pattern = self.get_pattern(tab,find,result_label)
+                if pattern is None:
+                    continue
+                if response != RESPONSE_FIND and tab.is_busy():
+                    # a reload or conversion started while the dialog was up
+                    result_label.set_text('The tab is busy, try again when it\'s done')
+                    continue
+                if response == RESPONSE_REPLACE_ALL:
                     bounds = textbuffer.get_selection_bounds()
-                    if bounds:
-                        cur_iter = bounds[1]
-                    else:
-                        cur_iter = textbuffer.get_iter_at_mark(textbuffer.get_insert())
-                    found = cur_iter.forward_search(find,flags=0)
-                    if found:
-                       match_start,match_end = found
-                       textbuffer.select_range(match_start,match_end)
-                       textview.scroll_to_iter(match_start,0.1)
-                    else:
-                        #loop around to beginning, stopping at cursor position
-                        start_iter = textbuffer.get_start_iter()
-                        found = start_iter.forward_search(find,flags=0,limit=cur_iter)
-                        if found:
-                           match_start,match_end = found
-                           textbuffer.select_range(match_start,match_end)
-                           textview.scroll_to_iter(match_start,0.1)
+                    try:
+                        if selection_check.get_active():
+                            if bounds:
+                                count = replace_all(textbuffer,pattern,replace,regex,*bounds)
+                            else:
+                                count = 0
+                        else:
+                            count = replace_all(textbuffer,pattern,replace,regex)
+                    except (re.error,IndexError) as e:
+                        # nothing is replaced until every match has expanded
+                        result_label.set_text('Invalid replacement: %s' % e)
+                        continue
+                    result_label.set_text('Replaced %d occurrences' % count)
+                    continue
+                if response == RESPONSE_REPLACE:
+                    # replace the selected match, finding one first if needed
+                    if not match_selection(textbuffer,pattern):
+                        self.find_in_tab(tab,pattern)
+                    match = match_selection(textbuffer,pattern)
+                    if match:
+                        try:
+                            text = expand(match,to_unicode(replace),regex)
+                        except (re.error,IndexError) as e:
+                            result_label.set_text('Invalid replacement: %s' % e)
+                            continue
+                        bounds = textbuffer.get_selection_bounds()
+                        offset = bounds[0].get_offset()
+                        textbuffer.begin_user_action()
+                        textbuffer.delete(*bounds)
+                        textbuffer.insert(textbuffer.get_iter_at_offset(offset),text)
+                        textbuffer.end_user_action()
+                self.find_in_tab(tab,pattern)
             else:
                 done = True
                 dialog.destroy()
@@ -388,40 +721,42 @@ class TextEditor(object):
                 line_num = ''
             if line_num is not '' and line_num >= 0:
                 try:
-                    textiter = textbuffer.get_iter_at_line(line_num)
-                    textbuffer.place_cursor(textiter)
-                    textview.scroll_to_iter(textiter,0.1)
+                    tab.goto_line(line_num)
                 except OverflowError:
                     pass
 
     ### tools menu signal handlers ###
 
     def run(self):
+        'Run the current file, its output goes in the panel'
         if self.tabs:
             tab = self.current_tab()
             filename = tab.get_filename()
-            if filename:
-                (basename,ext) = os.path.splitext(filename)
-                if os.path.exists(filename) and ext == '.py':
-                    try:
-                        command = 'python ' + filename
-                        subprocess.Popen('python ' + filename,shell=True)
-                    except OSError as e:
-                        print e
-    
+            if filename and os.path.exists(filename):
+                if not self.run_pane:
+                    self.run_pane = RunPane(self)
+                    self.run_pane.set_warm(self.warm_interpreter)
+                    self.panel.append_page(self.run_pane.get_widget(),gtk.Label('Output'))
+                self.show_panel(self.run_pane.get_widget())
+                self.run_pane.run(filename)
+
+    def set_warm_interpreter(self,warm):
+        'Keep a Python interpreter started ready for the next run'
+        self.warm_interpreter = warm
+        if self.run_pane:
+            self.run_pane.set_warm(warm)
+
     def replace_tabs(self):
         if self.tabs:
             tab = self.current_tab()
-            textview = tab.get_textview()
-            textbuffer = textview.get_buffer()
-            textview.set_sensitive(False)
-            start = textbuffer.get_start_iter()
-            end = textbuffer.get_end_iter()
-            text = textbuffer.get_text(start,end,True)
-            text = re.sub('\t','    ',text)
-            textbuffer.set_text(text)
-            textview.set_sensitive(True)
+            tab.replace_tabs()
    
+    def set_highlighting(self,policy):
+        'Highlight the current tab a particular way, None for automatic'
+        if self.tabs:
+            tab = self.current_tab()
+            tab.set_highlight_policy(policy)
+
     def toggle_comments(self):
         if self.tabs:
             tab = self.current_tab()
@@ -443,18 +778,32 @@ class TextEditor(object):
             tab.next_mark()
 
     def quit(self):
+        # let saves that are still running finish writing
+        for tab in self.tabs:
+            if tab.saver:
+                tab.saver.wait()
+        while gtk.events_pending():
+            gtk.main_iteration(False)
         changes = 0
         for tab in self.tabs:
             if tab.has_unsaved_changes():
                 changes = 1
                 break
         if changes:
-            if self.ok_to_quit():
-                gtk.main_quit()
-            else:
+            if not self.ok_to_quit():
                 return False
-        else:
-            gtk.main_quit()
+        if self.find_results:
+            self.find_results.cancel()
+        if self.run_pane:
+            self.run_pane.close()
+        for tab in self.tabs:
+            if tab.journal:
+                tab.journal.close()
+        save_session(self)
+        instrument.dump()
+        self.watcher.stop()
+        self.server.stop()
+        gtk.main_quit()
 
     def ok_to_quit(self):
         dialog = gtk.MessageDialog(parent=self.window,
@@ -491,7 +840,17 @@ class TextEditor(object):
         #reset the flag to indicate that we no longer
         #have just the original "New Document" tab
         self.only_first_tab = 0
-    
+
+    def new_lazy_tab(self,filename):
+        '''
+        Add a tab for a file without switching to it.
+        The file isn't loaded until the tab is first shown.
+        '''
+        tab = Tab(self.notebook,self.statusbar,os.path.dirname(filename),filename)
+        self.tabs.append(tab)
+        self.only_first_tab = 0
+        return tab
+
     def next_tab(self):
         '''
         advance to the next tab
@@ -522,51 +881,88 @@ class TextEditor(object):
                     self.notebook.set_current_page(cur_tab-1)
                 self.current_tab().focus()
    
-    def load_file(self,filename):
-        new_file = False
-        try:
-            f = open(filename,'rb')
-            text = f.read()
-            f.close()
-        except IOError as e:
-            text = ""
-            new_file = True
-        tab = self.current_tab()
-        textview = tab.get_textview()
-        textbuffer = textview.get_buffer()
-        textview.set_sensitive(False)
-        textbuffer.set_text(text)
-        start = textbuffer.get_start_iter()
-        textbuffer.place_cursor(start)
-        textview.set_sensitive(True)
+    def load_file(self,filename,tab=None):
+        '''
+        Load a file into a tab, the current one by default.
+        The file is read in the background, on_file_loaded
+        finishes setting up the tab once it's all in the buffer.
+        '''
+        if tab is None:
+            tab = self.current_tab()
+        if tab.loader:
+            tab.loader.cancel()
+        if tab.journal:
+            # the loader's inserts aren't edits
+            tab.journal.stop()
+        if is_large_file(filename):
+            with profiling.phase('open large file %s' % filename):
+                tab.open_large_file(filename)
+            self.goto_pending_line(tab)
+            tab.update_statusbar()
+            tab.focus()
+            return
         tab.set_filename(filename)
-        tab.set_format()
-        textbuffer.set_modified(new_file)
-        tab.update_statusbar()
+        tab.loader = FileLoader(tab,filename,self.on_file_loaded)
+        tab.loader.start()
         tab.focus()
 
+    def on_file_loaded(self,loader):
+        tab = loader.tab
+        profiling.add('load',loader.filename,time.time() - loader.start_wall,
+                      profiling.cpu_time() - loader.start_cpu)
+        tab.set_disk_state(loader)
+        self.watch_tab(tab)
+        tab.loader = None
+        textbuffer = tab.get_textview().get_buffer()
+        tab.set_format(loader)
+        textbuffer.set_modified(loader.new_file)
+        tab.reset_journal()
+        self.goto_pending_line(tab)
+        tab.update_statusbar()
+
+    def goto_pending_line(self,tab):
+        tab.apply_pending_state()
+        if tab.pending_line is not None:
+            tab.goto_line(tab.pending_line)
+            tab.pending_line = None
+
     def save_file(self,filename):
+        '''
+        Save the current tab in the background.
+        If the tab is already being saved, save again once that finishes.
+        '''
         if filename:
             tab = self.current_tab()
-            textview = tab.get_textview()
-            textbuffer = textview.get_buffer()
-            start = textbuffer.get_start_iter()
-            end = textbuffer.get_end_iter()
-            text = textbuffer.get_text(start,end)
-            try:
-                f = open(filename,'wb')
-                f.write(text)
-                f.close()
-                textbuffer.set_modified(False)
-                tab.set_filename(filename)
-                tab.update_statusbar()
-            except IOError as e:
-                print("Error saving file %s" % filename)
-
-    def convert_line_endings(self):
+            if tab.is_read_only():
+                return
+            if tab.saver:
+                tab.pending_save = filename
+                return
+            tab.saver = FileSaver(tab,filename,self.on_file_saved)
+            tab.saver.start()
+
+    def on_file_saved(self,saver):
+        tab = saver.tab
+        tab.saver = None
+        if not saver.error:
+            tab.set_filename(saver.filename)
+            tab.set_disk_state(saver)
+            self.watch_tab(tab)
+            tab.reset_journal()
+            if tab.edit_serial != saver.serial:
+                # edited while saving, the log can't start from the file
+                tab.journal.record_whole_text()
+            tab.update_statusbar()
+        if tab.pending_save:
+            filename = tab.pending_save
+            tab.pending_save = None
+            tab.saver = FileSaver(tab,filename,self.on_file_saved)
+            tab.saver.start()
+
+    def convert_line_endings(self,line_endings):
         if self.tabs:
             tab = self.current_tab()
-            tab.convert_line_endings()
+            tab.convert_line_endings(line_endings)
 
     def close_tab(self):
         if self.tabs:
@@ -577,9 +973,142 @@ class TextEditor(object):
                 if not self.ok_to_close_tab():
                     quit = False
             if quit:
+                if tab.watched:
+                    self.watcher.unwatch(tab.watched)
+                tab.close()
                 self.notebook.remove_page(page)
                 self.tabs.remove(tab)                
 
+    def watch_tab(self,tab):
+        'Watch the file the tab has open, and stop watching the one it had'
+        filename = tab.get_filename()
+        if tab.watched == filename:
+            return
+        if tab.watched:
+            self.watcher.unwatch(tab.watched)
+        tab.watched = filename
+        if filename:
+            self.watcher.watch(filename)
+
+    def on_files_changed(self,paths):
+        'Runs on the main loop when the watcher sees files change'
+        for tab in self.tabs:
+            if tab.watched and os.path.realpath(tab.watched) in paths:
+                tab.stale = True
+        if self.tabs and self.window.is_active():
+            self.check_disk(self.current_tab())
+
+    def check_disk(self,tab):
+        '''
+        If the tab's file might have changed, check in the background
+        whether it really did. Without a watcher every check looks.
+        '''
+        if not self.watcher.available():
+            tab.stale = True
+        if not tab.stale or tab not in self.tabs or not tab.watched or tab.viewer:
+            return False
+        if tab.loader or tab.saver or tab.transform:
+            # still stale, look again next time
+            return False
+        tab.stale = False
+        def done(result,signature):
+            self.on_disk_checked(tab,result,signature)
+        verify_in_background(tab.watched,tab.disk_signature,done)
+        return False
+
+    def on_disk_checked(self,tab,result,signature):
+        if tab not in self.tabs:
+            return
+        if result == 'same':
+            # at most touched, remember the new mtime so it isn't hashed again
+            tab.disk_signature = signature
+        elif result == 'deleted':
+            # it'll need saving to get it back
+            tab.get_textview().get_buffer().set_modified(True)
+        elif tab.has_unsaved_changes() and not self.ok_to_reload(tab):
+            # don't ask again about this version of the file,
+            # what's known about the old one no longer applies
+            tab.disk_signature = signature
+            tab.disk_sha = None
+            tab.disk_tail = ''
+        else:
+            self.reload_file(tab)
+
+    def reload_file(self,tab):
+        '''
+        Bring the tab up to date with its file, changing only what changed.
+        The reloader takes the loader's place so everything that waits
+        for a tab to finish loading waits for it too.
+        '''
+        if tab.loader:
+            tab.loader.cancel()
+        tab.loader = FileReloader(tab,tab.get_filename(),self.on_file_reloaded)
+        tab.loader.start()
+
+    def on_file_reloaded(self,reloader):
+        tab = reloader.tab
+        tab.loader = None
+        if reloader.error:
+            return
+        tab.set_disk_state(reloader)
+        tab.reset_journal()
+        tab.encoding = reloader.encoding
+        tab.bom = reloader.bom
+        if reloader.line_ending_counts is not None:
+            tab.line_ending_counts = reloader.line_ending_counts
+            tab.line_endings = main_line_ending(tab.line_ending_counts)
+        tab.update_statusbar()
+
+    def recover_journals(self):
+        '''
+        Offer to replay the journals left behind by a coder that died,
+        each into the tab for its file once the file has loaded
+        '''
+        journals = find_journals()
+        if not journals:
+            return False
+        names = [os.path.basename(header['filename']) or 'New Document'
+                 for filename,header in journals]
+        if not self.ok_to_recover(names):
+            for filename,header in journals:
+                remove_journal(filename)
+            return False
+        for filename,header in journals:
+            if header['filename']:
+                self.open_file(header['filename'])
+                tab = self.current_tab()
+            else:
+                self.new_tab()
+                tab = self.current_tab()
+            if tab.loader:
+                tab.pending_journal = filename
+            else:
+                tab.recover_journal(filename)
+        return False
+
+    def ok_to_recover(self,names):
+        dialog = gtk.MessageDialog(parent=self.window,
+                                  flags=gtk.DIALOG_MODAL | gtk.DIALOG_DESTROY_WITH_PARENT,
+                                  type=gtk.MESSAGE_QUESTION,
+                                  buttons=gtk.BUTTONS_YES_NO,
+                                  message_format="Coder didn't shut down cleanly. Recover the unsaved changes to %s?" % ', '.join(names))
+        dialog_response = dialog.run()
+        dialog.destroy()
+        return dialog_response == gtk.RESPONSE_YES
+
+    def ok_to_reload(self,tab):
+        dialog = gtk.MessageDialog(parent=self.window,
+                                  flags=gtk.DIALOG_MODAL | gtk.DIALOG_DESTROY_WITH_PARENT,
+                                  type=gtk.MESSAGE_QUESTION,
+                                  buttons=gtk.BUTTONS_OK_CANCEL,
+                                  message_format="%s has changed on disk, reload it and lose your changes?" % os.path.basename(tab.get_filename()))
+        dialog_response = dialog.run()
+        ok_to_reload = False
+        if dialog_response == gtk.RESPONSE_OK:
+            ok_to_reload = True
+        dialog.destroy()
+        return ok_to_reload
+
     def ok_to_close_tab(self):
         dialog = gtk.MessageDialog(parent=self.window,
                                   flags=gtk.DIALOG_MODAL | gtk.DIALOG_DESTROY_WITH_PARENT,
@@ -0,0 +1,557 @@
+'''
+Copyright 2010 John Murphy
+This file is part of Coder.
+
+Coder is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+Coder is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with Coder.  If not, see <http://www.gnu.org/licenses/>.
+'''
+
+import os
+import stat
+import time
+import codecs
+import difflib
+import hashlib
+import tempfile
+import threading
+import traceback
+import Queue
+import gobject
+
+from coder import SOURCE_VIEW
+from profiling import cpu_time
+from instrument import wrap
+
+def get_umask():
+    umask = os.umask(0)
+    os.umask(umask)
+    return umask
+
+# the umask can only be read by setting it, which affects every thread,
+# so it's read once at import before any workers are started
+UMASK = get_umask()
+
+# byte order marks that are recognised, and the encoding each one means
+BOMS = ((codecs.BOM_UTF8,'utf-8'),
+        (codecs.BOM_UTF16_LE,'utf-16-le'),
+        (codecs.BOM_UTF16_BE,'utf-16-be'))
+
+def detect_encoding(data):
+    '''
+    Work out the encoding from the start of a file.
+    Returns (encoding,bom) where bom is the byte order mark found, if any.
+    Without a BOM the sample is checked for UTF-8, anything that isn't
+    valid UTF-8 is taken to be Latin-1.
+    '''
+    for bom,encoding in BOMS:
+        if data.startswith(bom):
+            return encoding,bom
+    try:
+        # not final, a character cut off at the end of the sample is fine
+        codecs.getincrementaldecoder('utf-8')().decode(data,False)
+    except UnicodeDecodeError:
+        return 'latin-1',''
+    return 'utf-8',''
+
+def count_line_endings(text,counts,last_cr=False):
+    '''
+    Add the line endings in a piece of text to counts.
+    last_cr says the previous piece ended with a carriage return, so a
+    line feed at the start of this one completes a dos line ending.
+    '''
+    dos = text.count(u'\r\n')
+    counts['dos'] += dos
+    counts['unix'] += text.count(u'\n') - dos
+    counts['mac'] += text.count(u'\r') - dos
+    if last_cr and text.startswith(u'\n'):
+        counts['mac'] -= 1
+        counts['unix'] -= 1
+        counts['dos'] += 1
+
+def measure_lines(text,run=0):
+    '''
+    Length of the longest line in a piece of text, and of the unfinished
+    line it ends with. run is the length of the unfinished line before it.
+    '''
+    lines = text.split(u'\n')
+    if len(lines) == 1:
+        return run + len(text),run + len(text)
+    longest = max(run + len(lines[0]),max([len(line) for line in lines[1:]]))
+    return longest,len(lines[-1])
+
+# bytes kept from the end of a file, to tell if it has only been appended to
+TAIL_SIZE = 4096
+
+def snapshot(textbuffer,chunk_chars=1024*1024):
+    'Copy the buffer out in chunks rather than as one big string'
+    chunks = []
+    start = textbuffer.get_start_iter()
+    while not start.is_end():
+        end = start.copy()
+        end.forward_chars(chunk_chars)
+        chunks.append(textbuffer.get_text(start,end))
+        start = end
+    return chunks
+
+def main_line_ending(counts):
+    'The most common line ending, unix if there are none'
+    line_endings = 'unix'
+    for name in ('dos','mac'):
+        if counts[name] > counts[line_endings]:
+            line_endings = name
+    return line_endings
+
+class FileLoader(object):
+    '''
+    Reads a file on a worker thread and inserts it into a Tab's buffer
+    in idle-time chunks, so the window keeps drawing while a big file loads.
+    The worker also works out the file's format as it goes: the encoding
+    from a sample at the start and the line endings from every chunk,
+    so nothing has to scan the buffer afterwards.
+    Call cancel() to stop loading, for example when the tab is closed.
+    '''
+
+    chunk_size = 256 * 1024 # bytes read by the worker at a time
+    sample_size = 64 * 1024 # bytes looked at to guess the encoding
+    queue_size = 16 # chunks read ahead of the buffer
+    idle_time = 0.02 # seconds spent inserting per idle callback
+
+    def __init__(self,tab,filename,on_done=None):
+        self.tab = tab
+        self.filename = filename
+        self.on_done = on_done
+        self.new_file = False
+        self.cancelled = False
+        self.encoding = 'utf-8'
+        self.bom = ''
+        self.line_ending_counts = {'unix':0,'dos':0,'mac':0}
+        # in characters, for picking how to highlight it
+        self.longest_line = 0
+        # (size,mtime,sha1) of what was read, to tell later if the file changed
+        self.signature = None
+        self.sha = None
+        self.tail = ''
+        self.size = 0
+        self.bytes_inserted = 0
+        self.queue = Queue.Queue(self.queue_size)
+        self.lock = threading.Lock()
+        self.scheduled = False
+        self.thread = threading.Thread(target=self.read)
+        self.thread.daemon = True
+
+    def start(self):
+        self.start_wall = time.time()
+        self.start_cpu = cpu_time()
+        try:
+            self.size = os.path.getsize(self.filename)
+        except OSError:
+            self.size = 0
+        textview = self.tab.get_textview()
+        textbuffer = textview.get_buffer()
+        textview.set_editable(False)
+        if SOURCE_VIEW:
+            textbuffer.begin_not_undoable_action()
+            # the tab decides how to highlight once it knows what's in the file
+            textbuffer.set_highlight_syntax(False)
+        textbuffer.set_text('')
+        self.thread.start()
+
+    def cancel(self):
+        if self.cancelled:
+            return
+        self.cancelled = True
+        textview = self.tab.get_textview()
+        if SOURCE_VIEW:
+            textview.get_buffer().end_not_undoable_action()
+        textview.set_editable(True)
+
+    def read(self):
+        'Runs on the worker thread, never touches the buffer'
+        last_cr = False
+        run = 0
+        try:
+            f = open(self.filename,'rb')
+            try:
+                stat = os.fstat(f.fileno())
+                sha = hashlib.sha1()
+                data = f.read(self.chunk_size)
+                sha.update(data)
+                tail = data[-TAIL_SIZE:]
+                self.encoding,self.bom = detect_encoding(data[:self.sample_size])
+                decoder = codecs.getincrementaldecoder(self.encoding)('replace')
+                length = len(data)
+                data = data[len(self.bom):]
+                while not self.cancelled:
+                    text = decoder.decode(data,not data)
+                    if text:
+                        count_line_endings(text,self.line_ending_counts,last_cr)
+                        last_cr = text.endswith(u'\r')
+                        longest,run = measure_lines(text,run)
+                        self.longest_line = max(self.longest_line,longest)
+                        self.put((text,length))
+                    if not data:
+                        break
+                    data = f.read(self.chunk_size)
+                    sha.update(data)
+                    tail = (tail + data)[-TAIL_SIZE:]
+                    length = len(data)
+                self.signature = (stat.st_size,stat.st_mtime,sha.hexdigest())
+                self.sha = sha
+                self.tail = tail
+            finally:
+                f.close()
+        except IOError:
+            self.new_file = True
+        self.put(None)
+
+    def put(self,item):
+        while not self.cancelled:
+            try:
+                self.queue.put(item,timeout=0.1)
+                break
+            except Queue.Full:
+                pass
+        self.lock.acquire()
+        try:
+            if not self.scheduled:
+                self.scheduled = True
+                gobject.idle_add(wrap('FileLoader.insert_chunks',self.insert_chunks))
+        finally:
+            self.lock.release()
+
+    def insert_chunks(self):
+        'Runs on the main thread, inserts queued chunks for a short while'
+        if self.cancelled:
+            return False
+        textbuffer = self.tab.get_textview().get_buffer()
+        first = self.bytes_inserted == 0
+        start_time = time.time()
+        while time.time() - start_time < self.idle_time:
+            try:
+                item = self.queue.get_nowait()
+            except Queue.Empty:
+                self.lock.acquire()
+                try:
+                    if self.queue.empty():
+                        self.scheduled = False
+                        break
+                finally:
+                    self.lock.release()
+                continue
+            if item is None:
+                self.finish()
+                return False
+            text,length = item
+            textbuffer.insert(textbuffer.get_end_iter(),text)
+            self.bytes_inserted += length
+        if first:
+            textbuffer.place_cursor(textbuffer.get_start_iter())
+        if self.size:
+            self.tab.show_progress('Loading %s' % self.filename,
+                                   float(self.bytes_inserted)/self.size)
+        return self.scheduled
+
+    def finish(self):
+        textview = self.tab.get_textview()
+        textbuffer = textview.get_buffer()
+        if SOURCE_VIEW:
+            textbuffer.end_not_undoable_action()
+        textbuffer.place_cursor(textbuffer.get_start_iter())
+        textview.set_editable(True)
+        self.tab.hide_progress()
+        if self.on_done:
+            self.on_done(self)
+
+class FileSaver(object):
+    '''
+    Saves a snapshot of a Tab's buffer without blocking the window.
+    The snapshot is written to a temporary file next to the target on a
+    worker thread, synced to disk and then renamed over the target, so a
+    crash part way through never leaves a truncated file behind.
+    The buffer stays editable while this runs, the modified flag is only
+    cleared if nothing changed since the snapshot was taken.
+    The file keeps the encoding and byte order mark it was loaded with,
+    chunks are re-encoded one at a time as they are written.
+    '''
+
+    chunk_chars = 1024 * 1024 # characters copied out of the buffer at a time
+
+    def __init__(self,tab,filename,on_done=None):
+        self.tab = tab
+        self.filename = filename
+        self.on_done = on_done
+        self.error = None
+        self.serial = tab.edit_serial
+        self.encoding = tab.encoding
+        self.bom = tab.bom
+        self.signature = None
+        self.sha = None
+        self.tail = ''
+        self.chunks = snapshot(tab.get_textview().get_buffer(),self.chunk_chars)
+        self.thread = threading.Thread(target=self.write)
+        self.thread.daemon = True
+
+    def start(self):
+        self.thread.start()
+
+    def wait(self):
+        'Block until the file is on disk'
+        self.thread.join()
+
+    def write(self):
+        'Runs on the worker thread, never touches the buffer'
+        # write through symlinks instead of replacing them
+        target = os.path.realpath(self.filename)
+        dirname,basename = os.path.split(target)
+        temp = None
+        try:
+            fd,temp = tempfile.mkstemp(prefix='.%s.' % basename,dir=dirname)
+            f = os.fdopen(fd,'wb')
+            sha = hashlib.sha1()
+            tail = ['']
+            def write(data):
+                sha.update(data)
+                tail[0] = (tail[0] + data)[-TAIL_SIZE:]
+                f.write(data)
+            try:
+                write(self.bom)
+                # the buffer hands out utf-8, only re-encode if the file isn't
+                encoder = None
+                if codecs.lookup(self.encoding).name != 'utf-8':
+                    decoder = codecs.getincrementaldecoder('utf-8')()
+                    encoder = codecs.getincrementalencoder(self.encoding)()
+                for i in xrange(len(self.chunks)):
+                    if encoder:
+                        write(encoder.encode(decoder.decode(self.chunks[i])))
+                    else:
+                        write(self.chunks[i])
+                    self.chunks[i] = None
+                if encoder:
+                    write(encoder.encode(decoder.decode('',True),True))
+                f.flush()
+                os.fsync(f.fileno())
+            finally:
+                f.close()
+            try:
+                mode = stat.S_IMODE(os.stat(target).st_mode)
+            except OSError:
+                mode = 0666 & ~UMASK
+            os.chmod(temp,mode)
+            os.rename(temp,target)
+            temp = None
+            st = os.stat(target)
+            self.signature = (st.st_size,st.st_mtime,sha.hexdigest())
+            self.sha = sha
+            self.tail = tail[0]
+            fd = os.open(dirname,os.O_RDONLY)
+            try:
+                os.fsync(fd)
+            finally:
+                os.close(fd)
+        except (IOError,OSError,UnicodeError) as e:
+            self.error = e
+        except Exception as e:
+            # a bug rather than a problem with the file, the tab
+            # still has to hear the save is over or it never saves again
+            self.error = e
+            traceback.print_exc()
+        if self.error and temp:
+            try:
+                os.unlink(temp)
+            except OSError:
+                pass
+        self.chunks = None
+        gobject.idle_add(self.finish)
+
+    def finish(self):
+        if self.error:
+            print("Error saving file %s: %s" % (self.filename,self.error))
+        elif self.tab.edit_serial == self.serial:
+            self.tab.get_textview().get_buffer().set_modified(False)
+        if self.on_done:
+            self.on_done(self)
+        return False
+
+def line_edits(old_text,new_text,max_diff_lines=20000):
+    '''
+    The edits that turn old_text into new_text, as a list of
+    (start,end,text) where the characters from start to end of old_text
+    are replaced by text, last edit first so they can be applied in order.
+    Lines the two have in common at the start and end are skipped, what's
+    left is diffed line by line unless it's too big, in which case it's
+    one edit.
+    '''
+    old = old_text.splitlines(True)
+    new = new_text.splitlines(True)
+    common = min(len(old),len(new))
+    prefix = 0
+    while prefix < common and old[prefix] == new[prefix]:
+        prefix += 1
+    suffix = 0
+    while suffix < common - prefix and old[-1-suffix] == new[-1-suffix]:
+        suffix += 1
+    old_middle = old[prefix:len(old)-suffix]
+    new_middle = new[prefix:len(new)-suffix]
+    # character offset of the start of each line in the middle of old_text
+    offsets = [sum([len(line) for line in old[:prefix]])]
+    for line in old_middle:
+        offsets.append(offsets[-1] + len(line))
+    if len(old_middle) + len(new_middle) <= max_diff_lines:
+        matcher = difflib.SequenceMatcher(None,old_middle,new_middle,autojunk=False)
+        opcodes = matcher.get_opcodes()
+    else:
+        opcodes = [('replace',0,len(old_middle),0,len(new_middle))]
+    edits = [(offsets[i1],offsets[i2],u''.join(new_middle[j1:j2]))
+             for tag,i1,i2,j1,j2 in opcodes if tag != 'equal']
+    edits.reverse()
+    return edits
+
+class FileReloader(object):
+    '''
+    Brings a Tab's buffer up to date with its file by changing only what
+    changed, so the cursor, bookmarks and undo history survive.
+    If the file has only grown and still ends the way it did when it was
+    last loaded or saved, only the new bytes are read and appended.
+    Otherwise the file and a snapshot of the buffer are diffed line by
+    line on a worker thread and the buffer gets just the changed hunks,
+    as one user action.
+    The view is read-only while this runs.
+    '''
+
+    def __init__(self,tab,filename,on_done=None):
+        self.tab = tab
+        self.filename = filename
+        self.on_done = on_done
+        self.error = None
+        self.cancelled = False
+        self.encoding = tab.encoding
+        self.bom = tab.bom
+        self.old_signature = tab.disk_signature
+        self.old_sha = tab.disk_sha
+        self.old_tail = tab.disk_tail
+        # what the worker works out
+        self.appended = None
+        self.edits = None
+        self.signature = None
+        self.sha = None
+        self.tail = ''
+        self.line_ending_counts = None
+        self.chunks = None
+        if tab.has_unsaved_changes() or not self.only_appended():
+            self.chunks = snapshot(tab.get_textview().get_buffer(),FileSaver.chunk_chars)
+        self.thread = threading.Thread(target=self.read)
+        self.thread.daemon = True
+
+    def only_appended(self):
+        'True if the file still has the same bytes where it used to end'
+        if not (self.old_signature and self.old_sha and self.old_tail):
+            return False
+        try:
+            f = open(self.filename,'rb')
+            try:
+                return self.tail_matches(f,os.fstat(f.fileno()))
+            finally:
+                f.close()
+        except (IOError,OSError):
+            return False
+
+    def tail_matches(self,f,stat):
+        old_size = self.old_signature[0]
+        if stat.st_size < old_size:
+            return False
+        f.seek(old_size - len(self.old_tail))
+        return f.read(len(self.old_tail)) == self.old_tail
+
+    def start(self):
+        self.tab.get_textview().set_editable(False)
+        self.thread.start()
+
+    def cancel(self):
+        if not self.cancelled:
+            self.cancelled = True
+            self.tab.get_textview().set_editable(True)
+
+    def read(self):
+        'Runs on the worker thread, never touches the buffer'
+        try:
+            f = open(self.filename,'rb')
+            try:
+                stat = os.fstat(f.fileno())
+                if self.chunks is not None:
+                    self.read_all(f,stat)
+                elif self.tail_matches(f,stat):
+                    self.read_appended(f,stat)
+                else:
+                    self.error = 'changed again while reloading'
+            finally:
+                f.close()
+        except (IOError,OSError) as e:
+            self.error = e
+        gobject.idle_add(self.finish)
+
+    def read_appended(self,f,stat):
+        data = f.read(stat.st_size - self.old_signature[0])
+        self.sha = self.old_sha.copy()
+        self.sha.update(data)
+        self.tail = (self.old_tail + data)[-TAIL_SIZE:]
+        self.signature = (self.old_signature[0] + len(data),stat.st_mtime,self.sha.hexdigest())
+        self.appended = data.decode(self.encoding,'replace')
+        self.line_ending_counts = dict(self.tab.line_ending_counts)
+        if self.line_ending_counts:
+            count_line_endings(self.appended,self.line_ending_counts,
+                               self.old_tail.endswith('\r'))
+
+    def read_all(self,f,stat):
+        data = f.read()
+        self.sha = hashlib.sha1(data)
+        self.tail = data[-TAIL_SIZE:]
+        self.signature = (len(data),stat.st_mtime,self.sha.hexdigest())
+        encoding,self.bom = detect_encoding(data[:FileLoader.sample_size])
+        if self.bom or self.tab.bom:
+            # gained or lost a BOM, either way it says what the encoding is now
+            self.encoding = encoding
+        new_text = data[len(self.bom):].decode(self.encoding,'replace')
+        data = None
+        self.line_ending_counts = {'unix':0,'dos':0,'mac':0}
+        count_line_endings(new_text,self.line_ending_counts)
+        old_text = ''.join(self.chunks).decode('utf-8')
+        self.chunks = None
+        self.edits = line_edits(old_text,new_text)
+
+    def finish(self):
+        if self.cancelled:
+            return False
+        textview = self.tab.get_textview()
+        textbuffer = textview.get_buffer()
+        if self.error:
+            print("Error reloading file %s: %s" % (self.filename,self.error))
+        elif self.appended or self.edits:
+            # keep the same line at the top of the view
+            rect = textview.get_visible_rect()
+            top = textbuffer.create_mark(None,textview.get_line_at_y(rect.y)[0],True)
+            textbuffer.begin_user_action()
+            if self.appended:
+                textbuffer.insert(textbuffer.get_end_iter(),self.appended)
+            for start,end,text in self.edits or []:
+                textbuffer.delete(textbuffer.get_iter_at_offset(start),
+                                  textbuffer.get_iter_at_offset(end))
+                textbuffer.insert(textbuffer.get_iter_at_offset(start),text)
+            textbuffer.end_user_action()
+            textview.scroll_to_mark(top,0,True,0,0)
+            textbuffer.delete_mark(top)
+        if not self.error:
+            textbuffer.set_modified(False)
+        textview.set_editable(True)
+        if self.on_done:
+            self.on_done(self)
+        return False
@@ -0,0 +1,221 @@
+'''
+Copyright 2010 John Murphy
+This file is part of Coder.
+
+Coder is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+Coder is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with Coder.  If not, see <http://www.gnu.org/licenses/>.
+'''
+
+import os
+import time
+import threading
+import Queue
+import gobject
+import gtk
+
+from search import to_unicode
+from searchpool import start_pool,search_batch,matching_lines
+from instrument import wrap
+
+# version control directories aren't searched
+SKIP_DIRS = set(['.git','.hg','.svn','.bzr','CVS'])
+BATCH_SIZE = 64 # files per task sent to a worker process
+
+def walk_batches(folder,skip,state):
+    'Yields lists of files under folder, stops early if the search is cancelled'
+    batch = []
+    for dirpath,dirnames,filenames in os.walk(folder):
+        if state.cancelled:
+            return
+        dirnames[:] = [d for d in dirnames if d not in SKIP_DIRS]
+        for name in filenames:
+            path = os.path.join(dirpath,name)
+            if path in skip or os.path.islink(path):
+                continue
+            batch.append(path)
+            if len(batch) >= BATCH_SIZE:
+                yield batch
+                batch = []
+    if batch:
+        yield batch
+
+class FileSearch(object):
+    '''
+    Searches the open tabs and then every file under a folder.
+    Files are spread over a pool of worker processes in batches,
+    results stream back through a queue and on_results is called with
+    them on the main loop. on_done is called when the search finishes
+    or is cancelled.
+    '''
+
+    idle_time = 0.02
+
+    def __init__(self,folder,pattern,on_results,on_done):
+        self.folder = os.path.abspath(folder)
+        self.pattern = pattern
+        self.on_results = on_results
+        self.on_done = on_done
+        self.cancelled = False
+        self.finished = False
+        self.queue = Queue.Queue()
+
+    def start(self,tabs):
+        '''
+        Search the open tabs here, since their buffers may have unsaved
+        changes, and hand everything else to the worker processes
+        '''
+        skip = set()
+        found = []
+        for tab in tabs:
+            filename = tab.get_filename()
+            if not tab.is_materialized() or tab.is_read_only() or tab.loader:
+                continue
+            if filename:
+                skip.add(os.path.abspath(filename))
+            lines = self.search_tab(tab)
+            if lines:
+                found.append((filename or 'New Document',lines))
+        if found:
+            self.on_results(found)
+        args = ((batch,self.pattern.pattern,self.pattern.flags)
+                for batch in walk_batches(self.folder,skip,self))
+        results = start_pool().imap_unordered(search_batch,args)
+        thread = threading.Thread(target=self.collect,args=(results,))
+        thread.daemon = True
+        thread.start()
+        gobject.idle_add(wrap('FileSearch.deliver',self.deliver))
+
+    def search_tab(self,tab):
+        textbuffer = tab.get_textview().get_buffer()
+        start = textbuffer.get_start_iter()
+        end = textbuffer.get_end_iter()
+        text = to_unicode(textbuffer.get_slice(start,end))
+        return matching_lines(self.pattern,text)
+
+    def collect(self,results):
+        'Runs on a thread, moves results from the pool to the queue'
+        try:
+            for found in results:
+                if self.cancelled:
+                    break
+                if found:
+                    self.queue.put(found)
+        except Exception as e:
+            # a worker process dying ends up here
+            if not self.cancelled:
+                print("Error searching files: %s" % e)
+        self.queue.put(None)
+
+    def deliver(self):
+        'Runs on the main loop, hands queued results to on_results'
+        start_time = time.time()
+        while time.time() - start_time < self.idle_time:
+            try:
+                found = self.queue.get_nowait()
+            except Queue.Empty:
+                # nothing yet, check back shortly rather than spinning
+                gobject.timeout_add(50,wrap('FileSearch.deliver',self.deliver))
+                return False
+            if found is None:
+                self.finish()
+                return False
+            if not self.cancelled:
+                self.on_results(found)
+        return True
+
+    def cancel(self):
+        if not self.finished and not self.cancelled:
+            self.cancelled = True
+            # walk_batches stops handing out files, but don't wait for
+            # the batches the workers already have
+            self.queue.put(None)
+
+    def finish(self):
+        self.finished = True
+        self.on_done(self)
+
+class FindResultsPane(object):
+    '''
+    A list of search results, activating a row opens the file at that line
+    '''
+
+    def __init__(self,editor):
+        self.editor = editor
+        self.search = None
+        self.count = 0
+        self.store = gtk.ListStore(str,int,str,str)
+        self.treeview = gtk.TreeView(self.store)
+        for title,column in (('File',3),('Line',1),('Text',2)):
+            renderer = gtk.CellRendererText()
+            self.treeview.append_column(gtk.TreeViewColumn(title,renderer,text=column))
+        self.treeview.connect('row-activated',self.on_row_activated)
+        scrolled = gtk.ScrolledWindow()
+        scrolled.set_policy(gtk.POLICY_AUTOMATIC,gtk.POLICY_AUTOMATIC)
+        scrolled.add(self.treeview)
+        self.status = gtk.Label()
+        self.status.set_alignment(0,0.5)
+        self.cancel_button = gtk.Button(stock=gtk.STOCK_STOP)
+        self.cancel_button.connect('clicked',lambda w:self.cancel())
+        hbox = gtk.HBox(spacing=10)
+        hbox.pack_start(self.status,expand=True,fill=True)
+        hbox.pack_start(self.cancel_button,expand=False,fill=False)
+        self.widget = gtk.VBox()
+        self.widget.pack_start(hbox,expand=False,fill=True)
+        self.widget.pack_start(scrolled,expand=True,fill=True)
+        self.widget.show_all()
+
+    def get_widget(self):
+        return self.widget
+
+    def start(self,folder,pattern,tabs):
+        self.cancel()
+        self.store.clear()
+        self.count = 0
+        self.folder = os.path.abspath(folder)
+        self.status.set_text('Searching %s...' % self.folder)
+        self.cancel_button.set_sensitive(True)
+        self.search = FileSearch(folder,pattern,self.on_results,self.on_done)
+        self.search.start(tabs)
+
+    def cancel(self):
+        if self.search:
+            self.search.cancel()
+
+    def on_results(self,found):
+        for filename,lines in found:
+            if filename.startswith(self.folder + os.sep):
+                display = filename[len(self.folder)+1:]
+            else:
+                display = filename
+            for line_number,text in lines:
+                self.store.append([filename,line_number,text.encode('utf-8'),display])
+                self.count += 1
+        self.status.set_text('Searching %s... %d matches' % (self.folder,self.count))
+
+    def on_done(self,search):
+        if search is not self.search:
+            return
+        self.search = None
+        self.cancel_button.set_sensitive(False)
+        if search.cancelled:
+            text = 'Search stopped, %d matches'
+        else:
+            text = 'Search finished, %d matches'
+        self.status.set_text(text % self.count)
+
+    def on_row_activated(self,treeview,path,column):
+        treeiter = self.store.get_iter(path)
+        filename = self.store.get_value(treeiter,0)
+        line = self.store.get_value(treeiter,1)
+        if os.path.exists(filename):
+            self.editor.open_file_at_line(filename,line - 1)
@@ -0,0 +1,241 @@
+'''
+Copyright 2010 John Murphy
+This file is part of Coder.
+
+Coder is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+Coder is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with Coder.  If not, see <http://www.gnu.org/licenses/>.
+'''
+
+# How much syntax highlighting a tab gets. Source View's highlighter
+# works through the whole buffer, which can keep a core busy for a long
+# time on a huge file and crawls on very long lines, so big files only
+# get their visible lines highlighted with a few regular expressions,
+# and files with enormous lines aren't highlighted at all.
+
+import re
+import time
+import gobject
+
+from instrument import wrap
+
+FULL = 'full'
+VIEWPORT = 'viewport'
+NONE = 'none'
+POLICIES = (FULL,VIEWPORT,NONE)
+
+# past any of these, only the visible lines are highlighted
+FULL_SIZE = 2 * 1024 * 1024
+FULL_LINES = 50000
+FULL_LONGEST_LINE = 2000
+# past either of these, nothing is
+NONE_SIZE = 64 * 1024 * 1024
+NONE_LONGEST_LINE = 64 * 1024
+
+def choose_policy(size,lines,longest_line):
+    'The policy for a file of a size, line count and longest line, and why'
+    if longest_line > NONE_LONGEST_LINE:
+        return NONE,'%d char line' % longest_line
+    if size > NONE_SIZE:
+        return NONE,'%d MB' % (size // (1024 * 1024))
+    if longest_line > FULL_LONGEST_LINE:
+        return VIEWPORT,'%d char line' % longest_line
+    if size > FULL_SIZE:
+        return VIEWPORT,'%d MB' % (size // (1024 * 1024))
+    if lines > FULL_LINES:
+        return VIEWPORT,'%d lines' % lines
+    return FULL,None
+
+def create(tab,policy,reason):
+    'A started Highlighting for the policy'
+    highlighting = {FULL:FullHighlighting,
+                    VIEWPORT:ViewportHighlighting,
+                    NONE:Highlighting}[policy](tab,reason)
+    highlighting.start()
+    return highlighting
+
+class Highlighting(object):
+    '''
+    Applies a policy to a Tab's Source View buffer and keeps track of
+    what the highlighting costs, for the status bar.
+    This one is the policy of not highlighting at all.
+    reason is why it was picked, if it wasn't the usual one.
+    '''
+
+    policy = NONE
+
+    def __init__(self,tab,reason):
+        self.tab = tab
+        self.reason = reason
+        self.textview = tab.get_textview()
+        self.textbuffer = self.textview.get_buffer()
+
+    def start(self):
+        self.textbuffer.set_highlight_syntax(False)
+
+    def stop(self):
+        pass
+
+    def cost(self):
+        return ''
+
+    def describe(self):
+        description = self.policy
+        if self.reason:
+            description = '%s (%s)' % (description,self.reason)
+        cost = self.cost()
+        if cost:
+            description = '%s %s' % (description,cost)
+        return description
+
+class FullHighlighting(Highlighting):
+    '''
+    Source View highlights the whole buffer, the cost is how long it
+    took to get to the end of it the first time
+    '''
+
+    policy = FULL
+
+    def start(self):
+        self.elapsed = None
+        self.start_time = time.time()
+        self.updated_id = self.textbuffer.connect('highlight-updated',self.on_highlight_updated)
+        self.textbuffer.set_highlight_syntax(True)
+
+    def on_highlight_updated(self,textbuffer,start,end):
+        if end.is_end():
+            self.elapsed = time.time() - self.start_time
+            self.stop()
+            self.tab.update_statusbar()
+
+    def stop(self):
+        if self.updated_id:
+            self.textbuffer.disconnect(self.updated_id)
+            self.updated_id = None
+
+    def cost(self):
+        if self.elapsed is None:
+            return ''
+        return '%dms' % (self.elapsed * 1000)
+
+class ViewportHighlighting(Highlighting):
+    '''
+    Highlights comments, strings and numbers in the visible lines with
+    regular expressions, in idle time after scrolling or editing.
+    Only the first max_line_chars of a line are looked at. The cost is
+    how long the last pass took.
+    '''
+
+    policy = VIEWPORT
+    margin = 20 # lines above and below the visible ones
+    max_line_chars = 4000
+    styles = (('comment','def:comment','#00B82E'),
+              ('string','def:string','#C2FFA8'),
+              ('number','def:constant','#CCCCCC'))
+
+    def start(self):
+        self.textbuffer.set_highlight_syntax(False)
+        self.idle_id = None
+        self.elapsed = None
+        self.pattern = self.build_pattern(self.textbuffer.get_language())
+        self.tags = {}
+        if self.pattern is None:
+            self.handlers = []
+            return
+        scheme = self.textbuffer.get_style_scheme()
+        for name,style_id,default in self.styles:
+            color = default
+            style = scheme and scheme.get_style(style_id)
+            if style and style.get_property('foreground-set'):
+                color = style.get_property('foreground')
+            self.tags[name] = self.textbuffer.create_tag(None,foreground=color)
+        adjustment = self.tab.get_window().get_vadjustment()
+        self.handlers = [(adjustment,adjustment.connect('value-changed',self.queue)),
+                         (self.textbuffer,self.textbuffer.connect('changed',self.queue)),
+                         (self.textview,self.textview.connect('size-allocate',self.queue))]
+        self.queue()
+
+    def build_pattern(self,language):
+        'One pattern matching everything highlighted, or None for plain text'
+        if language is None:
+            return None
+        parts = []
+        line_comment = language.get_metadata('line-comment-start')
+        if line_comment:
+            parts.append('(?P<comment>%s.*)' % re.escape(line_comment))
+        block_start = language.get_metadata('block-comment-start')
+        block_end = language.get_metadata('block-comment-end')
+        if block_start and block_end:
+            # a line on its own can't tell if it's inside a block comment,
+            # so only ones that start on the line are found
+            parts.append('(?P<block>%s.*?(?:%s|$))' % (re.escape(block_start),re.escape(block_end)))
+        parts.append(r'(?P<string>"(?:[^"\\]|\\.)*"?|' + r"'(?:[^'\\]|\\.)*'?)")
+        parts.append(r'(?P<number>\b(?:0[xX][0-9a-fA-F]+|\d+\.?\d*(?:[eE][-+]?\d+)?)\b)')
+        return re.compile('|'.join(parts),re.UNICODE)
+
+    def queue(self,*args):
+        if self.idle_id is None:
+            self.idle_id = gobject.idle_add(wrap('ViewportHighlighting.highlight',self.highlight))
+
+    def highlight(self):
+        self.idle_id = None
+        start_time = time.time()
+        buf = self.textbuffer
+        rect = self.textview.get_visible_rect()
+        top = max(0,self.textview.get_line_at_y(rect.y)[0].get_line() - self.margin)
+        bottom = self.textview.get_line_at_y(rect.y + rect.height)[0].get_line() + self.margin
+        bottom = min(bottom,buf.get_line_count() - 1)
+        start = buf.get_iter_at_line(top)
+        end = buf.get_iter_at_line(bottom)
+        if not end.ends_line():
+            end.forward_to_line_end()
+        for tag in self.tags.values():
+            buf.remove_tag(tag,start,end)
+        for line in xrange(top,bottom + 1):
+            line_start = buf.get_iter_at_line(line)
+            if line_start.ends_line():
+                continue
+            line_end = line_start.copy()
+            if line_start.get_chars_in_line() > self.max_line_chars:
+                line_end.set_line_offset(self.max_line_chars)
+            else:
+                line_end.forward_to_line_end()
+            text = buf.get_text(line_start,line_end,False).decode('utf-8')
+            for match in self.pattern.finditer(text):
+                name = match.lastgroup
+                if name == 'block':
+                    name = 'comment'
+                buf.apply_tag(self.tags[name],
+                              buf.get_iter_at_line_offset(line,match.start()),
+                              buf.get_iter_at_line_offset(line,match.end()))
+        self.elapsed = time.time() - start_time
+        self.tab.update_statusbar()
+        return False
+
+    def stop(self):
+        if self.idle_id:
+            gobject.source_remove(self.idle_id)
+            self.idle_id = None
+        for obj,handler_id in self.handlers:
+            obj.disconnect(handler_id)
+        self.handlers = []
+        buf = self.textbuffer
+        tag_table = buf.get_tag_table()
+        for tag in self.tags.values():
+            buf.remove_tag(tag,buf.get_start_iter(),buf.get_end_iter())
+            tag_table.remove(tag)
+        self.tags = {}
+
+    def cost(self):
+        if self.elapsed is None:
+            return ''
+        return '%.1fms' % (self.elapsed * 1000)
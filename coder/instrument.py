@@ -0,0 +1,176 @@
+'''
+Copyright 2010 John Murphy
+This file is part of Coder.
+
+Coder is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+Coder is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with Coder.  If not, see <http://www.gnu.org/licenses/>.
+'''
+
+# Times signal handlers, idle callbacks and editor commands.
+# Turned on with --instrument[=FILE] or CODER_INSTRUMENT=FILE, when it's
+# off wrap() hands back the function it was given so nothing is slowed
+# down. Like the server client, this runs before gtk is imported and
+# only imports it for the stats pane.
+
+import os
+import time
+import json
+import collections
+
+FRAME_BUDGET = 1.0 / 60 # seconds a handler can take without dropping a frame
+SAMPLES = 1024 # recent calls kept per name for the percentiles
+
+stats = None
+output = None
+
+class Stats(object):
+    'Call count and worst time since startup, percentiles over recent calls'
+
+    def __init__(self):
+        self.count = 0
+        self.max = 0.0
+        self.total = 0.0
+        self.over_budget = 0
+        self.samples = collections.deque(maxlen=SAMPLES)
+
+    def add(self,elapsed):
+        self.count += 1
+        self.total += elapsed
+        self.samples.append(elapsed)
+        if elapsed > self.max:
+            self.max = elapsed
+        if elapsed > FRAME_BUDGET:
+            self.over_budget += 1
+
+    def percentile(self,p):
+        samples = sorted(self.samples)
+        if not samples:
+            return 0.0
+        return samples[min(len(samples)-1,int(len(samples) * p))]
+
+    def summary(self):
+        'Times are in milliseconds'
+        return {'count':self.count,
+                'p50_ms':self.percentile(0.5) * 1000.0,
+                'p99_ms':self.percentile(0.99) * 1000.0,
+                'max_ms':self.max * 1000.0,
+                'total_ms':self.total * 1000.0,
+                'over_budget':self.over_budget}
+
+def enable(filename=None):
+    'Start recording, the stats are written to filename on exit, or printed'
+    global stats,output
+    stats = {}
+    output = filename
+
+def enable_from_environment():
+    value = os.environ.get('CODER_INSTRUMENT')
+    if value and stats is None:
+        if value == '1':
+            value = None
+        enable(value)
+
+def enabled():
+    return stats is not None
+
+def wrap(name,function):
+    'function, timed under name if instrumenting'
+    if stats is None:
+        return function
+    record = stats.setdefault(name,Stats())
+    def timed(*args,**kwargs):
+        start = time.time()
+        try:
+            return function(*args,**kwargs)
+        finally:
+            record.add(time.time() - start)
+    timed.__name__ = function.__name__
+    timed.__doc__ = function.__doc__
+    return timed
+
+def wrap_methods(obj,prefix):
+    '''
+    Replace the public methods of obj with timed ones.
+    Call it before anything connects to them.
+    '''
+    if stats is None:
+        return
+    for name in dir(obj.__class__):
+        if name.startswith('_'):
+            continue
+        method = getattr(obj,name)
+        if callable(method) and hasattr(method,'im_self'):
+            setattr(obj,name,wrap('%s.%s' % (prefix,name),method))
+
+def summaries():
+    'Per name summaries, the worst p99 first'
+    rows = [(name,record.summary()) for name,record in stats.items() if record.count]
+    rows.sort(key=lambda row:row[1]['p99_ms'],reverse=True)
+    return rows
+
+def dump():
+    'Write or print the stats, called on exit'
+    if stats is None:
+        return
+    rows = summaries()
+    if output:
+        f = open(output,'w')
+        try:
+            json.dump({'frame_budget_ms':FRAME_BUDGET * 1000.0,
+                       'handlers':dict(rows)},f,indent=1,sort_keys=True)
+        finally:
+            f.close()
+        return
+    print('%-40s %8s %9s %9s %9s %6s' % ('handler','count','p50 ms','p99 ms','max ms','over'))
+    for name,summary in rows:
+        print('%-40s %8d %9.3f %9.3f %9.3f %6d' % (name,summary['count'],summary['p50_ms'],
+                                                    summary['p99_ms'],summary['max_ms'],
+                                                    summary['over_budget']))
+
+class StatsPane(object):
+    '''
+    The stats as a table in the panel, refreshed every second while shown
+    '''
+
+    refresh_time = 1000
+
+    def __init__(self):
+        import gobject
+        import gtk
+        self.store = gtk.ListStore(str,int,str,str,str,int)
+        treeview = gtk.TreeView(self.store)
+        titles = ('Handler','Count','p50 ms','p99 ms','Max ms','Over budget')
+        for column,title in enumerate(titles):
+            renderer = gtk.CellRendererText()
+            treeview.append_column(gtk.TreeViewColumn(title,renderer,text=column))
+        scrolled = gtk.ScrolledWindow()
+        scrolled.set_policy(gtk.POLICY_AUTOMATIC,gtk.POLICY_AUTOMATIC)
+        scrolled.add(treeview)
+        self.widget = scrolled
+        self.widget.show_all()
+        self.refresh()
+        gobject.timeout_add(self.refresh_time,self.refresh)
+
+    def get_widget(self):
+        return self.widget
+
+    def refresh(self):
+        if not self.widget.get_mapped():
+            # nobody's looking, don't make work
+            return True
+        self.store.clear()
+        for name,summary in summaries():
+            self.store.append([name,summary['count'],
+                               '%.3f' % summary['p50_ms'],'%.3f' % summary['p99_ms'],
+                               '%.3f' % summary['max_ms'],summary['over_budget']])
+        return True
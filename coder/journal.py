@@ -0,0 +1,276 @@
+'''
+Copyright 2010 John Murphy
+This file is part of Coder.
+
+Coder is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+Coder is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with Coder.  If not, see <http://www.gnu.org/licenses/>.
+'''
+
+import os,errno
+import json
+import gobject
+
+from config import config_path,write_file,encode_strings
+from instrument import wrap
+
+JOURNAL_DIR = 'journal'
+JOURNAL_VERSION = 1
+
+def journal_dir():
+    'The directory the journals are kept in, created if need be'
+    path = config_path(JOURNAL_DIR)
+    if not os.path.isdir(path):
+        try:
+            os.mkdir(path,0700)
+        except OSError as e:
+            print("Couldn't create journal directory %s: %s" % (path,e))
+    return path
+
+def process_running(pid):
+    try:
+        os.kill(pid,0)
+    except OSError as e:
+        return e.errno == errno.EPERM
+    return True
+
+def find_journals():
+    '''
+    The (path,header) of every journal left behind by a coder
+    that's no longer running, oldest first
+    '''
+    path = journal_dir()
+    try:
+        names = os.listdir(path)
+    except OSError:
+        return []
+    journals = []
+    for name in names:
+        if not name.endswith('.log'):
+            continue
+        try:
+            pid = int(name.split('-')[0])
+        except ValueError:
+            continue
+        if pid == os.getpid() or process_running(pid):
+            continue
+        filename = os.path.join(path,name)
+        header = read_journal(filename)[0]
+        if header:
+            journals.append((os.path.getmtime(filename),filename,header))
+    journals.sort()
+    return [(filename,header) for mtime,filename,header in journals]
+
+def read_journal(filename):
+    '''
+    The header and records of a journal, (None,[]) if it can't be read.
+    A record that was cut off by a crash in the middle of a write is left out.
+    '''
+    try:
+        f = open(filename,'rb')
+    except IOError:
+        return None,[]
+    try:
+        lines = f.read().split('\n')
+    finally:
+        f.close()
+    try:
+        header = json.loads(lines[0])
+    except ValueError:
+        return None,[]
+    if not isinstance(header,dict) or header.get('version') != JOURNAL_VERSION:
+        return None,[]
+    records = []
+    for line in lines[1:]:
+        try:
+            records.append(json.loads(line))
+        except ValueError:
+            break
+    return encode_strings(header),records
+
+def remove_journal(filename):
+    try:
+        os.remove(filename)
+    except OSError:
+        pass
+
+class Journal(object):
+    '''
+    Keeps a log of the edits made to a Tab's buffer since it was last
+    loaded or saved, so they can be replayed if coder dies before
+    they're saved.
+    Each record is [offset,deleted,inserted], offsets and lengths in
+    characters, a deleted length of -1 replacing the whole buffer.
+    The signal handlers only add to a list, merging with the record
+    before when they can so typing a word makes one record. The list
+    is written out on a timer. Once the log gets well past the size
+    of the text it's rewritten as a single record holding all of it.
+    Nothing is written until there's an edit, so a journal file only
+    exists for a tab that has been edited.
+    '''
+
+    flush_interval = 1000 # milliseconds
+    compact_size = 1024 * 1024
+    count = 0
+
+    def __init__(self,textbuffer):
+        self.textbuffer = textbuffer
+        Journal.count += 1
+        self.path = os.path.join(journal_dir(),'%d-%d.log' % (os.getpid(),Journal.count))
+        self.header = None
+        self.recording = False
+        self.written = False
+        self.size = 0
+        self.pending = []
+        self.flush_id = None
+        textbuffer.connect('insert-text',wrap('Journal.inserted',self.inserted))
+        textbuffer.connect('delete-range',wrap('Journal.deleted',self.deleted))
+
+    def reset(self,filename,base):
+        '''
+        Start a new log for a buffer that now matches the file,
+        base is the sha1 of the file or None for a new document
+        '''
+        self.stop()
+        self.header = {'version':JOURNAL_VERSION,'filename':filename,'base':base}
+        self.recording = True
+
+    def stop(self):
+        'Stop recording and forget the log, while the buffer is being loaded or closed'
+        self.recording = False
+        self.pending = []
+        if self.flush_id:
+            gobject.source_remove(self.flush_id)
+            self.flush_id = None
+        if self.written:
+            remove_journal(self.path)
+            self.written = False
+            self.size = 0
+
+    def close(self):
+        self.stop()
+
+    def inserted(self,textbuffer,textiter,text,length):
+        if not self.recording:
+            return
+        offset = textiter.get_offset()
+        text = text.decode('utf-8')
+        if self.pending:
+            last = self.pending[-1]
+            if offset == last[0] + len(last[2]):
+                last[2] += text
+                return
+        self.add([offset,0,text])
+
+    def deleted(self,textbuffer,start,end):
+        if not self.recording:
+            return
+        start = start.get_offset()
+        end = end.get_offset()
+        if start > end:
+            start,end = end,start
+        if self.pending:
+            last = self.pending[-1]
+            last_end = last[0] + len(last[2])
+            if last[0] <= start and end <= last_end:
+                # taking back some of what was just inserted
+                last[2] = last[2][:start-last[0]] + last[2][end-last[0]:]
+                return
+            if end == last[0] and last[1] >= 0:
+                # backspacing, the characters before weren't touched yet
+                last[0] = start
+                last[1] += end - start
+                return
+            if start == last_end and last[1] >= 0:
+                # deleting forwards from the end of the last record
+                last[1] += end - start
+                return
+        self.add([start,end - start,u''])
+
+    def add(self,record):
+        self.pending.append(record)
+        if not self.flush_id:
+            self.flush_id = gobject.timeout_add(self.flush_interval,wrap('Journal.flush',self.flush))
+
+    def record_whole_text(self):
+        'Log the whole buffer, for when the file no longer matches the log\'s base'
+        if self.recording:
+            self.pending = []
+            self.add([0,-1,self.get_text()])
+
+    def get_text(self):
+        buf = self.textbuffer
+        return buf.get_text(buf.get_start_iter(),buf.get_end_iter(),True).decode('utf-8')
+
+    def flush(self):
+        'Write the pending records to the end of the log'
+        self.flush_id = None
+        if not self.pending:
+            return False
+        lines = [json.dumps(record,separators=(',',':')) for record in self.pending]
+        self.pending = []
+        if not self.written:
+            lines.insert(0,json.dumps(self.header,separators=(',',':')))
+        data = '\n'.join(lines) + '\n'
+        try:
+            if self.size + len(data) > max(self.compact_size,2 * self.textbuffer.get_char_count()):
+                self.compact()
+            else:
+                f = open(self.path,'ab')
+                try:
+                    f.write(data)
+                finally:
+                    f.close()
+                self.size += len(data)
+            self.written = True
+        except (IOError,OSError) as e:
+            print("Couldn't write journal %s: %s" % (self.path,e))
+        return False
+
+    def compact(self):
+        'Rewrite the log as one record holding the whole buffer'
+        data = '\n'.join([json.dumps(self.header,separators=(',',':')),
+                          json.dumps([0,-1,self.get_text()],separators=(',',':'))]) + '\n'
+        write_file(self.path,data)
+        self.size = len(data)
+
+    def replay(self,filename):
+        '''
+        Apply the edits in a journal left behind by a crash to the buffer,
+        which has to hold what the journal started from.
+        The edits are recorded in this tab's journal as they're made,
+        and the old journal is removed.
+        Returns an error message if it couldn't be replayed.
+        '''
+        header,records = read_journal(filename)
+        if header is None:
+            return "can't be read"
+        # nothing before the last copy of the whole text matters
+        for i in xrange(len(records)-1,-1,-1):
+            if records[i][1] == -1:
+                records = records[i:]
+                break
+        else:
+            if header.get('base') != self.header.get('base'):
+                return "the file has changed since"
+        buf = self.textbuffer
+        buf.begin_user_action()
+        for offset,deleted,inserted in records:
+            if deleted == -1:
+                buf.delete(buf.get_start_iter(),buf.get_end_iter())
+            elif deleted:
+                buf.delete(buf.get_iter_at_offset(offset),buf.get_iter_at_offset(offset + deleted))
+            if inserted:
+                buf.insert(buf.get_iter_at_offset(offset),inserted.encode('utf-8'))
+        buf.end_user_action()
+        remove_journal(filename)
+        return None
@@ -0,0 +1,182 @@
+'''
+Copyright 2010 John Murphy
+This file is part of Coder.
+
+Coder is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+Coder is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with Coder.  If not, see <http://www.gnu.org/licenses/>.
+'''
+
+# Syntax highlighting languages and the style scheme.
+# Nothing is set up until a tab first asks for it. Working out which
+# language goes with which file means parsing every language spec, so
+# the result is cached in the config directory and only rebuilt when
+# a spec is added, removed or changed.
+
+import os
+import re
+import json
+import fnmatch
+import mimetypes
+
+from coder import MAIN_PATH
+from config import config_path,write_file,encode_strings
+
+CACHE_FILE = 'languages.json'
+CACHE_VERSION = 1
+STYLE = 'coder'
+
+# interpreters named in a #! line whose name isn't the language id
+SHEBANG_ALIASES = {'bash':'sh','dash':'sh','ksh':'sh','zsh':'sh',
+                   'node':'js','nodejs':'js','gawk':'awk','mawk':'awk',
+                   'tclsh':'tcl','wish':'tcl','make':'makefile','octave':'octave'}
+
+language_manager = None
+scheme = None
+scheme_loaded = False
+language_map = None
+
+def get_language_manager():
+    global language_manager
+    if language_manager is None:
+        import gtksourceview2
+        language_manager = gtksourceview2.language_manager_get_default()
+    return language_manager
+
+def get_scheme():
+    'The coder style scheme, or None if it can\'t be found'
+    global scheme,scheme_loaded
+    if not scheme_loaded:
+        scheme_loaded = True
+        import gtksourceview2
+        style_scheme_manager = gtksourceview2.style_scheme_manager_get_default()
+        styles_path = os.path.join(MAIN_PATH,'data')
+        if os.path.exists(styles_path):
+            style_scheme_manager.prepend_search_path(styles_path)
+            scheme = style_scheme_manager.get_scheme(STYLE)
+            if not scheme:
+                print("Couldn't load style: %s" % STYLE)
+        else:
+            print("Couldn't find styles directory")
+    return scheme
+
+def get_language(lang_id):
+    if lang_id is None:
+        return None
+    return get_language_manager().get_language(lang_id)
+
+def spec_stamp(search_path):
+    'The modification time of every language spec directory and file'
+    stamp = []
+    for folder in search_path:
+        try:
+            names = os.listdir(folder)
+            stamp.append([folder,os.path.getmtime(folder)])
+        except OSError:
+            continue
+        for name in sorted(names):
+            if name.endswith('.lang'):
+                path = os.path.join(folder,name)
+                try:
+                    stamp.append([path,os.path.getmtime(path)])
+                except OSError:
+                    pass
+    return stamp
+
+def build_map(manager):
+    'Ask every language what files it is for'
+    names = {}
+    extensions = {}
+    globs = []
+    mime_types = {}
+    shebangs = {}
+    for lang_id in manager.get_language_ids():
+        language = manager.get_language(lang_id)
+        for glob in language.get_globs():
+            if glob.startswith('*.') and not re.search(r'[*?\[]',glob[2:]):
+                extensions.setdefault(glob[2:],lang_id)
+            elif not re.search(r'[*?\[]',glob):
+                names.setdefault(glob,lang_id)
+            else:
+                globs.append([glob,lang_id])
+        for mime_type in language.get_mime_types():
+            mime_types.setdefault(mime_type,lang_id)
+        shebangs.setdefault(lang_id,lang_id)
+    for interpreter,lang_id in SHEBANG_ALIASES.items():
+        if lang_id in shebangs:
+            shebangs.setdefault(interpreter,lang_id)
+    return {'names':names,'extensions':extensions,'globs':globs,
+            'mime_types':mime_types,'shebangs':shebangs}
+
+def load_map():
+    '''
+    The language map from the cache if it is still good,
+    otherwise build it and cache it
+    '''
+    manager = get_language_manager()
+    stamp = spec_stamp(manager.get_search_path())
+    path = config_path(CACHE_FILE)
+    try:
+        f = open(path,'rb')
+        try:
+            cache = encode_strings(json.load(f))
+        finally:
+            f.close()
+        if cache.get('version') == CACHE_VERSION and cache.get('stamp') == stamp:
+            return cache
+    except (IOError,ValueError):
+        pass
+    cache = build_map(manager)
+    cache['version'] = CACHE_VERSION
+    cache['stamp'] = stamp
+    try:
+        write_file(path,json.dumps(cache,separators=(',',':')))
+    except (IOError,OSError) as e:
+        print("Couldn't cache languages: %s" % e)
+    return cache
+
+def get_map():
+    global language_map
+    if language_map is None:
+        language_map = load_map()
+    return language_map
+
+def guess_language(filename,first_line=None):
+    '''
+    The id of the language for a file, from its name, its mime type or
+    a #! line at the start of it. None if nothing matches.
+    '''
+    language_map = get_map()
+    basename = os.path.basename(filename)
+    lang_id = language_map['names'].get(basename)
+    if lang_id:
+        return lang_id
+    ext = os.path.splitext(basename)[1][1:]
+    lang_id = language_map['extensions'].get(ext) or language_map['extensions'].get(ext.lower())
+    if lang_id:
+        return lang_id
+    for glob,lang_id in language_map['globs']:
+        if fnmatch.fnmatch(basename,glob):
+            return lang_id
+    mime_type = mimetypes.guess_type(basename)[0]
+    lang_id = language_map['mime_types'].get(mime_type)
+    if lang_id:
+        return lang_id
+    if first_line and first_line.startswith('#!'):
+        words = first_line[2:].split()
+        if words and os.path.basename(words[0]) == 'env':
+            words = words[1:]
+        if words:
+            # python2.7 -> python
+            interpreter = os.path.basename(words[0]).rstrip('0123456789.')
+            return language_map['shebangs'].get(interpreter)
+    return None
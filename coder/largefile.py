@@ -0,0 +1,340 @@
+'''
+Copyright 2010 John Murphy
+This file is part of Coder.
+
+Coder is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+Coder is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with Coder.  If not, see <http://www.gnu.org/licenses/>.
+'''
+
+import os
+import mmap
+import time
+import codecs
+import array
+import bisect
+import gobject
+import gtk
+import pango
+
+from coder import SOURCE_VIEW
+from instrument import wrap
+from fileio import detect_encoding
+
+# files at least this big are opened read-only with a LargeFileViewer
+LARGE_FILE_SIZE = 128 * 1024 * 1024
+
+def is_large_file(filename):
+    try:
+        return os.path.getsize(filename) >= LARGE_FILE_SIZE
+    except OSError:
+        return False
+
+class LargeFileViewer(object):
+    '''
+    A read-only view of a memory mapped file.
+    Only the lines around the viewport are put in the Tab's buffer,
+    a separate scrollbar moves the window through the whole file.
+    Line numbers come from a sparse index that holds the number of
+    newlines before each block of the file, so it stays small no matter
+    how big the file is.
+    Reading a mapped page past the end of a file that has been truncated
+    kills the process with SIGBUS, so the size is checked before the
+    mapping is used and the file is mapped again if it has shrunk.
+    '''
+
+    block_size = 1024 * 1024
+    max_window_bytes = 1024 * 1024 # stops one huge line filling the buffer
+    index_time = 0.02 # seconds spent indexing per idle callback
+    scroll_lines = 3
+
+    def __init__(self,tab,filename):
+        self.tab = tab
+        self.filename = filename
+        # kept open to check the size and map it again
+        self.file = open(filename,'rb')
+        self.map_file()
+        self.encoding,self.bom = detect_encoding(self.map[:64 * 1024])
+        self.top = 0
+        self.page_lines = 50
+        self.index_id = None
+        self.index_file = None
+        self.create_widgets()
+        self.start_index()
+        self.render()
+
+    def map_file(self):
+        self.size = os.fstat(self.file.fileno()).st_size
+        if self.size:
+            self.map = mmap.mmap(self.file.fileno(),0,access=mmap.ACCESS_READ)
+        else:
+            # an empty file can't be mapped, an empty string reads the same
+            self.map = ''
+
+    def start_index(self):
+        # counts[i] is the number of newlines before byte i * block_size
+        self.counts = array.array('L',[0])
+        self.index_file = open(self.filename,'rb')
+        self.index_id = gobject.idle_add(wrap('LargeFileViewer.build_index',self.build_index))
+
+    def stop_index(self):
+        if self.index_id:
+            gobject.source_remove(self.index_id)
+            self.index_id = None
+        if self.index_file and not self.index_file.closed:
+            self.index_file.close()
+
+    def check_size(self):
+        '''
+        Map the file again if it has been truncated, starting the
+        index over, before anything reads past its new end
+        '''
+        if os.fstat(self.file.fileno()).st_size >= self.size:
+            return
+        self.stop_index()
+        self.close_map()
+        self.map_file()
+        self.top = 0
+        self.start_index()
+        self.update_adjustment()
+
+    def close_map(self):
+        if isinstance(self.map,mmap.mmap):
+            self.map.close()
+
+    def create_widgets(self):
+        textview = self.tab.get_textview()
+        textview.set_editable(False)
+        # the view only ever holds a screenful of lines,
+        # don't let that decide how tall the window is
+        textview.set_size_request(-1,1)
+        textview.connect('key-press-event',self.on_key_press_event)
+        textview.connect('scroll-event',self.on_scroll_event)
+        textview.connect('size-allocate',self.on_size_allocate)
+        self.adjustment = gtk.Adjustment(0,0,1,1,self.page_lines,self.page_lines)
+        self.adjustment.connect('value-changed',self.on_value_changed)
+        scrolled = gtk.ScrolledWindow()
+        scrolled.set_policy(gtk.POLICY_AUTOMATIC,gtk.POLICY_NEVER)
+        scrolled.add(textview)
+        self.widget = gtk.HBox()
+        self.widget.pack_start(scrolled,expand=True,fill=True)
+        self.widget.pack_start(gtk.VScrollbar(self.adjustment),expand=False,fill=True)
+        self.widget.show_all()
+
+    def get_widget(self):
+        return self.widget
+
+    def close(self):
+        self.stop_index()
+        self.close_map()
+        self.file.close()
+
+    def indexed(self):
+        'True once the whole file has been indexed'
+        return self.index_file.closed
+
+    def line_count(self):
+        'Number of lines known so far'
+        return self.counts[-1] + 1
+
+    def build_index(self):
+        start_time = time.time()
+        while time.time() - start_time < self.index_time:
+            data = self.index_file.read(self.block_size)
+            if data:
+                self.counts.append(self.counts[-1] + data.count('\n'))
+            if len(data) < self.block_size:
+                self.index_file.close()
+                self.index_id = None
+                break
+        self.update_adjustment()
+        self.tab.update_statusbar()
+        return self.index_id is not None
+
+    def count_lines(self,start,end):
+        'Count newlines in the mapping without copying more than a block at a time'
+        count = 0
+        while start < end:
+            stop = min(end,start + self.block_size)
+            count += self.map[start:stop].count('\n')
+            start = stop
+        return count
+
+    def line_offset(self,line):
+        'Byte offset of the start of a line'
+        if line <= 0:
+            return 0
+        # find the block holding the newline that ends line-1
+        block = bisect.bisect_left(self.counts,line) - 1
+        offset = block * self.block_size
+        remaining = line - self.counts[block]
+        while remaining > 0:
+            offset = self.map.find('\n',offset)
+            if offset < 0:
+                return self.size
+            offset += 1
+            remaining -= 1
+        return offset
+
+    def offset_line(self,offset):
+        'Line number of a byte offset'
+        block = min(offset // self.block_size,len(self.counts)-1)
+        start = block * self.block_size
+        return self.counts[block] + self.count_lines(start,offset)
+
+    def update_adjustment(self):
+        self.adjustment.set_all(self.top,0,self.line_count(),1,
+                                self.page_lines,self.page_lines)
+
+    def decode(self,data):
+        return data.decode(self.encoding,'replace')
+
+    def render(self):
+        'Put the lines from self.top into the buffer'
+        self.check_size()
+        start = self.line_offset(self.top)
+        end = self.line_offset(self.top + self.page_lines)
+        end = min(end,start + self.max_window_bytes)
+        text = self.decode(self.map[start:end])
+        textbuffer = self.tab.get_textview().get_buffer()
+        if SOURCE_VIEW:
+            textbuffer.begin_not_undoable_action()
+        textbuffer.set_text(text)
+        if SOURCE_VIEW:
+            textbuffer.end_not_undoable_action()
+        textbuffer.set_modified(False)
+        self.window_start = start
+        # the cursor's line in the file moves with the window
+        self.tab.update_statusbar()
+
+    def scroll_to_line(self,line):
+        top = max(0,min(line,self.line_count() - self.page_lines))
+        if top != self.top:
+            self.top = top
+            self.adjustment.set_value(top)
+            self.render()
+
+    def goto_line(self,line):
+        'Scroll to a line and put the cursor on it'
+        line = max(0,min(line,self.line_count()-1))
+        self.scroll_to_line(line - self.page_lines/3)
+        textbuffer = self.tab.get_textview().get_buffer()
+        textbuffer.place_cursor(textbuffer.get_iter_at_line(line - self.top))
+
+    def cursor_offset(self):
+        'Byte offset in the file of the end of the selection or the cursor'
+        textbuffer = self.tab.get_textview().get_buffer()
+        bounds = textbuffer.get_selection_bounds()
+        if bounds:
+            cur_iter = bounds[1]
+        else:
+            cur_iter = textbuffer.get_iter_at_mark(textbuffer.get_insert())
+        line_start = self.line_offset(self.top + cur_iter.get_line())
+        line_end = self.map.find('\n',line_start)
+        if line_end < 0:
+            line_end = self.size
+        # no more of a line than render shows
+        line_end = min(line_end,line_start + self.max_window_bytes)
+        return line_start + self.char_bytes(self.map[line_start:line_end],cur_iter.get_line_offset())
+
+    def char_bytes(self,data,chars):
+        '''
+        How many bytes of data decode to the first chars characters.
+        Bytes that don't decode turn into one replacement character each
+        however many there are, so this decodes growing prefixes rather
+        than encoding the text again.
+        '''
+        low = 0
+        high = len(data)
+        while low < high:
+            middle = (low + high) // 2
+            # not final, so a character cut in half isn't counted
+            decoder = codecs.getincrementaldecoder(self.encoding)('replace')
+            if len(decoder.decode(data[:middle])) < chars:
+                low = middle + 1
+            else:
+                high = middle
+        return low
+
+    def find(self,pattern):
+        '''
+        Search the mapping with a byte string pattern, starting at the
+        cursor and wrapping around to the beginning.
+        Selects the match if found.
+        '''
+        self.check_size()
+        cur = self.cursor_offset()
+        match = pattern.search(self.map,cur)
+        if not match:
+            match = pattern.search(self.map,0,cur)
+        if not match:
+            return False
+        line = self.offset_line(match.start())
+        line_start = self.line_offset(line)
+        self.goto_line(line)
+        textbuffer = self.tab.get_textview().get_buffer()
+        col = len(self.decode(self.map[line_start:match.start()]))
+        length = len(self.decode(match.group(0)))
+        match_start = textbuffer.get_iter_at_line_offset(line - self.top,col)
+        match_end = match_start.copy()
+        match_end.forward_chars(length)
+        textbuffer.select_range(match_start,match_end)
+        return True
+
+    def on_value_changed(self,adjustment):
+        top = int(adjustment.get_value())
+        if top != self.top:
+            self.top = top
+            self.render()
+
+    def on_scroll_event(self,widget,event):
+        if event.direction == gtk.gdk.SCROLL_UP:
+            self.scroll_to_line(self.top - self.scroll_lines)
+            return True
+        elif event.direction == gtk.gdk.SCROLL_DOWN:
+            self.scroll_to_line(self.top + self.scroll_lines)
+            return True
+        return False
+
+    def on_key_press_event(self,widget,event):
+        '''
+        Moves the window when the cursor would leave it
+        '''
+        keyname = gtk.gdk.keyval_name(event.keyval)
+        textbuffer = self.tab.get_textview().get_buffer()
+        cursor = textbuffer.get_iter_at_mark(textbuffer.get_insert())
+        line = self.top + cursor.get_line()
+        if keyname == 'Page_Up':
+            self.goto_line(line - self.page_lines)
+        elif keyname == 'Page_Down':
+            self.goto_line(line + self.page_lines)
+        elif keyname == 'Up' and cursor.get_line() == 0:
+            self.goto_line(line - 1)
+        elif keyname == 'Down' and cursor.get_line() >= self.page_lines - 1:
+            self.goto_line(line + 1)
+        elif keyname == 'Home' and event.state & gtk.gdk.CONTROL_MASK:
+            self.goto_line(0)
+        elif keyname == 'End' and event.state & gtk.gdk.CONTROL_MASK:
+            self.goto_line(self.line_count() - 1)
+        else:
+            return False
+        return True
+
+    def on_size_allocate(self,widget,allocation):
+        metrics = widget.get_pango_context().get_metrics(widget.style.font_desc)
+        line_height = (metrics.get_ascent() + metrics.get_descent()) / pango.SCALE
+        page_lines = max(1,allocation.height / max(1,line_height))
+        if page_lines != self.page_lines:
+            self.page_lines = page_lines
+            self.update_adjustment()
+            # re-render outside of the size allocation
+            gobject.idle_add(self.render)
@@ -18,6 +18,9 @@ along with Coder.  If not, see <http://www.gnu.org/licenses/>.
 
 import gtk
 
+import instrument
+import highlight
+
 def build_main_menu(editor,accelgroup=None):
     menubar = gtk.MenuBar()
 
@@ -72,6 +75,32 @@ def build_main_menu(editor,accelgroup=None):
     item = gtk.ImageMenuItem(gtk.STOCK_FIND_AND_REPLACE,accelgroup)
     item.connect('activate',lambda w:editor.replace())
     menu.append(item)
+    item = gtk.ImageMenuItem('Find _Next')
+    image = gtk.image_new_from_stock(gtk.STOCK_GO_DOWN,gtk.ICON_SIZE_MENU)
+    item.set_image(image)
+    key, mod = gtk.accelerator_parse('F3')
+    item.add_accelerator('activate',accelgroup,key,mod,gtk.ACCEL_VISIBLE)
+    item.connect('activate',lambda w:editor.find_next())
+    menu.append(item)
+    item = gtk.ImageMenuItem('Find _Previous')
+    image = gtk.image_new_from_stock(gtk.STOCK_GO_UP,gtk.ICON_SIZE_MENU)
+    item.set_image(image)
+    key, mod = gtk.accelerator_parse('<Shift>F3')
+    item.add_accelerator('activate',accelgroup,key,mod,gtk.ACCEL_VISIBLE)
+    item.connect('activate',lambda w:editor.find_previous())
+    menu.append(item)
+    item = gtk.ImageMenuItem('_Clear Highlights')
+    image = gtk.image_new_from_stock(gtk.STOCK_CLEAR,gtk.ICON_SIZE_MENU)
+    item.set_image(image)
+    item.connect('activate',lambda w:editor.clear_highlights())
+    menu.append(item)
+    item = gtk.ImageMenuItem('Find in _Files')
+    image = gtk.image_new_from_stock(gtk.STOCK_DIRECTORY,gtk.ICON_SIZE_MENU)
+    item.set_image(image)
+    key, mod = gtk.accelerator_parse('<Ctrl><Shift>F')
+    item.add_accelerator('activate',accelgroup,key,mod,gtk.ACCEL_VISIBLE)
+    item.connect('activate',lambda w:editor.find_in_files())
+    menu.append(item)
     item = gtk.ImageMenuItem('_Goto Line')
     image = gtk.image_new_from_stock(gtk.STOCK_JUMP_TO,gtk.ICON_SIZE_MENU)
     item.set_image(image)
@@ -92,6 +121,21 @@ def build_main_menu(editor,accelgroup=None):
     item.add_accelerator('activate',accelgroup,key,mod,gtk.ACCEL_VISIBLE)        
     item.connect('activate',lambda w:editor.run())
     menu.append(item)
+    item = gtk.CheckMenuItem('Keep _Interpreter Warm')
+    item.set_active(editor.warm_interpreter)
+    item.connect('toggled',lambda w:editor.set_warm_interpreter(w.get_active()))
+    menu.append(item)
+    item = gtk.MenuItem('_Highlighting')
+    submenu = gtk.Menu()
+    for label,policy in (('_Automatic',None),
+                         ('_Full',highlight.FULL),
+                         ('_Visible Lines Only',highlight.VIEWPORT),
+                         ('_Off',highlight.NONE)):
+        submenu_item = gtk.MenuItem(label)
+        submenu_item.connect('activate',lambda w,policy=policy:editor.set_highlighting(policy))
+        submenu.append(submenu_item)
+    item.set_submenu(submenu)
+    menu.append(item)
     item = gtk.ImageMenuItem('Replace _Tabs with Spaces')
     image = gtk.image_new_from_stock(gtk.STOCK_GO_FORWARD,gtk.ICON_SIZE_MENU)
     item.set_image(image)
@@ -128,10 +172,20 @@ def build_main_menu(editor,accelgroup=None):
     item = gtk.ImageMenuItem('Convert Line Endings')
     image = gtk.image_new_from_stock(gtk.STOCK_REMOVE,gtk.ICON_SIZE_MENU)
     item.set_image(image)
-    #key, mod = gtk.accelerator_parse('<Ctrl>M')
-    #item.add_accelerator('activate',accelgroup,key,mod,gtk.ACCEL_VISIBLE)
-    item.connect('activate',lambda w:editor.convert_line_endings())
-    menu.append(item)
+    submenu = gtk.Menu()
+    for label,line_endings in (('To _Unix (LF)','unix'),
+                               ('To _Dos (CRLF)','dos'),
+                               ('To _Mac (CR)','mac')):
+        submenu_item = gtk.MenuItem(label)
+        submenu_item.connect('activate',
+                             lambda w,line_endings=line_endings:editor.convert_line_endings(line_endings))
+        submenu.append(submenu_item)
+    item.set_submenu(submenu)
+    menu.append(item)
+    if instrument.enabled():
+        item = gtk.CheckMenuItem('Handler _Stats')
+        item.connect('toggled',lambda w:editor.show_stats(w.get_active()))
+        menu.append(item)
     menu_item.set_submenu(menu)
     menubar.add(menu_item)
     
@@ -0,0 +1,139 @@
+'''
+Copyright 2010 John Murphy
+This file is part of Coder.
+
+Coder is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+Coder is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with Coder.  If not, see <http://www.gnu.org/licenses/>.
+'''
+
+# Records where the time goes while the editor starts up.
+# Turned on with --profile-startup, everything here is a no-op otherwise.
+# Nothing in this module imports gtk, so it can time that import too.
+
+import os
+import sys
+import time
+import json
+import __builtin__
+
+profile = None
+
+def cpu_time():
+    'User and system CPU time of the process, including worker threads'
+    times = os.times()
+    return times[0] + times[1]
+
+class Timer(object):
+    'Times a with block and adds it to the profile'
+
+    def __init__(self,kind,name):
+        self.kind = kind
+        self.name = name
+
+    def __enter__(self):
+        self.wall = time.time()
+        self.cpu = cpu_time()
+        return self
+
+    def __exit__(self,exc_type,exc_value,traceback):
+        if profile:
+            profile.add(self.kind,self.name,time.time() - self.wall,cpu_time() - self.cpu)
+        return False
+
+class NullTimer(object):
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self,exc_type,exc_value,traceback):
+        return False
+
+class StartupProfile(object):
+    '''
+    Wall and CPU time for each startup phase, file load and import.
+    Imports are timed by wrapping __import__, only imports that actually
+    load something are kept. Their times include the imports they set off,
+    depth says how deeply nested each one was.
+    '''
+
+    def __init__(self,output=None):
+        self.output = output
+        self.records = []
+        self.depth = 0
+        self.wall = time.time()
+        self.cpu = cpu_time()
+        self.original_import = __builtin__.__import__
+        __builtin__.__import__ = self.timed_import
+
+    def timed_import(self,name,*args,**kwargs):
+        modules = len(sys.modules)
+        wall = time.time()
+        cpu = cpu_time()
+        self.depth += 1
+        try:
+            return self.original_import(name,*args,**kwargs)
+        finally:
+            self.depth -= 1
+            if len(sys.modules) > modules:
+                self.add('import',name,time.time() - wall,cpu_time() - cpu,self.depth)
+
+    def add(self,kind,name,wall,cpu,depth=0):
+        self.records.append({'kind':kind,'name':name,'wall':wall,'cpu':cpu,'depth':depth})
+
+    def stop(self):
+        __builtin__.__import__ = self.original_import
+        self.total_wall = time.time() - self.wall
+        self.total_cpu = cpu_time() - self.cpu
+
+    def report(self):
+        self.stop()
+        records = sorted(self.records,key=lambda r:r['wall'],reverse=True)
+        if self.output:
+            data = {'wall':self.total_wall,'cpu':self.total_cpu,'records':records}
+            f = open(self.output,'w')
+            try:
+                json.dump(data,f,indent=1)
+            finally:
+                f.close()
+            print("Startup profile written to %s" % self.output)
+            return
+        print("Startup took %.3fs wall, %.3fs cpu" % (self.total_wall,self.total_cpu))
+        print("%9s %9s  %-7s %s" % ('wall','cpu','kind','name'))
+        for record in records:
+            print("%9.4f %9.4f  %-7s %s%s" % (record['wall'],record['cpu'],record['kind'],
+                                             '  ' * record['depth'],record['name']))
+
+def start(output=None):
+    global profile
+    profile = StartupProfile(output)
+
+def enabled():
+    return profile is not None
+
+def phase(name):
+    'Use as "with phase(name):" to time a part of startup'
+    if profile:
+        return Timer('phase',name)
+    return NullTimer()
+
+def add(kind,name,wall,cpu):
+    'Add something that was timed some other way, like a file loading in the background'
+    if profile:
+        profile.add(kind,name,wall,cpu)
+
+def report():
+    'Print or write out the profile, after which nothing more is recorded'
+    global profile
+    if profile:
+        profile.report()
+        profile = None
@@ -0,0 +1,333 @@
+'''
+Copyright 2010 John Murphy
+This file is part of Coder.
+
+Coder is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+Coder is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with Coder.  If not, see <http://www.gnu.org/licenses/>.
+'''
+
+import os
+import sys
+import re
+import fcntl
+import errno
+import signal
+import subprocess
+import gobject
+import gtk
+import pango
+
+from instrument import wrap
+
+# File "script.py", line 12 from Python, script.c:12: from compilers
+LOCATION_PATTERNS = [re.compile(r'File "([^"]+)", line (\d+)'),
+                     re.compile(r'^([^:\s]+):(\d+):')]
+
+WORKER = os.path.join(os.path.dirname(os.path.abspath(__file__)),'runworker.py')
+
+def command_for(filename):
+    'The arguments to run a file with, or None if it can\'t be run'
+    if filename.endswith('.py'):
+        return [sys.executable,filename]
+    if os.access(filename,os.X_OK):
+        return [filename]
+    return None
+
+def spawn(args,cwd):
+    '''
+    Start a program without a shell, reading its output through pipes.
+    It gets its own process group so it can be killed along with
+    anything it starts.
+    '''
+    env = dict(os.environ)
+    # python output should turn up as it's written, not when a buffer fills
+    env['PYTHONUNBUFFERED'] = '1'
+    devnull = open(os.devnull)
+    try:
+        return subprocess.Popen(args,cwd=cwd,env=env,close_fds=True,preexec_fn=os.setsid,
+                                stdin=devnull,
+                                stdout=subprocess.PIPE,stderr=subprocess.PIPE)
+    finally:
+        # the child has its own copy
+        devnull.close()
+
+class WarmInterpreter(object):
+    '''
+    Keeps a spare runworker process started, so a Python script can be
+    handed to an interpreter that's already up. A new spare is started
+    each time one is used.
+    '''
+
+    def __init__(self):
+        self.spare = None
+
+    def start_spare(self):
+        env = dict(os.environ)
+        env['PYTHONUNBUFFERED'] = '1'
+        self.spare = subprocess.Popen([sys.executable,WORKER],env=env,close_fds=True,
+                                      preexec_fn=os.setsid,stdin=subprocess.PIPE,
+                                      stdout=subprocess.PIPE,stderr=subprocess.PIPE)
+
+    def run(self,filename,cwd):
+        '''
+        Hand the script to the spare interpreter and return its process.
+        If the spare has died a new one is tried. Raises IOError or
+        OSError if that can't be started either.
+        '''
+        if self.spare is None or self.spare.poll() is not None:
+            self.start_spare()
+        process = self.spare
+        try:
+            self.hand_over(process,filename,cwd)
+        except IOError:
+            # died since it was polled, broken pipe
+            process.wait()
+            process.stdout.close()
+            process.stderr.close()
+            self.start_spare()
+            process = self.spare
+            self.hand_over(process,filename,cwd)
+        self.start_spare()
+        return process
+
+    def hand_over(self,process,filename,cwd):
+        try:
+            process.stdin.write('%s\0%s\n' % (filename,cwd))
+        finally:
+            process.stdin.close()
+
+    def close(self):
+        if self.spare and self.spare.poll() is None:
+            self.spare.kill()
+            self.spare.wait()
+        self.spare = None
+
+class Runner(object):
+    '''
+    Watches a running process's stdout and stderr from the main loop,
+    passing itself and output to on_output(runner,text,is_error) as it
+    arrives, and itself
+    and the exit status to on_exit once both pipes are closed and the
+    process is done.
+    '''
+
+    read_size = 65536
+
+    def __init__(self,process,on_output,on_exit):
+        self.process = process
+        self.on_output = on_output
+        self.on_exit = on_exit
+        self.returncode = None
+        self.open_pipes = 2
+        for pipe,is_error in ((process.stdout,False),(process.stderr,True)):
+            fd = pipe.fileno()
+            flags = fcntl.fcntl(fd,fcntl.F_GETFL)
+            fcntl.fcntl(fd,fcntl.F_SETFL,flags | os.O_NONBLOCK)
+            gobject.io_add_watch(fd,gobject.IO_IN | gobject.IO_HUP | gobject.IO_ERR,
+                                 wrap('Runner.on_read',self.on_read),is_error)
+
+    def on_read(self,fd,condition,is_error):
+        try:
+            data = os.read(fd,self.read_size)
+        except OSError as e:
+            if e.errno in (errno.EAGAIN,errno.EINTR):
+                return True
+            data = ''
+        if data:
+            self.on_output(self,data,is_error)
+            return True
+        self.open_pipes -= 1
+        if self.open_pipes == 0:
+            gobject.child_watch_add(self.process.pid,self.on_child_exit)
+        return False
+
+    def on_child_exit(self,pid,status):
+        # the main loop has reaped the process, so Popen can't
+        self.process.stdout.close()
+        self.process.stderr.close()
+        if os.WIFSIGNALED(status):
+            self.returncode = -os.WTERMSIG(status)
+        else:
+            self.returncode = os.WEXITSTATUS(status)
+        self.process.returncode = self.returncode
+        self.on_exit(self,self.returncode)
+
+    def kill(self):
+        if self.returncode is None:
+            try:
+                os.killpg(self.process.pid,signal.SIGTERM)
+            except OSError:
+                pass
+
+class RunPane(object):
+    '''
+    Runs the current file and shows what it prints.
+    Clicking a line of a traceback opens the file at that line.
+    '''
+
+    def __init__(self,editor):
+        self.editor = editor
+        self.runner = None
+        self.filename = None
+        self.cwd = None
+        self.warm = None
+        self.textbuffer = gtk.TextBuffer()
+        self.error_tag = self.textbuffer.create_tag('error',foreground='#CC0000')
+        self.link_tag = self.textbuffer.create_tag('link',underline=pango.UNDERLINE_SINGLE)
+        self.textview = gtk.TextView(self.textbuffer)
+        self.textview.set_editable(False)
+        self.textview.set_cursor_visible(False)
+        self.textview.modify_font(pango.FontDescription('Monospace 10'))
+        self.textview.connect('button-release-event',self.on_button_release_event)
+        scrolled = gtk.ScrolledWindow()
+        scrolled.set_policy(gtk.POLICY_AUTOMATIC,gtk.POLICY_AUTOMATIC)
+        scrolled.add(self.textview)
+        self.status = gtk.Label()
+        self.status.set_alignment(0,0.5)
+        self.stop_button = gtk.Button(stock=gtk.STOCK_STOP)
+        self.stop_button.connect('clicked',lambda w:self.stop())
+        self.restart_button = gtk.Button(stock=gtk.STOCK_REFRESH)
+        self.restart_button.connect('clicked',lambda w:self.restart())
+        hbox = gtk.HBox(spacing=10)
+        hbox.pack_start(self.status,expand=True,fill=True)
+        hbox.pack_start(self.restart_button,expand=False,fill=False)
+        hbox.pack_start(self.stop_button,expand=False,fill=False)
+        self.widget = gtk.VBox()
+        self.widget.pack_start(hbox,expand=False,fill=True)
+        self.widget.pack_start(scrolled,expand=True,fill=True)
+        self.widget.show_all()
+        self.stop_button.set_sensitive(False)
+        self.restart_button.set_sensitive(False)
+
+    def get_widget(self):
+        return self.widget
+
+    def set_warm(self,warm):
+        'Keep a Python interpreter started ahead of the next run'
+        if warm and not self.warm:
+            self.warm = WarmInterpreter()
+            self.warm.start_spare()
+        elif not warm and self.warm:
+            self.warm.close()
+            self.warm = None
+
+    def run(self,filename):
+        self.stop()
+        self.filename = filename
+        self.cwd = os.path.dirname(os.path.abspath(filename))
+        self.textbuffer.set_text('')
+        self.restart_button.set_sensitive(True)
+        args = command_for(filename)
+        if not args:
+            self.status.set_text("Don't know how to run %s" % filename)
+            return
+        try:
+            if self.warm and args[0] == sys.executable:
+                process = self.warm.run(filename,self.cwd)
+            else:
+                process = spawn(args,self.cwd)
+        except (IOError,OSError) as e:
+            self.status.set_text("Couldn't run %s: %s" % (filename,e))
+            return
+        self.status.set_text('Running %s' % filename)
+        self.stop_button.set_sensitive(True)
+        self.runner = Runner(process,self.on_output,self.on_exit)
+
+    def restart(self):
+        if self.filename:
+            self.run(self.filename)
+
+    def stop(self):
+        if self.runner:
+            self.runner.kill()
+            self.runner = None
+            self.stop_button.set_sensitive(False)
+            self.status.set_text('Stopped %s' % self.filename)
+
+    def close(self):
+        self.stop()
+        self.set_warm(False)
+
+    def on_output(self,runner,data,is_error):
+        if runner is not self.runner:
+            # what a stopped run still had queued up
+            return
+        text = data.decode('utf-8','replace')
+        end = self.textbuffer.get_end_iter()
+        # only follow the output if the view is already at the end
+        adjustment = self.textview.get_vadjustment()
+        at_end = adjustment.value >= adjustment.upper - adjustment.page_size - 1
+        start_offset = end.get_offset()
+        if is_error:
+            self.textbuffer.insert_with_tags(end,text,self.error_tag)
+        else:
+            self.textbuffer.insert(end,text)
+        self.tag_links(start_offset)
+        if at_end:
+            self.textview.scroll_mark_onscreen(self.textbuffer.get_insert())
+            self.textbuffer.place_cursor(self.textbuffer.get_end_iter())
+
+    def tag_links(self,start_offset):
+        'Underline file locations in the lines just added'
+        start = self.textbuffer.get_iter_at_offset(start_offset)
+        start.set_line_offset(0)
+        while not start.is_end():
+            end = start.copy()
+            if not end.ends_line():
+                end.forward_to_line_end()
+            line = start.get_text(end)
+            match = self.find_location(line)
+            if match:
+                link_start = start.copy()
+                link_start.forward_chars(len(line[:match.start()].decode('utf-8')))
+                link_end = link_start.copy()
+                link_end.forward_chars(len(match.group(0).decode('utf-8')))
+                self.textbuffer.apply_tag(self.link_tag,link_start,link_end)
+            if not start.forward_line():
+                break
+
+    def find_location(self,line):
+        for pattern in LOCATION_PATTERNS:
+            match = pattern.search(line)
+            if match:
+                return match
+        return None
+
+    def on_exit(self,runner,returncode):
+        if runner is not self.runner:
+            # stopped, or replaced by another run
+            return
+        self.runner = None
+        self.stop_button.set_sensitive(False)
+        if returncode < 0:
+            text = 'killed by signal %d' % -returncode
+        else:
+            text = 'exit status %d' % returncode
+        self.status.set_text('%s finished, %s' % (self.filename,text))
+
+    def on_button_release_event(self,textview,event):
+        if self.textbuffer.get_selection_bounds():
+            return False
+        x,y = textview.window_to_buffer_coords(gtk.TEXT_WINDOW_TEXT,int(event.x),int(event.y))
+        start = textview.get_iter_at_location(x,y)
+        start.set_line_offset(0)
+        end = start.copy()
+        if not end.ends_line():
+            end.forward_to_line_end()
+        match = self.find_location(start.get_text(end))
+        if not match:
+            return False
+        filename = os.path.join(self.cwd,match.group(1))
+        if os.path.exists(filename):
+            self.editor.open_file_at_line(filename,int(match.group(2)) - 1)
+        return False
@@ -0,0 +1,56 @@
+'''
+Copyright 2010 John Murphy
+This file is part of Coder.
+
+Coder is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+Coder is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with Coder.  If not, see <http://www.gnu.org/licenses/>.
+'''
+
+# A Python interpreter that starts ahead of time and waits to be told
+# which script to run, so running a quick script doesn't have to wait
+# for the interpreter to start up. It reads one request from stdin:
+# the script's filename and the folder to run it in, separated by NUL.
+# Its stdout and stderr are already the pipes the editor is reading.
+
+import sys,os
+import runpy
+import traceback
+
+def main():
+    request = sys.stdin.readline()
+    if not request:
+        return
+    filename,cwd = request.rstrip('\n').split('\0')
+    # the script gets no input, the same as a normal run
+    devnull = os.open(os.devnull,os.O_RDONLY)
+    os.dup2(devnull,0)
+    os.close(devnull)
+    os.chdir(cwd)
+    sys.argv = [filename]
+    sys.path[0] = os.path.dirname(filename)
+    try:
+        runpy.run_path(filename,run_name='__main__')
+    except (SystemExit,KeyboardInterrupt):
+        raise
+    except:
+        # leave this file and runpy out, so it looks like a normal run
+        exc_type,exc_value,tb = sys.exc_info()
+        entries = [entry for entry in traceback.extract_tb(tb)
+                   if entry[0] not in (__file__,runpy.__file__.rstrip('co'))]
+        sys.stderr.write('Traceback (most recent call last):\n')
+        sys.stderr.write(''.join(traceback.format_list(entries)))
+        sys.stderr.write(''.join(traceback.format_exception_only(exc_type,exc_value)))
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,396 @@
+'''
+Copyright 2010 John Murphy
+This file is part of Coder.
+
+Coder is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+Coder is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with Coder.  If not, see <http://www.gnu.org/licenses/>.
+'''
+
+import re
+import time
+import gobject
+from collections import OrderedDict
+
+from instrument import wrap
+
+# the most recently used compiled patterns, oldest first
+pattern_cache = OrderedDict()
+PATTERN_CACHE_SIZE = 32
+
+# text is copied out of the buffer this many characters at a time
+# when searching from the cursor, doubling until a match turns up
+SEARCH_WINDOW = 64 * 1024
+
+def to_unicode(text):
+    'pygtk hands back utf-8 strings, offsets in the buffer are in characters'
+    if isinstance(text,unicode):
+        return text
+    return text.decode('utf-8','replace')
+
+def compile_pattern(search,regex=False,match_case=True,whole_word=False):
+    '''
+    Compile a search into a regular expression, plain text searches are
+    escaped so everything goes through the same engine.
+    Compiled patterns are cached, keyed by the search and its options.
+    Raises re.error if a regular expression is invalid.
+    '''
+    key = (type(search),search,regex,match_case,whole_word)
+    try:
+        pattern = pattern_cache.pop(key)
+    except KeyError:
+        expression = search
+        if not regex:
+            expression = re.escape(search)
+        if whole_word:
+            expression = r'\b(?:%s)\b' % expression
+        flags = re.MULTILINE | re.UNICODE
+        if not match_case:
+            flags = flags | re.IGNORECASE
+        pattern = re.compile(expression,flags)
+        if len(pattern_cache) >= PATTERN_CACHE_SIZE:
+            pattern_cache.popitem(last=False)
+    pattern_cache[key] = pattern
+    return pattern
+
+def same_pattern(a,b):
+    return a.pattern == b.pattern and a.flags == b.flags
+
+def expand(match,replacement,regex):
+    'The text to replace a match with, regular expressions can use \\1 etc.'
+    if regex:
+        return match.expand(replacement)
+    return replacement
+
+def first_match(pattern,text,pos=0):
+    'The first match that isn\'t empty'
+    for match in pattern.finditer(text,pos):
+        if match.end() > match.start():
+            return match
+    return None
+
+def last_match(pattern,text,endpos=None):
+    'The last match that isn\'t empty and ends by endpos'
+    if endpos is None:
+        endpos = len(text)
+    found = None
+    for match in pattern.finditer(text):
+        if match.end() > endpos:
+            break
+        if match.end() > match.start():
+            found = match
+    return found
+
+def search_forward(textbuffer,pattern,start,limit=None):
+    '''
+    Find the first match after the start iter, before the limit iter
+    or the end of the buffer. Text is copied out in growing windows
+    so a nearby match doesn\'t cost a copy of the whole buffer.
+    Returns (match_start,match_end) iters or None.
+    '''
+    offset = start.get_offset()
+    # the window starts at the start of the line, so ^ and \b see
+    # what's before the start iter, matching starts at the iter itself
+    line_start = start.copy()
+    line_start.set_line_offset(0)
+    line_offset = line_start.get_offset()
+    if limit is None:
+        limit = textbuffer.get_end_iter()
+    limit_offset = limit.get_offset()
+    window = SEARCH_WINDOW
+    while True:
+        window_end = textbuffer.get_iter_at_offset(min(offset + window,limit_offset))
+        # finish the line so a match isn't cut short at the window edge
+        if window_end.compare(limit) < 0 and not window_end.ends_line():
+            window_end.forward_to_line_end()
+            if window_end.compare(limit) > 0:
+                window_end = limit.copy()
+        text = to_unicode(textbuffer.get_slice(line_start,window_end))
+        match = first_match(pattern,text,offset - line_offset)
+        at_limit = window_end.compare(limit) >= 0
+        if match and (match.end() < len(text) or at_limit):
+            return (textbuffer.get_iter_at_offset(line_offset + match.start()),
+                    textbuffer.get_iter_at_offset(line_offset + match.end()))
+        if at_limit:
+            return None
+        window = window * 2
+
+def search_backward(textbuffer,pattern,end,limit=None):
+    '''
+    Find the last match ending before the end iter, after the limit iter
+    or the start of the buffer. Works through growing windows of text
+    like search_forward. Returns (match_start,match_end) iters or None.
+    '''
+    offset = end.get_offset()
+    # the window runs to the end of the line, so $ and \b see what's
+    # after the end iter, matches that end after it are left out
+    line_end = end.copy()
+    if not line_end.ends_line():
+        line_end.forward_to_line_end()
+    if limit is None:
+        limit = textbuffer.get_start_iter()
+    limit_offset = limit.get_offset()
+    window = SEARCH_WINDOW
+    while True:
+        window_start = textbuffer.get_iter_at_offset(max(offset - window,limit_offset))
+        if window_start.compare(limit) > 0:
+            window_start.set_line_offset(0)
+            if window_start.compare(limit) < 0:
+                window_start = limit.copy()
+        start_offset = window_start.get_offset()
+        text = to_unicode(textbuffer.get_slice(window_start,line_end))
+        match = last_match(pattern,text,offset - start_offset)
+        at_limit = start_offset <= limit_offset
+        if match and (match.start() > 0 or at_limit):
+            return (textbuffer.get_iter_at_offset(start_offset + match.start()),
+                    textbuffer.get_iter_at_offset(start_offset + match.end()))
+        if at_limit:
+            return None
+        window = window * 2
+
+def match_selection(textbuffer,pattern):
+    'The match object if the whole selection matches the pattern, else None'
+    bounds = textbuffer.get_selection_bounds()
+    if not bounds:
+        return None
+    text = to_unicode(textbuffer.get_slice(*bounds))
+    match = pattern.match(text)
+    if match and match.end() == len(text):
+        return match
+    return None
+
+def replace_all(textbuffer,pattern,replacement,regex=False,start=None,end=None):
+    '''
+    Replace every match between start and end (the whole buffer by default)
+    as a single undoable action. Every replacement is worked out on a copy
+    of the text first, then only the matches whose text changes are
+    rewritten, last first so the offsets of the others stay put. Text
+    between matches isn't touched, so marks in it (bookmarks, match
+    highlights) stay where they are.
+    Returns the number of replacements.
+    '''
+    if start is None:
+        start = textbuffer.get_start_iter()
+    if end is None:
+        end = textbuffer.get_end_iter()
+    replacement = to_unicode(replacement)
+    text = to_unicode(textbuffer.get_slice(start,end))
+    edits = []
+    count = 0
+    for match in pattern.finditer(text):
+        new_text = expand(match,replacement,regex)
+        count += 1
+        if new_text != match.group():
+            edits.append((match.start(),match.end(),new_text))
+    if not edits:
+        return count
+    offset = start.get_offset()
+    textbuffer.begin_user_action()
+    for match_start,match_end,new_text in reversed(edits):
+        textbuffer.delete(textbuffer.get_iter_at_offset(offset + match_start),
+                          textbuffer.get_iter_at_offset(offset + match_end))
+        if new_text:
+            textbuffer.insert(textbuffer.get_iter_at_offset(offset + match_start),new_text)
+    textbuffer.end_user_action()
+    return count
+
+class MatchIndex(object):
+    '''
+    Finds and highlights every match of a pattern in a buffer.
+    The buffer is searched in idle-time chunks, starting with the part
+    that's on screen. Matches are kept as a sorted list of start and end
+    marks, which move along with edits, so an edit only means searching
+    the lines it touched again. Matches are assumed not to span lines.
+    '''
+
+    chunk_chars = 64 * 1024
+    idle_time = 0.01 # seconds spent searching per idle callback
+
+    def __init__(self,textview,pattern,on_update=None):
+        self.textview = textview
+        self.textbuffer = textview.get_buffer()
+        self.pattern = pattern
+        self.on_update = on_update
+        self.matches = []
+        self.pending = []
+        self.idle_id = None
+        buf = self.textbuffer
+        self.tag = buf.get_tag_table().lookup('search-match')
+        if not self.tag:
+            self.tag = buf.create_tag('search-match',background='#FFFF66')
+        self.handlers = [buf.connect_after('insert-text',self.on_insert_text),
+                         buf.connect_after('delete-range',self.on_delete_range)]
+        self.queue_chunks()
+
+    def close(self):
+        'Remove the highlighting and stop tracking the buffer'
+        buf = self.textbuffer
+        if self.idle_id:
+            gobject.source_remove(self.idle_id)
+            self.idle_id = None
+        for handler in self.handlers:
+            buf.disconnect(handler)
+        for start,end in self.pending + self.matches:
+            buf.delete_mark(start)
+            buf.delete_mark(end)
+        self.pending = []
+        self.matches = []
+        buf.remove_tag(self.tag,buf.get_start_iter(),buf.get_end_iter())
+
+    def count(self):
+        return len(self.matches)
+
+    def is_complete(self):
+        return not self.pending
+
+    def offset(self,mark):
+        return self.textbuffer.get_iter_at_mark(mark).get_offset()
+
+    def bisect(self,offset):
+        'Index of the first match starting at or after offset'
+        lo = 0
+        hi = len(self.matches)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self.offset(self.matches[mid][0]) < offset:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+    def bounds(self,i):
+        buf = self.textbuffer
+        start,end = self.matches[i]
+        return (buf.get_iter_at_mark(start),buf.get_iter_at_mark(end))
+
+    def next(self,offset):
+        '(start,end) iters of the first match after offset, wrapping around'
+        if not self.matches:
+            return None
+        i = self.bisect(offset + 1)
+        if i == len(self.matches):
+            i = 0
+        return self.bounds(i)
+
+    def previous(self,offset):
+        '(start,end) iters of the last match before offset, wrapping around'
+        if not self.matches:
+            return None
+        return self.bounds(self.bisect(offset) - 1)
+
+    def queue_chunks(self):
+        '''
+        Split the buffer into chunks to search, with the chunks
+        on screen first. The chunk bounds are marks so edits made
+        before a chunk is reached don't throw it off.
+        '''
+        buf = self.textbuffer
+        total = buf.get_char_count()
+        rect = self.textview.get_visible_rect()
+        top = self.textview.get_iter_at_location(rect.x,rect.y).get_offset()
+        bottom = self.textview.get_iter_at_location(rect.x,rect.y+rect.height).get_offset()
+        visible = []
+        rest = []
+        for start in xrange(0,total,self.chunk_chars):
+            end = min(start + self.chunk_chars,total)
+            chunk = (buf.create_mark(None,buf.get_iter_at_offset(start),True),
+                     buf.create_mark(None,buf.get_iter_at_offset(end),False))
+            if start <= bottom and end >= top:
+                visible.append(chunk)
+            else:
+                rest.append(chunk)
+        self.pending = visible + rest
+        self.idle_id = gobject.idle_add(wrap('MatchIndex.search_chunks',self.search_chunks))
+
+    def search_chunks(self):
+        buf = self.textbuffer
+        start_time = time.time()
+        while self.pending and time.time() - start_time < self.idle_time:
+            start_mark,end_mark = self.pending.pop(0)
+            self.search_range(buf.get_iter_at_mark(start_mark),
+                              buf.get_iter_at_mark(end_mark))
+            buf.delete_mark(start_mark)
+            buf.delete_mark(end_mark)
+        if self.on_update:
+            self.on_update()
+        if not self.pending:
+            self.idle_id = None
+            return False
+        return True
+
+    def line_bounds(self,start,end):
+        'Widen a range to whole lines'
+        start = start.copy()
+        start.set_line_offset(0)
+        end = end.copy()
+        if not end.ends_line():
+            end.forward_to_line_end()
+        return (start,end)
+
+    def search_range(self,start,end):
+        '''
+        Find the matches in the lines between the start and end iters
+        and add the ones we don't already have
+        '''
+        start,end = self.line_bounds(start,end)
+        offset = start.get_offset()
+        text = to_unicode(self.textbuffer.get_slice(start,end))
+        found = []
+        for match in self.pattern.finditer(text):
+            if match.end() > match.start():
+                found.append((offset + match.start(),offset + match.end()))
+        self.add_matches(found)
+
+    def add_matches(self,found):
+        'Merge a sorted list of (start,end) offsets into the matches'
+        if not found:
+            return
+        buf = self.textbuffer
+        i = self.bisect(found[0][0])
+        for start,end in found:
+            while i < len(self.matches) and self.offset(self.matches[i][0]) < start:
+                i += 1
+            if i < len(self.matches) and self.offset(self.matches[i][0]) == start:
+                continue
+            match_start = buf.get_iter_at_offset(start)
+            match_end = buf.get_iter_at_offset(end)
+            self.matches.insert(i,(buf.create_mark(None,match_start,True),
+                                   buf.create_mark(None,match_end,False)))
+            buf.apply_tag(self.tag,match_start,match_end)
+            i += 1
+
+    def update_range(self,start,end):
+        '''
+        The text between the start and end iters changed,
+        drop the matches on those lines and search them again
+        '''
+        buf = self.textbuffer
+        start,end = self.line_bounds(start,end)
+        start_offset = start.get_offset()
+        end_offset = end.get_offset()
+        i = self.bisect(start_offset)
+        while i < len(self.matches) and self.offset(self.matches[i][0]) <= end_offset:
+            match_start,match_end = self.matches.pop(i)
+            buf.delete_mark(match_start)
+            buf.delete_mark(match_end)
+        buf.remove_tag(self.tag,start,end)
+        self.search_range(start,end)
+        if self.on_update:
+            self.on_update()
+
+    def on_insert_text(self,textbuffer,textiter,text,length):
+        start = textiter.copy()
+        start.backward_chars(len(to_unicode(text)))
+        self.update_range(start,textiter)
+
+    def on_delete_range(self,textbuffer,start,end):
+        self.update_range(start,start)
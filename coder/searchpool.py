@@ -0,0 +1,94 @@
+'''
+Copyright 2010 John Murphy
+This file is part of Coder.
+
+Coder is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+Coder is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with Coder.  If not, see <http://www.gnu.org/licenses/>.
+'''
+
+# This module is imported before gtk when coder starts, so that the
+# worker processes forked for Find in Files are copies of a small
+# process rather than of one with gtk, its threads and its X connection.
+# It must not import gtk (or anything that imports gtk).
+
+import os
+import re
+import multiprocessing
+
+MAX_LINE_LENGTH = 200 # characters of a matching line that are shown
+MAX_RESULTS = 10000
+
+pool = None
+
+def start_pool():
+    'Fork the worker processes, if they haven\'t been already'
+    global pool
+    if pool is None:
+        pool = multiprocessing.Pool()
+    return pool
+
+def search_batch(args):
+    '''
+    Runs in a worker process.
+    Searches each file with the pattern and returns a list of
+    (filename,[(line_number,line_text),...]) for the files that matched.
+    '''
+    filenames,expression,flags = args
+    # the same unicode pattern the buffers are searched with, re caches it
+    pattern = re.compile(expression,flags)
+    found = []
+    for filename in filenames:
+        lines = search_file(filename,pattern)
+        if lines:
+            found.append((filename,lines))
+    return found
+
+def search_file(filename,pattern):
+    'One (line_number,line_text) per matching line, binary files are skipped'
+    try:
+        f = open(filename,'rb')
+        try:
+            data = f.read()
+        finally:
+            f.close()
+    except (IOError,MemoryError):
+        return None
+    if not data or '\0' in data[:8192]:
+        return None
+    # decoded like the editor opens it, so the pattern matches characters
+    try:
+        text = data.decode('utf-8-sig')
+    except UnicodeDecodeError:
+        text = data.decode('latin-1')
+    return matching_lines(pattern,text)
+
+def matching_lines(pattern,text):
+    'One (line_number,line_text) per line of text with a match'
+    lines = []
+    line_number = 1
+    counted = 0
+    match = pattern.search(text)
+    while match and len(lines) < MAX_RESULTS:
+        start = match.start()
+        line_number += text.count(u'\n',counted,start)
+        counted = start
+        line_start = text.rfind(u'\n',0,start) + 1
+        line_end = text.find(u'\n',start)
+        if line_end < 0:
+            line_end = len(text)
+        lines.append((line_number,text[line_start:min(line_end,line_start + MAX_LINE_LENGTH)].rstrip()))
+        # one result per line, carry on from the next one
+        if line_end >= len(text):
+            break
+        match = pattern.search(text,line_end + 1)
+    return lines
@@ -0,0 +1,157 @@
+'''
+Copyright 2010 John Murphy
+This file is part of Coder.
+
+Coder is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+Coder is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with Coder.  If not, see <http://www.gnu.org/licenses/>.
+'''
+
+# The client half of this module runs before anything else when coder
+# starts, so it must not import gtk (or anything that imports gtk).
+
+import os
+import stat
+import errno
+import socket
+import tempfile
+
+def is_private(folder):
+    'True if folder is a real directory that only this user can get into'
+    try:
+        st = os.lstat(folder)
+    except OSError:
+        return False
+    return (stat.S_ISDIR(st.st_mode) and st.st_uid == os.getuid()
+            and not st.st_mode & 0077)
+
+def socket_path(create=False):
+    '''
+    One socket per user and display, in the runtime directory if there
+    is one, otherwise in a coder-<uid> directory in the temp directory,
+    made if create is set.
+    None if the directory could belong to someone else, another user
+    could have made it first to get the filenames sent to it.
+    '''
+    folder = os.environ.get('XDG_RUNTIME_DIR')
+    if not folder:
+        folder = os.path.join(tempfile.gettempdir(),'coder-%d' % os.getuid())
+        if create:
+            try:
+                os.mkdir(folder,0700)
+            except OSError as e:
+                if e.errno != errno.EEXIST:
+                    return None
+    if not is_private(folder):
+        return None
+    display = os.environ.get('DISPLAY','').replace('/','_')
+    return os.path.join(folder,'coder-%d%s.sock' % (os.getuid(),display))
+
+def send_files(filenames):
+    '''
+    Ask a running editor to open the files.
+    Returns False if there is no running editor to ask.
+    '''
+    if not hasattr(socket,'AF_UNIX'):
+        return False
+    path = socket_path()
+    if path is None:
+        return False
+    sock = socket.socket(socket.AF_UNIX,socket.SOCK_STREAM)
+    try:
+        try:
+            sock.connect(path)
+        except socket.error:
+            return False
+        # filenames can't contain NUL, so it separates them
+        message = '\0'.join([os.path.abspath(f) for f in filenames])
+        sock.sendall(message + '\0')
+        return True
+    finally:
+        sock.close()
+
+class Server(object):
+    '''
+    Listens on the socket for filenames from send_files
+    and passes them to open_files on the main loop.
+    '''
+
+    def __init__(self,open_files):
+        self.open_files = open_files
+        self.path = socket_path(create=True)
+        self.sock = None
+        self.messages = {}
+
+    def start(self):
+        if not hasattr(socket,'AF_UNIX'):
+            return
+        if self.path is None:
+            print("Not listening for files to open, the socket directory isn't private")
+            return
+        # imported here so the client never pays for it
+        import gobject
+        # nobody answered send_files, so any socket file left over
+        # belongs to an editor that didn't shut down cleanly
+        try:
+            os.unlink(self.path)
+        except OSError:
+            pass
+        sock = socket.socket(socket.AF_UNIX,socket.SOCK_STREAM)
+        try:
+            sock.bind(self.path)
+            os.chmod(self.path,0600)
+            sock.listen(5)
+        except socket.error as e:
+            print("Couldn't start server on %s: %s" % (self.path,e))
+            sock.close()
+            return
+        sock.setblocking(False)
+        self.sock = sock
+        gobject.io_add_watch(sock,gobject.IO_IN,self.on_accept)
+
+    def stop(self):
+        if self.sock:
+            self.sock.close()
+            self.sock = None
+            try:
+                os.unlink(self.path)
+            except OSError:
+                pass
+
+    def on_accept(self,sock,condition):
+        import gobject
+        if self.sock is None:
+            return False
+        try:
+            conn,address = sock.accept()
+        except socket.error:
+            return True
+        conn.setblocking(False)
+        self.messages[conn] = []
+        gobject.io_add_watch(conn,gobject.IO_IN | gobject.IO_HUP | gobject.IO_ERR,
+                             self.on_read)
+        return True
+
+    def on_read(self,conn,condition):
+        try:
+            data = conn.recv(65536)
+        except socket.error as e:
+            if e.args[0] in (errno.EAGAIN,errno.EINTR):
+                return True
+            data = ''
+        if data:
+            self.messages[conn].append(data)
+            return True
+        message = ''.join(self.messages.pop(conn))
+        conn.close()
+        self.open_files([f for f in message.split('\0') if f])
+        return False
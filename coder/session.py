@@ -0,0 +1,68 @@
+'''
+Copyright 2010 John Murphy
+This file is part of Coder.
+
+Coder is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+Coder is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with Coder.  If not, see <http://www.gnu.org/licenses/>.
+'''
+
+import json
+
+from config import config_path,write_file,encode_strings
+
+SESSION_FILE = 'session.json'
+SESSION_VERSION = 1
+
+def save_session(editor):
+    '''
+    Write the open files, where the cursor and bookmarks were in each,
+    and the search history
+    '''
+    tabs = []
+    current = 0
+    current_tab = editor.current_tab()
+    for tab in editor.tabs:
+        if not tab.get_filename():
+            continue
+        if tab is current_tab:
+            current = len(tabs)
+        tabs.append(tab.get_state())
+    session = {'version':SESSION_VERSION,
+               'tabs':tabs,
+               'current':current,
+               'find_history':editor.find_history,
+               'replace_history':editor.replace_history,
+               'search_options':editor.search_options,
+               'last_goto':editor.last_goto}
+    try:
+        write_file(config_path(SESSION_FILE),json.dumps(session,separators=(',',':')))
+    except (IOError,OSError) as e:
+        print("Couldn't save session: %s" % e)
+
+def load_session():
+    'The saved session, or None if there isn\'t one that can be read'
+    try:
+        f = open(config_path(SESSION_FILE),'rb')
+    except IOError:
+        return None
+    try:
+        try:
+            session = json.load(f)
+        except ValueError as e:
+            print("Couldn't read session: %s" % e)
+            return None
+    finally:
+        f.close()
+    if not isinstance(session,dict) or session.get('version') != SESSION_VERSION:
+        return None
+    return encode_strings(session)
@@ -17,11 +17,28 @@ along with Coder.  If not, see <http://www.gnu.org/licenses/>.
 '''
 
 import os,sys
+import re
+import gobject
 import gtk
+import pango
 
-from coder import SOURCE_VIEW,MAIN_PATH
+from coder import SOURCE_VIEW
 if SOURCE_VIEW:
     import gtksourceview2
+    import languages
+from largefile import LargeFileViewer
+from search import MatchIndex,to_unicode,compile_pattern
+from bookmarks import Bookmarks,BufferBookmarks
+from fileio import main_line_ending
+from transform import Transform
+from journal import Journal
+import highlight
+from instrument import wrap
+
+LINE_ENDINGS = {'unix':u'\n','dos':u'\r\n','mac':u'\r'}
+
+# what GTK ends a line at, including the lone \r of old mac files
+LINE_BREAK = re.compile(u'(\r\n|\r|\n|\u2029)')
 
 class Tab(object):
     '''
@@ -29,57 +46,104 @@ class Tab(object):
     that make up a tab in the Text Editor.
     '''
 
-    if SOURCE_VIEW:
-        source_language_manager = gtksourceview2.language_manager_get_default()
-        langs = {'py':'python','glade':'xml','pl':'perl'}
-        style_scheme_manager = gtksourceview2.style_scheme_manager_get_default()
-        styles_path = os.path.join(MAIN_PATH,'data')
-        scheme = None
-        if os.path.exists(styles_path):
-            style_scheme_manager.prepend_search_path(styles_path)
-            style = 'coder'
-            scheme = style_scheme_manager.get_scheme(style)
-            if not scheme:
-                print("Couldn't load style: %s" % style)
-        else:
-            print("Couldn't find styles directory")
+    font = pango.FontDescription('Monospace 10')
+    # what the status bar shows, shared since every tab writes to the same one
+    status = None
 
-    def __init__(self,notebook,statusbar,starting_folder):
+    def __init__(self,notebook,statusbar,starting_folder,filename=""):
+        '''
+        If a filename is given the tab starts out as a placeholder holding
+        just the filename, call materialize() to create the Text View
+        before loading the file into it.
+        '''
         self.notebook = notebook
         self.statusbar = statusbar
         self.starting_folder = starting_folder
-        self.filename = ""
+        self.filename = filename
         self.changed = 0
         self.line = 0
         self.col = 0
         self.line_endings = 'unix'
+        # set from the file by set_format, used again when saving
+        self.line_ending_counts = {}
+        self.encoding = 'utf-8'
+        self.bom = ''
+        self.loader = None
+        self.saver = None
+        self.transform = None
+        self.pending_save = None
+        # line to move to once the file has loaded
+        self.pending_line = None
+        # cursor and bookmarks from a saved session, applied once loaded
+        self.pending_state = None
+        # the file being watched for changes, and what it was like when
+        # last loaded or saved, see TextEditor.check_disk
+        self.watched = None
+        self.disk_signature = None
+        self.disk_sha = None
+        self.disk_tail = ''
+        self.stale = False
+        # counts edits so a save can tell if the buffer changed under it
+        self.edit_serial = 0
+        self.viewer = None
+        self.matches = None
+        self.textview = None
+        # idle callback that redraws the status bar, at most one queued
+        self.status_id = None
+        self.status_context = statusbar.get_context_id("status")
+        self.bookmarks = None
+        # unsaved edits logged in case of a crash, and a journal
+        # left by one to replay once the file has loaded
+        self.journal = None
+        self.pending_journal = None
+        # (size,lines,longest line) of the file as loaded, the policy
+        # picked by hand if there is one, and what's applying it
+        self.text_shape = None
+        self.highlight_override = None
+        self.highlighting = None
         self.create_widgets()
-        self.marks = []
         self.notebook.append_page(self.window,self.label)
         self.window.show()
-        self.textview.show()
-    
+        if not filename:
+            self.materialize()
+            self.journal.reset('',None)
+
     def create_widgets(self):
-        'Creates the Scrolled Window, Text View, and Label'
+        'Creates the Scrolled Window and Label'
         self.window = gtk.ScrolledWindow()
         self.window.set_policy(gtk.POLICY_AUTOMATIC,gtk.POLICY_AUTOMATIC)
+        if self.filename:
+            self.label = gtk.Label(os.path.basename(self.filename))
+        else:
+            self.label = gtk.Label("New Document")
+
+    def is_materialized(self):
+        return self.textview is not None
+
+    def materialize(self):
+        'Creates the Text View and Buffer'
         if SOURCE_VIEW:
             self.textbuffer = gtksourceview2.Buffer()
-            if Tab.scheme:
-                self.textbuffer.set_style_scheme(Tab.scheme)
+            scheme = languages.get_scheme()
+            if scheme:
+                self.textbuffer.set_style_scheme(scheme)
             self.textview = gtksourceview2.View(self.textbuffer)
         else:
             self.textbuffer = gtk.TextBuffer()
             self.textview = gtk.TextView(self.textbuffer)
-        self.textbuffer.create_tag('font',font='Monospace 10')
-        self.textbuffer.apply_tag_by_name('font',self.textbuffer.get_start_iter(),self.textbuffer.get_end_iter())
-        self.textview.connect('event',self.textview_event)
-        self.textview.connect('event-after',self.textview_event_after)
-        self.textbuffer.connect('modified-changed',self.buffer_modified_changed)
-        self.textbuffer.connect('changed',self.buffer_changed)
+        # set the font on the view instead of tagging the buffer,
+        # so edits don't have to re-apply a tag over the whole text
+        self.textview.modify_font(Tab.font)
+        self.textview.connect('event',wrap('Tab.textview_event',self.textview_event))
+        self.textbuffer.connect('notify::cursor-position',wrap('Tab.cursor_moved',self.cursor_moved))
+        self.textbuffer.connect('modified-changed',
+                                wrap('Tab.buffer_modified_changed',self.buffer_modified_changed))
+        self.textbuffer.connect('changed',wrap('Tab.buffer_changed',self.buffer_changed))
+        self.bookmarks = BufferBookmarks(self.textview)
+        self.journal = Journal(self.textbuffer)
         self.window.add(self.textview)
-        self.label = gtk.Label("New Document")
-    
+        self.textview.show()
+
     def get_window(self):
         return self.window
 
@@ -102,12 +166,92 @@ class Tab(object):
         self.notebook.set_tab_label(self.window,self.label)
         self.update_source_buffer(filename)
 
-    def set_format(self):
-        buf = self.textbuffer
-        text = buf.get_text(buf.get_start_iter(),buf.get_end_iter())
-        self.line_endings = 'unix'
-        if '\r\n' in text:
-            self.line_endings = 'dos'
+    def open_large_file(self,filename):
+        '''
+        Show the file read-only through a LargeFileViewer
+        instead of loading all of it into the buffer
+        '''
+        page = self.notebook.page_num(self.window)
+        self.window.remove(self.textview)
+        self.notebook.remove_page(page)
+        # the viewer's buffer only holds a window of the file,
+        # so its bookmarks are line numbers rather than marks
+        self.bookmarks.close()
+        self.bookmarks = Bookmarks()
+        # nothing to journal, it can't be edited
+        self.journal.stop()
+        if self.highlighting:
+            self.highlighting.stop()
+            self.highlighting = None
+        self.viewer = LargeFileViewer(self,filename)
+        self.encoding = self.viewer.encoding
+        self.bom = self.viewer.bom
+        self.window = self.viewer.get_widget()
+        self.notebook.insert_page(self.window,self.label,page)
+        self.notebook.set_current_page(page)
+        self.set_filename(filename)
+
+    def is_read_only(self):
+        return self.viewer is not None
+
+    def is_busy(self):
+        'True while a load or transform is rewriting the buffer, edits would get mixed into it'
+        return bool(self.loader or self.transform)
+
+    def set_format(self,loader):
+        'Take the format a FileLoader found while reading the file'
+        self.encoding = loader.encoding
+        self.bom = loader.bom
+        self.line_ending_counts = loader.line_ending_counts
+        self.line_endings = main_line_ending(self.line_ending_counts)
+        self.text_shape = (loader.size,sum(self.line_ending_counts.values()) + 1,
+                           loader.longest_line)
+        if SOURCE_VIEW:
+            # guess again now there's a first line to go on
+            self.update_source_buffer(self.filename)
+        else:
+            self.apply_highlighting()
+
+    def set_disk_state(self,source):
+        'Remember what the file was like when a loader, saver or reloader was done with it'
+        self.disk_signature = source.signature
+        self.disk_sha = source.sha
+        self.disk_tail = source.tail
+
+    def reset_journal(self):
+        '''
+        Start journaling from what's on disk now,
+        then replay any journal waiting for the file to load
+        '''
+        base = None
+        if self.disk_signature:
+            base = self.disk_signature[2]
+        self.journal.reset(self.filename,base)
+        if self.pending_journal:
+            filename = self.pending_journal
+            self.pending_journal = None
+            self.recover_journal(filename)
+
+    def recover_journal(self,filename):
+        'Replay the edits from a journal left behind by a crash'
+        if self.viewer:
+            print("Can't recover changes to %s, it's too large to edit" % self.filename)
+            return
+        error = self.journal.replay(filename)
+        if error:
+            print("Couldn't recover changes to %s: %s" % (self.filename or 'New Document',error))
+
+    def describe_format(self):
+        encoding = self.encoding
+        if self.bom:
+            encoding = encoding + ' BOM'
+        counts = [(count,name) for name,count in self.line_ending_counts.items() if count]
+        if len(counts) > 1:
+            counts.sort(reverse=True)
+            line_endings = 'mixed: ' + ', '.join(['%d %s' % c for c in counts])
+        else:
+            line_endings = self.line_endings
+        return '%s, %s' % (encoding,line_endings)
 
     def get_current_folder(self):
         if self.filename:
@@ -115,23 +259,44 @@ class Tab(object):
         else:
             return self.starting_folder
 
+    def get_first_line(self):
+        start = self.textbuffer.get_start_iter()
+        end = start.copy()
+        end.forward_chars(256)
+        return self.textbuffer.get_text(start,end).split('\n')[0]
+
     def update_source_buffer(self,filename):
-        'Set the syntax highlighting based on filename'
+        '''
+        Set the syntax highlighting based on filename,
+        or failing that a #! line at the start of the buffer
+        '''
         if not SOURCE_VIEW: return
-        (basename,ext) = os.path.splitext(filename)
-        #strip off the "." from the extension
-        ext = ext[1:]
-        #get the lang_id from the extension, ex: 'py' -> 'python'
-        try:
-            lang_id = Tab.langs[ext]
-        except KeyError:
-            #if the extension isn't in the list of langs 
-            #then just use the extension, ex: 'c'
-            #if lang_id isn't a valid id, the language manager
-            #just ignores it
-            lang_id = ext
-        language = Tab.source_language_manager.get_language(lang_id)
-        self.textbuffer.set_language(language)
+        lang_id = languages.guess_language(filename,self.get_first_line())
+        self.textbuffer.set_language(languages.get_language(lang_id))
+        self.apply_highlighting()
+
+    def apply_highlighting(self):
+        '''
+        Highlight the way the user picked, or else the way
+        highlight.choose_policy picks for the size and shape of the file
+        '''
+        if not SOURCE_VIEW or self.viewer or not self.textview:
+            return
+        if self.highlighting:
+            self.highlighting.stop()
+        if self.highlight_override:
+            policy,reason = self.highlight_override,'by hand'
+        elif self.text_shape:
+            policy,reason = highlight.choose_policy(*self.text_shape)
+        else:
+            policy,reason = highlight.FULL,None
+        self.highlighting = highlight.create(self,policy,reason)
+        self.update_statusbar()
+
+    def set_highlight_policy(self,policy):
+        'Override how the tab is highlighted, None goes back to choosing automatically'
+        self.highlight_override = policy
+        self.apply_highlighting()
 
     def textview_event(self,widget,event,data=None):
         '''
@@ -139,7 +304,7 @@ class Tab(object):
         Intercepts return keypresses and redirects to the autoindent function
         Intercepts backspace keypresses and redirect to the backspace function
         '''
-        if event.type == gtk.gdk.KEY_PRESS:
+        if event.type == gtk.gdk.KEY_PRESS and self.textview.get_editable():
             keyname = gtk.gdk.keyval_name(event.keyval)
             if keyname == 'Tab':
                 self.indent()
@@ -164,18 +329,15 @@ class Tab(object):
         if bounds:
             # a block is selected, indent/unindent the entire line(s)
             start,end = bounds
-            start_line = start.get_line()
-            end_line = end.get_line()
-            for line in range(start_line,end_line+1):
-                textiter = self.textbuffer.get_iter_at_line_offset(line,0)
-                if reverse:
-                    if textiter.get_chars_in_line() >= 5:
-                        textiter_end = self.textbuffer.get_iter_at_line_offset(line,4)
-                        text = self.textbuffer.get_text(textiter,textiter_end,True)
-                        if text == tab:
-                            self.textbuffer.delete(textiter,textiter_end)
-                else:
-                    self.textbuffer.insert(textiter,tab)
+            if reverse:
+                def edit(line):
+                    if line.startswith(tab):
+                        return line[len(tab):]
+                    return line
+            else:
+                def edit(line):
+                    return tab + line
+            self.edit_lines(start.get_line(),end.get_line(),edit)
         else:
             # there's no selection, just replace the tab with 4 spaces
             # if unindenting, check if there are 4 spaces before the cursor and if so, delete them
@@ -248,10 +410,9 @@ class Tab(object):
         Set the first character of the current/highlighted lines to '#'.
         If it already is set then remove it.
         '''
+        if self.is_read_only(): return
         comment = '#'
         bounds = self.textbuffer.get_selection_bounds()
-        start_line = None
-        end_line = None
         if bounds:
             # a block is selected, comment all of the lines
             start,end = bounds
@@ -261,44 +422,134 @@ class Tab(object):
             textiter = self.textbuffer.get_iter_at_mark(self.textbuffer.get_insert())
             start_line = textiter.get_line()
             end_line = start_line
-        for line in range(start_line,end_line+1):
-            textiter_start = self.textbuffer.get_iter_at_line_offset(line,0)
-            if textiter_start.get_chars_in_line() >= 2:
-                textiter_end = self.textbuffer.get_iter_at_line_offset(line,1)
-                text = self.textbuffer.get_text(textiter_start,textiter_end,True)
-                if text == comment:
-                    self.textbuffer.delete(textiter_start,textiter_end)
-                else:
-                    self.textbuffer.insert(textiter_start,comment)
-            else:
-                self.textbuffer.insert(textiter_start,comment)
+        def edit(line):
+            if line.startswith(comment):
+                return line[len(comment):]
+            return comment + line
+        self.edit_lines(start_line,end_line,edit)
 
-    def textview_event_after(self,widget,event,data=None):
+    def edit_lines(self,start_line,end_line,edit):
         '''
-        Updates the cursor position if it changed.
+        Run each line from start_line to end_line through edit, which gets
+        the text of a line without its newline and returns the new text.
+        The lines are read in one go and the span from the first changed
+        line to the last is replaced in a single user action, so a block
+        edit is one undo step however many lines it covers.
+        A selection is moved to cover the edited lines, otherwise
+        the cursor stays where it was in its line.
+        Returns True if anything changed.
         '''
-        pos = self.textbuffer.get_property('cursor-position')
-        textiter = self.textbuffer.get_iter_at_offset(pos)
-        line = textiter.get_line()
-        col = textiter.get_line_offset()
-        changed = False
-        if self.line != line:
-            self.line = line
-            changed = True
-        if self.col != col:
-            self.col = col
-            changed = True
-        if changed:
-            self.update_statusbar()
+        if self.is_busy():
+            return False
+        textbuffer = self.textbuffer
+        start = textbuffer.get_iter_at_line(start_line)
+        end = textbuffer.get_iter_at_line(end_line)
+        if not end.ends_line():
+            end.forward_to_line_end()
+        # lines and the breaks after them, alternately
+        parts = LINE_BREAK.split(to_unicode(textbuffer.get_slice(start,end)))
+        lines = parts[0::2]
+        breaks = parts[1::2] + [u'']
+        new_lines = [edit(line) for line in lines]
+        changed = [i for i in xrange(len(lines)) if lines[i] != new_lines[i]]
+        if not changed:
+            return False
+        first = changed[0]
+        last = changed[-1]
+        had_selection = textbuffer.get_selection_bounds() != ()
+        cursor = textbuffer.get_iter_at_mark(textbuffer.get_insert())
+        cursor_line = cursor.get_line()
+        cursor_col = cursor.get_line_offset()
+        if start_line <= cursor_line <= end_line:
+            i = cursor_line - start_line
+            cursor_col = max(0,cursor_col + len(new_lines[i]) - len(lines[i]))
+        # bookmarks in the replaced lines would all end up on the first
+        pairs = self.bookmarks.between(start_line + first,start_line + last)
+        # character offset of the first changed line
+        offset = start.get_offset() + sum([len(lines[i]) + len(breaks[i]) for i in xrange(first)])
+        old_length = sum([len(lines[i]) + len(breaks[i]) for i in xrange(first,last)]) + len(lines[last])
+        new_text = u''.join([new_lines[i] + breaks[i] for i in xrange(first,last)]) + new_lines[last]
+        textbuffer.begin_user_action()
+        textbuffer.delete(textbuffer.get_iter_at_offset(offset),
+                   textbuffer.get_iter_at_offset(offset + old_length))
+        textbuffer.insert(textbuffer.get_iter_at_offset(offset),new_text)
+        textbuffer.end_user_action()
+        self.bookmarks.restore(pairs)
+        if had_selection:
+            end = textbuffer.get_iter_at_line(end_line)
+            if not end.ends_line():
+                end.forward_to_line_end()
+            textbuffer.select_range(textbuffer.get_iter_at_line(start_line),end)
+        else:
+            cursor = textbuffer.get_iter_at_line(cursor_line)
+            if cursor.get_chars_in_line() > cursor_col:
+                cursor.set_line_offset(cursor_col)
+            elif not cursor.ends_line():
+                cursor.forward_to_line_end()
+            textbuffer.place_cursor(cursor)
+        return True
+
+    def cursor_moved(self,textbuffer,pspec):
+        self.update_statusbar()
+
+    def update_cursor_position(self):
+        'Set line and col from the cursor'
+        textiter = self.textbuffer.get_iter_at_mark(self.textbuffer.get_insert())
+        self.line = textiter.get_line()
+        self.col = textiter.get_line_offset()
+        if self.viewer:
+            self.line = self.line + self.viewer.top
 
     def update_statusbar(self):
+        '''
+        Queue a status bar update.
+        However many times this is called before the main loop goes idle,
+        the status is only worked out once.
+        '''
+        if self.status_id is None:
+            self.status_id = gobject.idle_add(wrap('Tab.refresh_statusbar',self.refresh_statusbar))
+
+    def is_current(self):
+        return self.notebook.get_nth_page(self.notebook.get_current_page()) is self.window
+
+    def refresh_statusbar(self):
+        self.status_id = None
+        # the status bar is shared, only the tab being shown writes to it
+        if not self.textview or not self.is_current():
+            return False
+        self.update_cursor_position()
         status = '%s [%s]      Line: %s  Col: %s' % (self.filename,
-                                                     self.line_endings,
+                                                     self.describe_format(),
                                                      self.line+1,self.col+1)
-        context_id = self.statusbar.get_context_id("status")
+        if self.viewer:
+            if self.viewer.indexed():
+                lines = self.viewer.line_count()
+            else:
+                lines = 'indexing...'
+            status = '%s  Lines: %s  [read only]' % (status,lines)
+        if self.highlighting:
+            status = '%s      Highlighting: %s' % (status,self.highlighting.describe())
+        if self.matches:
+            status = '%s      Matches: %d' % (status,self.matches.count())
+            if not self.matches.is_complete():
+                status = status + '...'
+        if status != Tab.status:
+            Tab.status = status
+            self.statusbar.pop(self.status_context)
+            self.statusbar.push(self.status_context,status)
+        return False
+
+    def show_progress(self,message,fraction):
+        'Show the progress of a long running operation in the status bar'
+        status = '%s  %d%%' % (message,int(fraction*100))
+        context_id = self.statusbar.get_context_id("progress")
         self.statusbar.pop(context_id)
         self.statusbar.push(context_id,status)
 
+    def hide_progress(self):
+        context_id = self.statusbar.get_context_id("progress")
+        self.statusbar.pop(context_id)
+
     def buffer_modified_changed(self,widget):
         if self.changed:
             self.changed = 0
@@ -316,70 +567,133 @@ class Tab(object):
             self.label.set_text(text)            
     
     def buffer_changed(self,widget):
-        self.textbuffer.apply_tag_by_name('font',self.textbuffer.get_start_iter(),self.textbuffer.get_end_iter())
+        self.edit_serial += 1
 
     def has_unsaved_changes(self):
         return self.changed
 
     def focus(self):
-        self.textview.grab_focus()
+        if self.textview:
+            self.textview.grab_focus()
+
+    def goto_line(self,line):
+        'Put the cursor on the start of a line and scroll to it'
+        if self.viewer:
+            self.viewer.goto_line(line)
+        else:
+            textiter = self.textbuffer.get_iter_at_line(line)
+            self.textbuffer.place_cursor(textiter)
+            self.textview.scroll_to_iter(textiter,0.1)
+
+    def highlight_matches(self,pattern):
+        'Highlight every match of a compiled pattern in the buffer'
+        self.clear_matches()
+        if not self.viewer:
+            self.matches = MatchIndex(self.textview,pattern,self.update_statusbar)
+
+    def clear_matches(self):
+        if self.matches:
+            self.matches.close()
+            self.matches = None
+            self.update_statusbar()
+
+    def close(self):
+        'Stop any background work on the tab before it is removed'
+        self.clear_matches()
+        if self.status_id:
+            gobject.source_remove(self.status_id)
+            self.status_id = None
+        if self.viewer:
+            self.viewer.close()
+        if self.transform:
+            self.transform.cancel()
+        if self.journal:
+            self.journal.close()
+        if self.highlighting:
+            self.highlighting.stop()
+        if self.loader:
+            self.loader.cancel()
+            self.loader = None
+            self.hide_progress()
 
     def toggle_mark(self):
-        removed = False
-        for i in xrange(len(self.marks)):
-            if self.line == self.marks[i]:
-                del(self.marks[i])
-                removed = True
-                break
-        if not removed:
-            added = False
-            for i in xrange(len(self.marks)):
-                if self.line < self.marks[i]:
-                    self.marks.insert(i,self.line)
-                    added = True
-                    break
-            if not added:
-                self.marks.append(self.line)
+        self.update_cursor_position()
+        self.bookmarks.toggle(self.line)
 
     def next_mark(self):
-        mark = None
-        for i in xrange(len(self.marks)):
-            if self.line < self.marks[i]:
-                mark = self.marks[i]
-                break
-        if self.marks and mark is None:
-            mark = self.marks[0]
-        if mark is not None:
-            iter = self.textbuffer.get_iter_at_line(mark)
-            self.textbuffer.place_cursor(iter)
-            self.textview.scroll_to_iter(iter,0.1)
+        self.update_cursor_position()
+        line = self.bookmarks.next(self.line)
+        if line is not None:
+            self.goto_line(line)
 
     def prev_mark(self):
-        mark = None
-        for i in xrange(len(self.marks)-1,-1,-1):
-            if self.line > self.marks[i]:
-                mark = self.marks[i]
-                break
-        if self.marks and mark is None:
-            mark = self.marks[-1]
-        if mark is not None:
-            iter = self.textbuffer.get_iter_at_line(mark)
-            self.textbuffer.place_cursor(iter)
-            self.textview.scroll_to_iter(iter,0.1)
-
-    def convert_line_endings(self):
-        buf = self.textbuffer
-        self.textview.set_sensitive(False)
-        text = buf.get_text(buf.get_start_iter(),buf.get_end_iter())
-        if self.line_endings == 'dos':
-            text = text.replace('\r\n','\n')
-            self.line_endings = 'unix'
-        else:
-            text = text.replace('\n','\r\n')
-            self.line_endings = 'dos'
-        buf.set_text(text)
-        buf.set_modified(True)
+        self.update_cursor_position()
+        line = self.bookmarks.previous(self.line)
+        if line is not None:
+            self.goto_line(line)
+
+    def get_state(self):
+        'What a session needs to put the tab back the way it is'
+        if self.pending_state is not None or not self.textview:
+            # never loaded, hand back what it was restored with
+            return self.pending_state or {'filename':self.filename}
+        self.update_cursor_position()
+        return {'filename':self.filename,
+                'line':self.line,
+                'col':self.col,
+                'bookmarks':self.bookmarks.lines(),
+                'line_endings':self.line_endings}
+
+    def restore_state(self,state):
+        'Keep the state from a session until the file has been loaded'
+        self.pending_state = state
+
+    def apply_pending_state(self):
+        state = self.pending_state
+        if state is None:
+            return
+        self.pending_state = None
+        if not sum(self.line_ending_counts.values()):
+            # the file doesn't say what its line endings are
+            self.line_endings = state.get('line_endings',self.line_endings)
+        for line in state.get('bookmarks',[]):
+            self.bookmarks.toggle(line)
+        line = state.get('line',0)
+        self.goto_line(line)
+        if not self.viewer:
+            textiter = self.textbuffer.get_iter_at_line(line)
+            if textiter.get_chars_in_line() > state.get('col',0):
+                textiter.set_line_offset(state.get('col',0))
+                self.textbuffer.place_cursor(textiter)
         self.update_statusbar()
-        self.textview.set_sensitive(True)
+
+    def run_transform(self,pattern,replacement,message,on_done=None):
+        '''
+        Replace every match of pattern in the buffer, in the background.
+        Does nothing if the tab is read-only or a transform is already running.
+        '''
+        if self.is_read_only() or self.is_busy():
+            return
+        def done(transform):
+            self.transform = None
+            if on_done:
+                on_done(transform)
+        self.transform = Transform(self,pattern,replacement,message,done)
+        self.transform.start()
+
+    def replace_tabs(self):
+        self.run_transform(compile_pattern(u'\t'),u'    ','Replacing tabs')
+
+    def convert_line_endings(self,line_endings):
+        'Make every line end the same way, one of unix, dos or mac'
+        # every kind of line ending, ones already right are left alone
+        pattern = compile_pattern(u'\r\n?|\n',regex=True)
+        replacement = LINE_ENDINGS[line_endings]
+        def done(transform):
+            self.line_endings = line_endings
+            self.line_ending_counts = {}
+            self.update_statusbar()
+        self.run_transform(pattern,replacement,
+                           'Converting line endings to %s' % line_endings,done)
 
 
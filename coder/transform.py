@@ -0,0 +1,94 @@
+'''
+Copyright 2010 John Murphy
+This file is part of Coder.
+
+Coder is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+Coder is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with Coder.  If not, see <http://www.gnu.org/licenses/>.
+'''
+
+import time
+import gobject
+
+from search import replace_all
+from instrument import wrap
+
+class Transform(object):
+    '''
+    Replaces every match of a pattern over a whole Tab's buffer, a chunk
+    of whole lines at a time in idle time, so a big file doesn't freeze
+    the window or get copied out all at once.
+    Only the matches that change are rewritten, see search.replace_all.
+    The whole run is one user action, so it undoes in one step, and
+    the view is read-only until it's done.
+    Matches are assumed not to span lines.
+    '''
+
+    chunk_chars = 256 * 1024
+    idle_time = 0.02 # seconds spent replacing per idle callback
+
+    def __init__(self,tab,pattern,replacement,message,on_done=None):
+        self.tab = tab
+        self.pattern = pattern
+        self.replacement = replacement
+        self.message = message
+        self.on_done = on_done
+        self.count = 0
+        self.idle_id = None
+        self.textview = tab.get_textview()
+        self.textbuffer = self.textview.get_buffer()
+
+    def start(self):
+        buf = self.textbuffer
+        self.textview.set_editable(False)
+        buf.begin_user_action()
+        # where the next chunk starts, left gravity keeps it
+        # in front of text inserted there
+        self.position = buf.create_mark(None,buf.get_start_iter(),True)
+        self.chunk_end = buf.create_mark(None,buf.get_start_iter(),False)
+        self.idle_id = gobject.idle_add(wrap('Transform.step',self.step))
+
+    def step(self):
+        buf = self.textbuffer
+        start_time = time.time()
+        while time.time() - start_time < self.idle_time:
+            start = buf.get_iter_at_mark(self.position)
+            if start.is_end():
+                self.finish()
+                return False
+            end = start.copy()
+            end.forward_chars(self.chunk_chars)
+            if not end.starts_line():
+                end.forward_line()
+            buf.move_mark(self.chunk_end,end)
+            self.count += replace_all(buf,self.pattern,self.replacement,False,start,end)
+            buf.move_mark(self.position,buf.get_iter_at_mark(self.chunk_end))
+        position = buf.get_iter_at_mark(self.position).get_offset()
+        self.tab.show_progress(self.message,float(position)/max(1,buf.get_char_count()))
+        return True
+
+    def cancel(self):
+        'Stop where it is, what has been replaced so far stays replaced'
+        if self.idle_id:
+            gobject.source_remove(self.idle_id)
+            self.finish()
+
+    def finish(self):
+        self.idle_id = None
+        buf = self.textbuffer
+        buf.delete_mark(self.position)
+        buf.delete_mark(self.chunk_end)
+        buf.end_user_action()
+        self.textview.set_editable(True)
+        self.tab.hide_progress()
+        if self.on_done:
+            self.on_done(self)
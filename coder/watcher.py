@@ -0,0 +1,270 @@
+'''
+Copyright 2010 John Murphy
+This file is part of Coder.
+
+Coder is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+Coder is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with Coder.  If not, see <http://www.gnu.org/licenses/>.
+'''
+
+import os
+import sys
+import errno
+import fcntl
+import select
+import struct
+import hashlib
+import threading
+import ctypes
+import ctypes.util
+import gobject
+
+from instrument import wrap
+
+# from <sys/inotify.h>
+IN_MODIFY = 0x00000002
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_CLOEXEC = 02000000
+
+# a file being written, replaced by a rename, created or deleted
+WATCH_MASK = (IN_MODIFY | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO |
+              IN_CREATE | IN_DELETE | IN_DELETE_SELF | IN_ONLYDIR)
+EVENT_HEADER = struct.Struct('iIII')
+
+HASH_CHUNK = 1024 * 1024
+
+def file_signature(f):
+    '''
+    (size,mtime,sha1) of an open file, read from where it is to the end.
+    The loader and saver work out the same thing as they go instead.
+    '''
+    stat = os.fstat(f.fileno())
+    sha = hashlib.sha1()
+    while True:
+        data = f.read(HASH_CHUNK)
+        if not data:
+            break
+        sha.update(data)
+    return (stat.st_size,stat.st_mtime,sha.hexdigest())
+
+def verify(filename,signature):
+    '''
+    Has the file really changed since signature was taken?
+    Returns ('same'|'changed'|'deleted',new_signature).
+    The size and mtime are checked first. A new size means it changed,
+    a new mtime alone means hashing the contents, so a touched file
+    doesn't count as changed.
+    '''
+    try:
+        f = open(filename,'rb')
+    except IOError:
+        return 'deleted',None
+    try:
+        stat = os.fstat(f.fileno())
+        if signature and (stat.st_size,stat.st_mtime) == tuple(signature[:2]):
+            return 'same',signature
+        if signature and stat.st_size != signature[0]:
+            return 'changed',(stat.st_size,stat.st_mtime,None)
+        new_signature = file_signature(f)
+    finally:
+        f.close()
+    if signature and new_signature[2] == signature[2]:
+        return 'same',new_signature
+    return 'changed',new_signature
+
+def load_inotify():
+    'libc, if it has inotify, otherwise None'
+    if not sys.platform.startswith('linux'):
+        return None
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library('c'),use_errno=True)
+        libc.inotify_init1
+    except (OSError,AttributeError):
+        return None
+    libc.inotify_add_watch.argtypes = [ctypes.c_int,ctypes.c_char_p,ctypes.c_uint32]
+    libc.inotify_rm_watch.argtypes = [ctypes.c_int,ctypes.c_int]
+    return libc
+
+class Watcher(object):
+    '''
+    Watches the folders holding open files with inotify, on a thread.
+    Folders rather than files are watched so a file that's replaced by
+    renaming another over it is still noticed. When watched files change
+    on_change is called on the main loop with the set of their real paths.
+    Nothing checks whether they really changed, that's up to verify().
+    Without inotify nothing is watched and available() is False.
+    '''
+
+    read_size = 64 * 1024
+
+    def __init__(self,on_change):
+        self.on_change = on_change
+        self.libc = load_inotify()
+        self.fd = -1
+        self.thread = None
+        # written to by stop to wake the thread, closing the inotify
+        # descriptor doesn't interrupt a read that's blocked on it
+        self.wake_fds = None
+        self.lock = threading.Lock()
+        self.files = {} # real path -> number of tabs with it open
+        self.folders = {} # folder -> watch descriptor
+        self.watches = {} # watch descriptor -> folder
+        self.changed = set()
+        self.scheduled = False
+
+    def available(self):
+        return self.fd >= 0
+
+    def start(self):
+        if not self.libc:
+            return
+        self.fd = self.libc.inotify_init1(IN_CLOEXEC)
+        if self.fd < 0:
+            print("Couldn't start watching files: %s" % os.strerror(ctypes.get_errno()))
+            return
+        self.wake_fds = os.pipe()
+        for fd in self.wake_fds:
+            fcntl.fcntl(fd,fcntl.F_SETFD,fcntl.fcntl(fd,fcntl.F_GETFD) | fcntl.FD_CLOEXEC)
+        self.thread = threading.Thread(target=self.read_events,args=(self.fd,self.wake_fds[0]))
+        self.thread.daemon = True
+        self.thread.start()
+
+    def stop(self):
+        'Stop the thread, the descriptors are only closed once it has finished with them'
+        if self.fd < 0:
+            return
+        fd = self.fd
+        self.fd = -1
+        os.write(self.wake_fds[1],'x')
+        self.thread.join()
+        self.thread = None
+        os.close(fd)
+        for wake_fd in self.wake_fds:
+            os.close(wake_fd)
+        self.wake_fds = None
+
+    def watch(self,filename):
+        if not self.available():
+            return
+        path = os.path.realpath(filename)
+        folder = os.path.dirname(path)
+        self.lock.acquire()
+        try:
+            self.files[path] = self.files.get(path,0) + 1
+            if folder not in self.folders:
+                wd = self.libc.inotify_add_watch(self.fd,folder,WATCH_MASK)
+                if wd < 0:
+                    print("Couldn't watch %s: %s" % (folder,os.strerror(ctypes.get_errno())))
+                    return
+                self.folders[folder] = wd
+                self.watches[wd] = folder
+        finally:
+            self.lock.release()
+
+    def unwatch(self,filename):
+        if not self.available():
+            return
+        path = os.path.realpath(filename)
+        folder = os.path.dirname(path)
+        self.lock.acquire()
+        try:
+            count = self.files.get(path,0) - 1
+            if count > 0:
+                self.files[path] = count
+                return
+            self.files.pop(path,None)
+            for other in self.files:
+                if os.path.dirname(other) == folder:
+                    return
+            wd = self.folders.pop(folder,None)
+            if wd is not None:
+                del self.watches[wd]
+                self.libc.inotify_rm_watch(self.fd,wd)
+        finally:
+            self.lock.release()
+
+    def read_events(self,fd,wake_fd):
+        'Runs on the thread until stop wakes it'
+        while True:
+            try:
+                ready = select.select([fd,wake_fd],[],[])[0]
+            except select.error as e:
+                if e.args[0] == errno.EINTR:
+                    continue
+                return
+            if wake_fd in ready:
+                return
+            try:
+                data = os.read(fd,self.read_size)
+            except OSError as e:
+                if e.errno == errno.EINTR:
+                    continue
+                return
+            if not data:
+                return
+            changed = set()
+            offset = 0
+            self.lock.acquire()
+            try:
+                while offset + EVENT_HEADER.size <= len(data):
+                    wd,mask,cookie,length = EVENT_HEADER.unpack_from(data,offset)
+                    offset += EVENT_HEADER.size
+                    name = data[offset:offset+length].rstrip('\0')
+                    offset += length
+                    if mask & IN_Q_OVERFLOW:
+                        # events were lost, any file might have changed
+                        changed.update(self.files)
+                    elif wd in self.watches:
+                        path = os.path.join(self.watches[wd],name)
+                        if path in self.files:
+                            changed.add(path)
+                        if mask & IN_IGNORED:
+                            # the folder went away
+                            folder = self.watches.pop(wd)
+                            self.folders.pop(folder,None)
+                schedule = changed and not self.scheduled
+                if changed:
+                    self.changed.update(changed)
+                    self.scheduled = True
+            finally:
+                self.lock.release()
+            if schedule:
+                gobject.idle_add(wrap('Watcher.deliver',self.deliver))
+
+    def deliver(self):
+        'Runs on the main loop'
+        self.lock.acquire()
+        try:
+            changed = self.changed
+            self.changed = set()
+            self.scheduled = False
+        finally:
+            self.lock.release()
+        self.on_change(changed)
+        return False
+
+def verify_in_background(filename,signature,on_done):
+    'Run verify on a thread and call on_done(result,signature) on the main loop'
+    def run():
+        result,new_signature = verify(filename,signature)
+        gobject.idle_add(lambda:on_done(result,new_signature) and False)
+    thread = threading.Thread(target=run)
+    thread.daemon = True
+    thread.start()